@@ -29,6 +29,7 @@ setup(
     package_data={
         'simple_idml.indesign': [
             'scripts/*.jsx',
+            'scripts/*.jsxinc',
         ]
     },
     data_files=[],
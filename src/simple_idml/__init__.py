@@ -8,3 +8,9 @@ BACKINGSTORY = "XML/BackingStory.xml"
 SETCONTENT_TAG = "simpleidml-setcontent"
 IGNORECONTENT_TAG = "simpleidml-ignorecontent"
 FORCECONTENT_TAG = "simpleidml-forcecontent"
+
+# Serialization policies of the XML files (see IDMLPackage.serialization).
+SERIALIZATION_PRETTY = "pretty"
+SERIALIZATION_COMPACT = "compact"
+SERIALIZATION_PRESERVE = "preserve"
+SERIALIZATIONS = (SERIALIZATION_PRETTY, SERIALIZATION_COMPACT, SERIALIZATION_PRESERVE)
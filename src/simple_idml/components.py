@@ -2,13 +2,15 @@
 
 import copy
 import datetime
+import hashlib
 import os
 import re
 from decimal import Decimal
 from lxml import etree
-from simple_idml import IdPkgNS, BACKINGSTORY
+from simple_idml import IdPkgNS, BACKINGSTORY, SERIALIZATION_COMPACT, SERIALIZATION_PRETTY
+from simple_idml.decorators import modifies_dom
 from simple_idml.utils import increment_xmltag_id, prefix_content_filename, deepcopy_element_as
-from simple_idml.utils import Proxy
+from simple_idml.utils import Proxy, get_xml_parser
 
 RECTO = "recto"
 VERSO = "verso"
@@ -16,6 +18,10 @@ VERSO = "verso"
 rx_node_name_from_xml_name = re.compile(r"[\w]+/[\w]+_([\w]+)\.xml")
 
 
+def get_dom_fingerprint(dom):
+    return hashlib.blake2b(etree.tostring(dom), digest_size=16).digest()
+
+
 class IDMLXMLFile():
     """Abstract class for various XML files found in IDML Packages. """
     name = None
@@ -55,16 +61,34 @@ class IDMLXMLFile():
         'ParagraphShadingColor',
         'ParagraphBorderColor',
     )
+    # Options of the etree.XMLParser (e.g. `remove_blank_text', `collect_ids').
+    parser_options = {"huge_tree": True}
+    # The DOM may be dropped when the package has a parsing budget (see IDMLPackage.use_component_dom).
+    evictable = False
 
     def __init__(self, idml_package, working_copy_path=None):
         self.idml_package = idml_package
         self.working_copy_path = working_copy_path
         self._fobj = None
         self._dom = None
+        # Modified but not written yet.
+        self.dirty = False
+        # The DOM differs from the file (see mark_modified()).
+        self.modified = False
+        self.parsed_bytes = 0
+        self._evicted = False
+        # Digest of the DOM when it was handed out for writing (see is_modified()).
+        self._fingerprint = None
 
     def __repr__(self):
         return f"<{self.__class__.__name__} object {self.name} at {hex(id(self))}>"
 
+    @property
+    def serialization(self):
+        if self.idml_package is None:
+            return SERIALIZATION_PRETTY
+        return self.idml_package.serialization
+
     @property
     def fobj(self):
         if self._fobj is None:
@@ -78,25 +102,74 @@ class IDMLXMLFile():
 
     @property
     def dom(self):
-        if self._dom is None:
-            xml = self.fobj.read()
-            try:
-                dom = etree.fromstring(xml, parser=etree.XMLParser(huge_tree=True))
-            except ValueError:
-                # Python3: when the fobj come from Story.create()
-                # it is strictly a textfile that cannot be implicitly
-                # read as a bytestring (required by etree.fromstring()).
-                dom = etree.fromstring(xml.encode('utf-8'))
-            self._dom = dom
-            self._fobj.close()
-            self._fobj = None
-        return self._dom
+        return self.get_dom()
+
+    def get_dom(self, readonly=False):
+        """Any access to the DOM may modify it in place, unless it is `readonly'. """
+        # Another thread may evict it once registered.
+        dom = self._dom
+        if dom is None:
+            dom = self._dom = self._parse_dom()
+            if self._evicted:
+                self._evicted = False
+                self.idml_package.count_reparse()
+        if self.evictable and self.idml_package is not None and self.idml_package.has_parsing_budget:
+            if not readonly and not self.modified and self._fingerprint is None:
+                self._fingerprint = get_dom_fingerprint(dom)
+            self.idml_package.use_component_dom(self)
+        return dom
+
+    def mark_modified(self):
+        """The DOM differs from the file: it is kept until written. """
+        self.modified = True
+
+    def is_modified(self):
+        """The DOM differs from the file: marked so (see mark_modified()) or changed in place since
+        it was handed out for writing. """
+        if self.dirty or self.modified:
+            return True
+        dom = self._dom
+        if self._fingerprint is not None and dom is not None and get_dom_fingerprint(dom) != self._fingerprint:
+            self.modified = True
+        return self.modified
+
+    def _parse_dom(self):
+        if self.idml_package is not None:
+            dom = self.idml_package.pop_preloaded_dom(self.name)
+            if dom is not None:
+                return dom
+        # Parsed from the stream, the file is never entirely in memory.
+        parser = self.get_parser(self.serialization)
+        try:
+            dom = etree.parse(self.fobj, parser=parser).getroot()
+        except ValueError:
+            # An in-memory text stream with an encoding declaration
+            # must be given as a bytestring.
+            self.fobj.seek(0)
+            dom = etree.fromstring(self.fobj.read().encode('utf-8'), parser=parser)
+        self._fobj.close()
+        self._fobj = None
+        return dom
+
+    @classmethod
+    def get_parser(cls, serialization):
+        """The parser of the current thread for the files of this class. """
+        parser_options = cls.parser_options
+        if serialization == SERIALIZATION_COMPACT:
+            parser_options = dict(parser_options, remove_blank_text=True)
+        return get_xml_parser(**parser_options)
+
+    def evict_dom(self):
+        """Drop the DOM (and what refers to it), it is parsed again on the next access. """
+        self._dom = None
+        self._evicted = True
+        self._fingerprint = None
 
     def tostring(self):
         kwargs = {"xml_declaration": True,
                   "encoding": "UTF-8",
                   "standalone": True,
-                  "pretty_print": True}
+                  "pretty_print": self.serialization == SERIALIZATION_PRETTY}
 
         if etree.LXML_VERSION < (2, 3):
             strn = etree.tostring(self.dom, **kwargs)
@@ -118,12 +191,26 @@ class IDMLXMLFile():
         self.fobj.close()
         self._fobj = None
 
+        # A shared component is written once, when the sharing ends.
+        if self.idml_package.is_shared_component(self):
+            self.dirty = True
+            return
+        self.write()
+
+    def write(self):
         # Must instanciate with a working_copy to use this.
         with open(os.path.join(self.working_copy_path, self.name), mode="wb+") as fobj:
             fobj.write(self.tostring())
-
-    def get_element_by_id(self, value, tag="XMLElement", attr="Self"):
-        elem = self.dom.xpath(f"//{tag}[@{attr}='{value}']")
+        if self.idml_package is not None and self.idml_package.working_copy_path == self.working_copy_path:
+            self.idml_package.register_member(self.name)
+        self.dirty = False
+        self.modified = False
+        if self._fingerprint is not None:
+            # The DOM may still be changed in place by whoever holds it.
+            self._fingerprint = get_dom_fingerprint(self._dom)
+
+    def get_element_by_id(self, value, tag="XMLElement", attr="Self", readonly=False):
+        elem = self.get_dom(readonly).xpath(f"//{tag}[@{attr}='{value}']")
         # etree FutureWarning when trying to simply do: elem = len(elem) and elem[0] or None
         if len(elem):
             elem = elem[0]
@@ -133,6 +220,17 @@ class IDMLXMLFile():
             elem = None
         return elem
 
+    def get_elements_by_id(self, attr="Self"):
+        """All the etree.Element of the file indexed by `attr' (the first one in document order
+        wins, like get_element_by_id(tag="*")). """
+        elements = {}
+        for elt in self.dom.iter(tag=etree.Element):
+            value = elt.get(attr)
+            if value is not None:
+                elements.setdefault(value, elt)
+        return elements
+
+    @modifies_dom
     def prefix_references(self, prefix):
         """Update references inside various XML files found in an IDML package
            after a call to prefix()."""
@@ -142,16 +240,21 @@ class IDMLXMLFile():
         # <[TextFrame|...] Self="uca" ParentStory="u102" ...>
         # <CharacterStyleRange AppliedCharacterStyle="CharacterStyle/$ID/[No character style]"
         #  PointSize="10" />
-        for elt in self.dom.iter():
-            if elt.tag in self.excluded_tags_for_prefix:
+        # Each attribute of an element is looked up once in a set.
+        excluded_tags = frozenset(self.excluded_tags_for_prefix)
+        prefixable_content_tags = frozenset(self.prefixable_content_tags)
+        prefixable_attrs = frozenset(self.prefixable_attrs)
+        for elt in self.dom.iter(tag=etree.Element):
+            if elt.tag in excluded_tags:
                 continue
-            if elt.tag in self.prefixable_content_tags and elt.text:
+            if elt.tag in prefixable_content_tags and elt.text:
                 elt.text = f"{prefix}{elt.text}"
-            for attr in self.prefixable_attrs:
-                if elt.get(attr):
-                    if attr in ['NextTextFrame', 'PreviousTextFrame'] and elt.get(attr) == 'n':
+            attrib = elt.attrib
+            for attr, value in attrib.items():
+                if attr in prefixable_attrs and value:
+                    if attr in ('NextTextFrame', 'PreviousTextFrame') and value == 'n':
                         continue
-                    elt.set(attr, f"{prefix}{elt.get(attr)}")
+                    attrib[attr] = f"{prefix}{value}"
 
         # <idPkg:Spread src="Spreads/Spread_ub6.xml"/>
         # <idPkg:Story src="Stories/Story_u139.xml"/>
@@ -166,29 +269,41 @@ class IDMLXMLFile():
         if elt and elt[0].get("StoryList"):
             elt[0].set("StoryList", " ".join([f"{prefix}{s}" for s in elt[0].get("StoryList").split(" ")]))
 
+    @modifies_dom
     def set_element_resource_path(self, element_id, resource_path, synchronize=False):
         """ For Spread and Story subclasses only (this comment is a call for a Mixin). """
         # the element may not be an <XMLElement> (so tag="*").
         elt = self.get_element_by_id(element_id, tag="*")
         if elt is None:
             return
+        if self.set_elt_resource_path(elt, resource_path) and synchronize:
+            self.synchronize()
+
+    @modifies_dom
+    def set_elt_resource_path(self, elt, resource_path):
+        """Like set_element_resource_path() when the element is already known.
+        Return True if a <Link> was updated. """
         link = elt.find("Link")
-        if link is not None:
-            link.set("LinkResourceURI", resource_path)
-            if synchronize:
-                self.synchronize()
+        if link is None:
+            return False
+        link.set("LinkResourceURI", resource_path)
+        return True
 
+    @modifies_dom
     def remove_xml_element_page_items(self, element_id, synchronize=False):
         """Page items are sometimes in Stories rather in Spread. """
-        elt = self.get_element_by_id(element_id)
+        self.remove_elt_page_items(self.get_element_by_id(element_id))
+        if synchronize:
+            self.synchronize()
+
+    @modifies_dom
+    def remove_elt_page_items(self, elt):
         if elt.get("NoTextMarker"):
             elt.attrib.pop("NoTextMarker")
         if elt.get("XMLContent"):
             elt.attrib.pop("XMLContent")
         for child in elt.iterchildren():
             elt.remove(child)
-        if synchronize:
-            self.synchronize()
 
 
 class MasterSpread(IDMLXMLFile):
@@ -222,6 +337,7 @@ class Spread(IDMLXMLFile):
                         |
                         ˇ +Y
     """
+    evictable = True
 
     def __init__(self, idml_package, name, working_copy_path=None):
         super().__init__(idml_package, working_copy_path)
@@ -229,6 +345,11 @@ class Spread(IDMLXMLFile):
         self._pages = None
         self._node = None
 
+    def evict_dom(self):
+        super().evict_dom()
+        self._pages = None
+        self._node = None
+
     @property
     def pages(self):
         if self._pages is None:
@@ -243,6 +364,7 @@ class Spread(IDMLXMLFile):
             self._node = node
         return self._node
 
+    @modifies_dom
     def add_page(self, page):
         """ Spread only manage 2 pages. """
         if self.pages:
@@ -271,6 +393,7 @@ class Spread(IDMLXMLFile):
                                 if item.get("Self") in items_references]
         last_page.set_face(face_required)
 
+    @modifies_dom
     def clear(self):
         items = list(self.node.items())
         self.node.clear()
@@ -282,6 +405,7 @@ class Spread(IDMLXMLFile):
     def get_node_name_from_xml_name(self):
         return rx_node_name_from_xml_name.match(self.name).groups()[0]
 
+    @modifies_dom
     def set_layer_references(self, layer_id):
         for elt in self.dom.iter():
             if elt.get("ItemLayer"):
@@ -295,12 +419,14 @@ class Spread(IDMLXMLFile):
     def has_any_guide_on_layer(self, layer_id):
         return bool(len(self.node.xpath(f".//Guide[@ItemLayer='{layer_id}']")))
 
+    @modifies_dom
     def remove_guides_on_layer(self, layer_id, synchronize=False):
         for guide in self.node.xpath(f".//Guide[@ItemLayer='{layer_id}']"):
             guide.getparent().remove(guide)
         if synchronize:
             self.synchronize()
 
+    @modifies_dom
     def remove_page_item(self, item_id, synchronize=False):
         # etree FutureWarning when trying to simply do: elt = foo() or bar().
         elt = self.get_element_by_id(item_id, tag="*")
@@ -310,6 +436,7 @@ class Spread(IDMLXMLFile):
         if synchronize:
             self.synchronize()
 
+    @modifies_dom
     def rectangle_to_textframe(self, rectangle):
         textframe = deepcopy_element_as(rectangle, "TextFrame")
         textframe.set("ContentType", "TextType")
@@ -331,12 +458,18 @@ STORIES_DIRNAME = "Stories"
 
 
 class Story(IDMLXMLFile):
+    evictable = True
+
     def __init__(self, idml_package, name, working_copy_path=None):
         super().__init__(idml_package, working_copy_path)
         self.name = name
         self.node_name = "Story"
         self._node = None
 
+    def evict_dom(self):
+        super().evict_dom()
+        self._node = None
+
     @classmethod
     def create(cls, idml_package, story_id, xml_element_id, xml_element_tag, working_copy_path):
         dirname = os.path.join(working_copy_path, STORIES_DIRNAME)
@@ -349,6 +482,8 @@ class Story(IDMLXMLFile):
         # to create a unexisting file.
         filename = os.path.join(working_copy_path, story_name)
         story._fobj = open(filename, mode="w+")
+        if idml_package is not None:
+            idml_package.register_member(story_name)
         story.fobj.write(
             f"""<?xml version='1.0' encoding='UTF-8' standalone='yes'?>
    <idPkg:Story xmlns:idPkg="http://ns.adobe.com/AdobeInDesign/idml/1.0/packaging" DOMVersion="7.5">
@@ -371,13 +506,19 @@ class Story(IDMLXMLFile):
             self._node = node
         return self._node
 
+    @modifies_dom
     def set_element_attributes(self, element_id, attrs):
         element = self.get_element_by_id(element_id)
         element.set_attributes(attrs)
 
+    @modifies_dom
     def set_element_content(self, element_id, content):
-        self.clear_element_content(element_id)
-        xml_element = self.get_element_by_id(element_id)
+        self.set_xml_element_content(self.get_element_by_id(element_id), content)
+
+    @modifies_dom
+    def set_xml_element_content(self, xml_element, content):
+        """Like set_element_content() when the XMLElement is already known. """
+        self.clear_xml_element_content(xml_element)
         xml_element.set_content(content)
         self._fix_siblings_style(xml_element)
 
@@ -399,8 +540,12 @@ class Story(IDMLXMLFile):
             local_style.append(sibling)
         xml_element.addnext(local_style)
 
+    @modifies_dom
     def clear_element_content(self, element_id):
-        element = self.get_element_by_id(element_id)
+        self.clear_xml_element_content(self.get_element_by_id(element_id))
+
+    @modifies_dom
+    def clear_xml_element_content(self, element):
         # We remove all `CharacterStyleRange' containers except the first.
         # FIXME: This should handle ./ParagraphStyleRange/CharacterStyleRange too.
         children = element.xpath("./CharacterStyleRange")[1:]
@@ -409,6 +554,10 @@ class Story(IDMLXMLFile):
         for content_node in self.get_element_content_nodes(element):
             content_node.text = ""
 
+    def get_xml_elements_by_id(self):
+        """All the XMLElement of the story indexed by their `Self' attribute. """
+        return {elt.get("Self"): elt for elt in self.dom.iter("XMLElement")}
+
     def get_element_content_nodes(self, element):
         return element.xpath(("./ParagraphStyleRange/CharacterStyleRange/Content | "
                               "./CharacterStyleRange/Content | "
@@ -424,6 +573,7 @@ class Story(IDMLXMLFile):
                               "./XMLElement | "
                               "./Content"))
 
+    @modifies_dom
     def set_element_id(self, element):
         ref_element = list(element.itersiblings(tag="XMLElement", preceding=True))
         if ref_element:
@@ -438,12 +588,14 @@ class Story(IDMLXMLFile):
             position = "child"
         element.set("Self", increment_xmltag_id(ref_element.get("Self"), position))
 
+    @modifies_dom
     def remove_element(self, element_id, synchronize=False):
         elt = self.get_element_by_id(element_id).element
         elt.getparent().remove(elt)
         if synchronize:
             self.synchronize()
 
+    @modifies_dom
     def remove_children(self, element_id, keep_style=False, synchronize=False):
         elt = self.get_element_by_id(element_id).element
 
@@ -454,16 +606,19 @@ class Story(IDMLXMLFile):
         if synchronize:
             self.synchronize()
 
+    @modifies_dom
     def add_element(self, element_destination_id, element):
         node = self.get_element_by_id(element_destination_id)
         node.append(element)
         self.set_element_id(element)
 
+    @modifies_dom
     def add_content_to_element(self, element_id, content, parent=None):
         element = self.get_element_by_id(element_id)
         xml_element = XMLElement(element=element)
         xml_element.add_content(content, parent)
 
+    @modifies_dom
     def add_note(self, element_id, note, author, when=None):
         element = self.get_element_by_id(element_id)
         when = when or datetime.datetime.now().replace(microsecond=0)
@@ -628,8 +783,25 @@ class Designmap(IDMLXMLFile):
 class Style(IDMLXMLFile):
     name = "Resources/Styles.xml"
 
+    def __init__(self, idml_package, working_copy_path=None):
+        super().__init__(idml_package, working_copy_path)
+        self._character_style_nodes = None
+
+    @property
+    def character_style_nodes(self):
+        """The <CharacterStyle> nodes indexed by their `Self' attribute. """
+        if self._character_style_nodes is None:
+            nodes = {}
+            for node in self.dom.iter("CharacterStyle"):
+                nodes.setdefault(node.get("Self"), node)
+            self._character_style_nodes = nodes
+        return self._character_style_nodes
+
     def get_style_node_by_name(self, style_name):
-        return self.dom.xpath(f".//CharacterStyle[@Self='{style_name}']")[0]
+        try:
+            return self.character_style_nodes[style_name]
+        except KeyError as exc:
+            raise IndexError(f"No CharacterStyle named '{style_name}'.") from exc
 
     def style_groups(self):
         """ Groups are `RootCharacterStyleGroup', `RootParagraphStyleGroup' etc. """
@@ -664,11 +836,9 @@ class StyleMapping(IDMLXMLFile):
     @property
     def dom(self):
         """Overriden because it may not exists in the package. """
-        try:
-            super().dom
-        except AttributeError:
+        if self._dom is None and self.fobj is None:
             self._dom = etree.fromstring(self.initial_dom.encode("utf-8"))
-        return self._dom
+        return super().dom
 
     @property
     def character_style_mapping(self):
@@ -684,6 +854,7 @@ class StyleMapping(IDMLXMLFile):
     def _initialize_fobj(self):
         filename = os.path.join(self.working_copy_path, self.name)
         fobj = open(filename, mode="w+")
+        self.idml_package.register_member(self.name)
         fobj.write(self.initial_dom)
         fobj.seek(0)
         self._fobj = fobj
@@ -780,6 +951,7 @@ class Page():
     @geometric_bounds.setter
     def geometric_bounds(self, matrix):
         self.node.set("GeometricBounds", " ".join([str(v) for v in matrix]))
+        self.spread.mark_modified()
 
     @property
     def item_transform(self):
@@ -788,6 +960,7 @@ class Page():
     @item_transform.setter
     def item_transform(self, matrix):
         self.node.set("ItemTransform", " ".join([str(v) for v in matrix]))
+        self.spread.mark_modified()
 
     @property
     def coordinates(self):
@@ -826,6 +999,7 @@ class Page():
     def set_face(self, face):
         if self.face == face:
             return
+        self.spread.mark_modified()
         item_transform = self.item_transform
         item_transform_x_origin = item_transform[4]
 
@@ -933,19 +1107,34 @@ class XMLElement(Proxy):
         if len(attr_node):
             return attr_node[0]
 
+    def _get_attribute_nodes(self):
+        """The <XMLAttribute> nodes indexed by name. """
+        attr_nodes = {}
+        for node in self.iterchildren("XMLAttribute"):
+            attr_nodes.setdefault(node.get("Name"), node)
+        return attr_nodes
+
+    def _add_attribute_node(self, name):
+        attr_node = etree.Element("XMLAttribute", Name=name, Self=f"{self.get('Self')}XMLAttributen{name}")
+        self.append(attr_node)
+        return attr_node
+
     def get_attributes(self):
         return {node.get("Name"): node.get("Value") for node in self.xpath("./XMLAttribute")}
 
     def set_attribute(self, name, value):
         attr_node = self._get_attribute_node(name)
         if attr_node is None:
-            attr_node = etree.Element("XMLAttribute", Name=name, Self=f"{self.get('Self')}XMLAttributen{name}")
-            self.append(attr_node)
+            attr_node = self._add_attribute_node(name)
         attr_node.set("Value", value)
 
     def set_attributes(self, attributes):
+        attr_nodes = self._get_attribute_nodes()
         for name, value in attributes.items():
-            self.set_attribute(name, value)
+            attr_node = attr_nodes.get(name)
+            if attr_node is None:
+                attr_node = attr_nodes[name] = self._add_attribute_node(name)
+            attr_node.set("Value", value)
 
     def get_character_style_range(self):
         """The applied style may be contained or the container. """
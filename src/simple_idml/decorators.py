@@ -42,12 +42,15 @@ def use_working_copy(view_func):
 
         from simple_idml.idml import IDMLPackage  # pylint: disable=import-outside-toplevel
         # Create a new archive from the extracted one.
-        tmp_package = IDMLPackage(f"{tmp_filename}.idml", mode="w")
+        tmp_package = IDMLPackage(f"{tmp_filename}.idml", mode="w", workers=idml_package.workers,
+                                  compresslevel=idml_package.compresslevel)
+        members = []
         for root, dirs, filenames in os.walk(tmp_filename):
             for filename in filenames:
                 filename = os.path.join(root, filename)
                 arcname = filename.replace(tmp_filename, "")
-                tmp_package.write(filename, arcname)
+                members.append((filename, arcname))
+        tmp_package.write_members(members)
         tmp_package.close()
 
         # swap working_copy with initial IDML Package.
@@ -58,6 +61,35 @@ def use_working_copy(view_func):
         shutil.rmtree(tmp_filename)
         idml_package.working_copy_path = None
 
-        return IDMLPackage(new_filename)
+        return IDMLPackage(new_filename, **idml_package.get_options())
+
+    return new_func
+
+
+@simple_decorator
+def use_shared_components(view_func):
+    """The components (Stories, Spreads...) are shared by all the calls made in `view_func'
+    so each file is parsed once, and the modified ones are written once when it returns. """
+    def new_func(idml_package, *args, **kwargs):
+        if idml_package.shared_components is not None:
+            return view_func(idml_package, *args, **kwargs)
+
+        idml_package.shared_components = {}
+        try:
+            result = view_func(idml_package, *args, **kwargs)
+            idml_package.synchronize_components()
+        finally:
+            idml_package.shared_components = None
+        return result
+
+    return new_func
+
+
+@simple_decorator
+def modifies_dom(view_func):
+    """The method changes the DOM of the component: it is kept until written (see IDMLXMLFile.mark_modified). """
+    def new_func(idml_xml_file, *args, **kwargs):
+        idml_xml_file.mark_modified()
+        return view_func(idml_xml_file, *args, **kwargs)
 
     return new_func
@@ -4,16 +4,18 @@ import os
 from simple_idml.idml import IDMLPackage
 
 
-def create_idml_package_from_dir(src_dir, destination):
+def create_idml_package_from_dir(src_dir, destination, compresslevel=None, workers=None):
     if not os.path.exists(src_dir):
         raise IOError(f"{src_dir} does not exist.")
     if os.path.exists(destination):
         raise IOError(f"{destination} already exist.")
 
-    with IDMLPackage(destination, mode="w") as package:
+    with IDMLPackage(destination, mode="w", compresslevel=compresslevel, workers=workers) as package:
+        members = []
         for root, dirs, filenames in os.walk(src_dir):
             for filename in filenames:
                 if filename in ['.DS_Store']:
                     continue
-                package.write(os.path.join(root, filename),
-                              os.path.join(root.replace(src_dir, "."), filename))
+                members.append((os.path.join(root, filename),
+                                os.path.join(root.replace(src_dir, "."), filename)))
+        package.write_members(members)
@@ -2,148 +2,470 @@
 
 """A Wrapper over ftplib and filesystem operations. """
 
+import collections
+import concurrent.futures
 import ftplib
+import logging
 import os
-import shlex
 import shutil
 import socket
-import subprocess
 import tempfile
+import threading
+import time
 import uuid
 import zipfile
+import zlib
+from contextlib import contextmanager
 from io import BytesIO
 from pathlib import Path
 from tempfile import mkdtemp
 from zipfile import ZipFile
 
+from simple_idml.utils import run_blocking, zip_members
 
-def copy(src_filename, dst_filename, ftp_params=None, src_open_mode="rb"):
-    if not ftp_params:
+logger = logging.getLogger('simpleidml.ftp')
+logger.addHandler(logging.NullHandler())
+
+# The remote files larger than that are streamed in the zips rather than downloaded ahead.
+MAX_BUFFERED_SIZE = 8 * 1024 * 1024
+
+
+class Transport(object):
+    """Moves the files between the client and the working directory shared with the
+    InDesign Server. Paths are in the client working directory. """
+
+    def copy(self, src_filename, dst_filename, src_open_mode="rb"):
+        """Copy the local file `src_filename' in `dst_filename'. """
+        raise NotImplementedError
+
+    def write(self, filename, data):
+        raise NotImplementedError
+
+    def read(self, filename):
+        raise NotImplementedError
+
+    def unlink(self, filename):
+        raise NotImplementedError
+
+    def rmtree(self, tree):
+        raise NotImplementedError
+
+    def unpack_archive(self, filename, extract_dir=None, fmt='zip', workers=None, report=None):
+        """Unpack the local archive `filename' into `extract_dir'. """
+        raise NotImplementedError
+
+    def zip_dir(self, dirname, zip_filename, workers=None):
+        """Zip `dirname' in `zip_filename' and remove it. """
+        raise NotImplementedError
+
+    def mkdir_unique(self, directory):
+        """Create a sub-directory with a unique name in `directory' and return its path. """
+        raise NotImplementedError
+
+    async def copy_async(self, src_filename, dst_filename, src_open_mode="rb"):
+        await run_blocking(self.copy, src_filename, dst_filename, src_open_mode)
+
+    async def write_async(self, filename, data):
+        await run_blocking(self.write, filename, data)
+
+    async def read_async(self, filename):
+        return await run_blocking(self.read, filename)
+
+    async def unlink_async(self, filename):
+        await run_blocking(self.unlink, filename)
+
+    async def rmtree_async(self, tree):
+        await run_blocking(self.rmtree, tree)
+
+    async def unpack_archive_async(self, filename, extract_dir=None, fmt='zip', workers=None, report=None):
+        await run_blocking(self.unpack_archive, filename, extract_dir, fmt, workers, report)
+
+    async def zip_dir_async(self, dirname, zip_filename, workers=None):
+        await run_blocking(self.zip_dir, dirname, zip_filename, workers)
+
+    async def mkdir_unique_async(self, directory):
+        return await run_blocking(self.mkdir_unique, directory)
+
+
+class LocalTransport(Transport):
+    """The working directory is on a local or mounted filesystem. """
+
+    def copy(self, src_filename, dst_filename, src_open_mode="rb"):
         shutil.copy(src_filename, dst_filename)
-        return
 
-    with open(src_filename, src_open_mode) as fobj:
-        ftp = get_ftp(ftp_params)
-        command = f'STOR {dst_filename}'
-        try:
-            if "b" in src_open_mode:
-                ftp.storbinary(command, fobj)
-            else:  # python2 only. storlines in Python 3 requires binary mode as well.
-                ftp.storlines(command, fobj)
-        except:
-            print(f'Cannot {command}')
-            raise
-        finally:
-            close_ftp_conn(ftp, ftp_params)
+    def write(self, filename, data):
+        with open(filename, "wb") as fobj:
+            fobj.write(data)
+
+    def read(self, filename):
+        with open(filename, "rb") as fobj:
+            return fobj.read()
+
+    def unlink(self, filename):
+        os.unlink(filename)
 
+    def rmtree(self, tree):
+        shutil.rmtree(tree)
 
-def unpack_archive(filename, ftp_params=None, extract_dir=None, fmt='zip'):
-    if not ftp_params:
+    def unpack_archive(self, filename, extract_dir=None, fmt='zip', workers=None, report=None):
         shutil.unpack_archive(filename, extract_dir, fmt)
-        return
-    dirs_created = []
-    with ZipFile(filename) as archive:
-        for info in archive.infolist():
-            path = Path(info.filename)
-            if info.is_dir() or path.name.startswith('.'):
-                continue
 
-            rootdir = extract_dir
-            for part in path.parent.parts:
-                rootdir = os.path.join(rootdir, part)
-                if rootdir in dirs_created:
-                    continue
-                ftp = get_ftp(ftp_params)
-                ftp.mkd(rootdir)
-                dirs_created.append(rootdir)
-                close_ftp_conn(ftp, ftp_params)
+    def zip_dir(self, dirname, zip_filename, workers=None):
+        zip_tree(dirname, zip_filename, workers=workers)
+        shutil.rmtree(dirname)
+
+    def mkdir_unique(self, directory):
+        return tempfile.mkdtemp(dir=directory)
+
+
+class FTPTransport(Transport):
+    """The working directory is on an FTP server, reached with pooled connections (`ftp_pool'). """
 
-            with archive.open(info) as fobj:
-                ftp = get_ftp(ftp_params)
-                command = f'STOR {extract_dir}/{info.filename}'
-                try:
+    def __init__(self, ftp_params):
+        self.ftp_params = ftp_params
+
+    def copy(self, src_filename, dst_filename, src_open_mode="rb"):
+        with open(src_filename, src_open_mode) as fobj, ftp_pool.connection(self.ftp_params) as ftp:
+            command = f'STOR {dst_filename}'
+            try:
+                if "b" in src_open_mode:
                     ftp.storbinary(command, fobj)
-                except:
-                    print(f'Cannot {command}')
-                    raise
-                finally:
-                    close_ftp_conn(ftp, ftp_params)
+                else:  # python2 only. storlines in Python 3 requires binary mode as well.
+                    ftp.storlines(command, fobj)
+            except Exception:
+                logger.error('Cannot %s', command)
+                raise
 
+    def write(self, filename, data):
+        with BytesIO(data) as fobj, ftp_pool.connection(self.ftp_params) as ftp:
+            ftp.storbinary(f'STOR {filename}', fobj)
 
-def unlink(filename, ftp_params=None):
-    if not ftp_params:
-        os.unlink(filename)
-        return
-    ftp = get_ftp(ftp_params)
-    ftp.delete(filename)
-    close_ftp_conn(ftp, ftp_params)
+    def read(self, filename):
+        with BytesIO() as buf:
+            with ftp_pool.connection(self.ftp_params) as ftp:
+                ftp.retrbinary(f'RETR {filename}', buf.write)
+            return buf.getvalue()
+
+    def unlink(self, filename):
+        with ftp_pool.connection(self.ftp_params) as ftp:
+            ftp.delete(filename)
+
+    def rmtree(self, tree):
+        with ftp_pool.connection(self.ftp_params) as ftp:
+            rmtree_ftp(ftp, tree)
+
+    def unpack_archive(self, filename, extract_dir=None, fmt='zip', workers=None, report=None):
+        """The directories are created first and the members are uploaded in parallel over
+        `workers' pooled connections (the pool size by default). `report', if given, is filled with
+        the number of files and bytes uploaded, the duration and the throughput (bytes per second).
+        """
+        start = time.monotonic()
+        with ZipFile(filename) as archive:
+            infos = [info for info in archive.infolist()
+                     if not (info.is_dir() or Path(info.filename).name.startswith('.'))]
+
+            dirnames = set()
+            for info in infos:
+                rootdir = extract_dir
+                for part in Path(info.filename).parent.parts:
+                    rootdir = os.path.join(rootdir, part)
+                    dirnames.add(rootdir)
+            if dirnames:
+                with ftp_pool.connection(self.ftp_params) as ftp:
+                    # Parents first.
+                    for dirname in sorted(dirnames):
+                        ftp.mkd(dirname)
+
+            def upload(info):
+                with archive.open(info) as fobj, ftp_pool.connection(self.ftp_params) as ftp:
+                    command = f'STOR {extract_dir}/{info.filename}'
+                    try:
+                        ftp.storbinary(command, fobj)
+                    except Exception:
+                        logger.error('Cannot %s', command)
+                        raise
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers or ftp_pool.max_size) as executor:
+                for _ in executor.map(upload, infos):
+                    pass
+
+        if report is not None:
+            duration = time.monotonic() - start
+            size = sum(info.file_size for info in infos)
+            report.update({
+                "files": len(infos),
+                "bytes": size,
+                "seconds": duration,
+                "throughput": size / duration if duration else None,
+            })
+
+    def zip_dir(self, dirname, zip_filename, workers=None):
+        # Stream the remote files into a local zip, upload it
+        # and delete the remote tree from its listing.
+        tmp_dirname = mkdtemp()
+        tmp_zip_filename = os.path.join(tmp_dirname, os.path.basename(zip_filename))
 
+        with ftp_pool.connection(self.ftp_params) as ftp:
+            tree = list(walk_ftp(ftp, dirname))
+        zip_ftp_tree(tree, tmp_zip_filename, self.ftp_params, workers=workers)
+        self.copy(tmp_zip_filename, zip_filename)
+        shutil.rmtree(tmp_dirname)
+        with ftp_pool.connection(self.ftp_params) as ftp:
+            remove_ftp_tree(ftp, tree)
 
-def rmtree(tree, ftp_params=None):
-    if not ftp_params:
-        shutil.rmtree(tree)
-        return
-    ftp = get_ftp(ftp_params)
-    rmtree_ftp(ftp, tree)
-    close_ftp_conn(ftp, ftp_params)
+    def mkdir_unique(self, directory):
+        unique_path = os.path.join(directory, uuid.uuid1().hex)
+        with ftp_pool.connection(self.ftp_params) as ftp:
+            ftp.mkd(unique_path)
+        return unique_path
 
 
-def read(filename, ftp_params=None):
-    response = ""
+class MemoryTransport(Transport):
+    """The working directory is a dict of {path: content} (tests, benchmarks). """
 
-    if not ftp_params:
-        with open(filename, "rb") as fobj:
-            response = fobj.read()
-    else:
+    def __init__(self):
+        self.files = {}
+        self.dirs = set()
+        self.lock = threading.Lock()
+
+    def copy(self, src_filename, dst_filename, src_open_mode="rb"):
+        with open(src_filename, "rb") as fobj:
+            self.write(dst_filename, fobj.read())
+
+    def write(self, filename, data):
+        with self.lock:
+            self.files[filename] = data
+
+    def read(self, filename):
+        try:
+            return self.files[filename]
+        except KeyError:
+            raise FileNotFoundError(filename)
+
+    def unlink(self, filename):
+        with self.lock:
+            try:
+                del self.files[filename]
+            except KeyError:
+                raise FileNotFoundError(filename)
+
+    def makedirs(self, dirname):
+        with self.lock:
+            self.dirs.add(dirname)
+
+    def get_tree(self, tree):
+        prefix = os.path.join(tree, "")
+        with self.lock:
+            filenames = sorted(filename for filename in self.files if filename.startswith(prefix))
+            dirnames = sorted(dirname for dirname in self.dirs if dirname.startswith(prefix))
+        return filenames, dirnames
+
+    def rmtree(self, tree):
+        filenames, dirnames = self.get_tree(tree)
+        with self.lock:
+            for filename in filenames:
+                del self.files[filename]
+            self.dirs.difference_update(dirnames)
+            self.dirs.discard(tree)
+
+    def unpack_archive(self, filename, extract_dir=None, fmt='zip', workers=None, report=None):
+        with ZipFile(filename) as archive:
+            for info in archive.infolist():
+                path = os.path.join(extract_dir, info.filename.rstrip("/"))
+                if info.is_dir():
+                    self.makedirs(path)
+                else:
+                    self.write(path, archive.read(info))
+
+    def zip_dir(self, dirname, zip_filename, workers=None):
+        relroot = os.path.dirname(os.path.normpath(dirname))
+        filenames, dirnames = self.get_tree(dirname)
         with BytesIO() as buf:
-            ftp = get_ftp(ftp_params)
-            ftp.retrbinary(f'RETR {filename}', buf.write)
-            close_ftp_conn(ftp, ftp_params)
-            buf.seek(0)
-            response = buf.read()
+            with ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zfile:
+                for path in [dirname] + dirnames:
+                    # ZipFile.mkdir() is Python >= 3.11 only.
+                    zfile.writestr(get_ftp_zipinfo(os.path.relpath(path, relroot), {}, is_dir=True), b"")
+                for filename in filenames:
+                    zfile.writestr(os.path.relpath(filename, relroot), self.files[filename])
+            self.write(zip_filename, buf.getvalue())
+        self.rmtree(dirname)
+
+    def mkdir_unique(self, directory):
+        unique_path = os.path.join(directory, uuid.uuid1().hex)
+        self.makedirs(unique_path)
+        return unique_path
+
 
-    return response
+local_transport = LocalTransport()
 
 
-def zip_dir(dirname, zip_filename, ftp_params=None):
+def get_transport(ftp_params=None, transport=None):
+    """The `transport' if given, else the FTP or local one depending on `ftp_params'. """
+    if transport is not None:
+        return transport
     if ftp_params:
-        # Work locally in a temporary directory.
-        # and then upload the zip to the ftp.
-        tmp_dirname = mkdtemp()
-        tmp_zip_filename = os.path.join(tmp_dirname, os.path.basename(zip_filename))
+        return FTPTransport(ftp_params)
+    return local_transport
 
-        cmd = 'wget -r %(no_passive)s --ftp-user="%(user)s" --ftp-password="%(passwd)s" ftp://%(url)s/%(dirname)s -P %(dst)s -nH -nv' % {
-            'user': ftp_params['auth'][1],
-            'passwd': ftp_params['auth'][2],
-            'url': ftp_params['auth'][0],
-            'no_passive': ftp_params['passive'] and "" or "--no-passive-ftp",
-            'dirname': dirname,
-            'dst': tmp_dirname
-        }
-        proc = subprocess.Popen(shlex.split(cmd))
-        proc.wait()
-
-        zip_tree(os.path.join(tmp_dirname, dirname), tmp_zip_filename)
-        copy(tmp_zip_filename, zip_filename, ftp_params)
-        shutil.rmtree(tmp_dirname)
-        rmtree(dirname, ftp_params)
-    else:
-        zip_tree(dirname, zip_filename)
-        shutil.rmtree(dirname)
+
+def copy(src_filename, dst_filename, ftp_params=None, src_open_mode="rb"):
+    get_transport(ftp_params).copy(src_filename, dst_filename, src_open_mode)
+
+
+def unpack_archive(filename, ftp_params=None, extract_dir=None, fmt='zip', workers=None, report=None):
+    """Unpack the archive `filename' into `extract_dir'. See `FTPTransport.unpack_archive()'. """
+    get_transport(ftp_params).unpack_archive(filename, extract_dir, fmt, workers, report)
 
 
-def zip_tree(tree, destination):
+def unlink(filename, ftp_params=None):
+    get_transport(ftp_params).unlink(filename)
+
+
+def rmtree(tree, ftp_params=None):
+    get_transport(ftp_params).rmtree(tree)
+
+
+def read(filename, ftp_params=None):
+    return get_transport(ftp_params).read(filename)
+
+
+def zip_dir(dirname, zip_filename, ftp_params=None, workers=None):
+    get_transport(ftp_params).zip_dir(dirname, zip_filename, workers)
+
+
+def zip_tree(tree, destination, compresslevel=zlib.Z_DEFAULT_COMPRESSION, workers=None):
     # http://stackoverflow.com/a/17080988/113036
     relroot = os.path.abspath(os.path.join(tree, os.pardir))
+    members = []
+    for root, dirs, files in os.walk(tree):
+        # add directory (needed for empty dirs)
+        members.append((root, os.path.relpath(root, relroot)))
+        for file in files:
+            filename = os.path.join(root, file)
+            if os.path.isfile(filename):  # regular files only
+                arcname = os.path.join(os.path.relpath(root, relroot), file)
+                members.append((filename, arcname))
     with zipfile.ZipFile(destination, "w", zipfile.ZIP_DEFLATED) as zfile:
-        for root, dirs, files in os.walk(tree):
-            # add directory (needed for empty dirs)
-            zfile.write(root, os.path.relpath(root, relroot))
-            for file in files:
-                filename = os.path.join(root, file)
-                if os.path.isfile(filename):  # regular files only
-                    arcname = os.path.join(os.path.relpath(root, relroot), file)
-                    zfile.write(filename, arcname)
+        zip_members(zfile, members, compresslevel=compresslevel, workers=workers)
+
+
+def zip_ftp_tree(tree, destination, ftp_params, compresslevel=zlib.Z_DEFAULT_COMPRESSION, workers=None,
+                 max_buffered_size=MAX_BUFFERED_SIZE):
+    """Zip the remote `tree' (as listed by `walk_ftp()') in `destination'.
+
+    The files of at most `max_buffered_size' bytes are downloaded concurrently over `workers'
+    pooled connections and at most 2 * `workers' of them wait in memory. The larger ones, and
+    those of unknown size, are streamed in the zip when their turn comes (deflated at the
+    default level). The members are written in order, with no local copy of the tree.
+    """
+    relroot = os.path.dirname(os.path.normpath(tree[0][0])) if tree else ""
+
+    def download(filename):
+        with BytesIO() as buf, ftp_pool.connection(ftp_params) as ftp:
+            ftp.retrbinary(f'RETR {filename}', buf.write)
+            return buf.getvalue()
+
+    def stream(zinfo, filename):
+        # The size is not known beforehand (force_zip64).
+        with ftp_pool.connection(ftp_params) as ftp, zfile.open(zinfo, "w", force_zip64=True) as member:
+            ftp.retrbinary(f'RETR {filename}', member.write)
+
+    def write(zinfo, content):
+        if content is None:
+            # ZipFile.mkdir() is Python >= 3.11 only.
+            zfile.writestr(zinfo, b"")
+        elif isinstance(content, str):
+            stream(zinfo, content)
+        else:
+            zfile.writestr(zinfo, content.result(), compresslevel=compresslevel)
+
+    workers = workers or ftp_pool.max_size
+    # Bound the number of downloaded files waiting in memory.
+    max_pending = 2 * workers
+    pending = collections.deque()
+    with zipfile.ZipFile(destination, "w", zipfile.ZIP_DEFLATED) as zfile, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for dirpath, dirnames, filenames in tree:
+            pending.append((get_ftp_zipinfo(os.path.relpath(dirpath, relroot), {}, is_dir=True), None))
+            for name, facts in filenames:
+                filename = os.path.join(dirpath, name)
+                zinfo = get_ftp_zipinfo(os.path.relpath(filename, relroot), facts)
+                size = facts.get("size")
+                if size is not None and int(size) <= max_buffered_size:
+                    pending.append((zinfo, executor.submit(download, filename)))
+                else:
+                    pending.append((zinfo, filename))
+                while len(pending) > max_pending:
+                    write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+
+
+def get_ftp_zipinfo(arcname, facts, is_dir=False):
+    modify = facts.get("modify")
+    if modify:
+        date_time = time.strptime(modify[:14], "%Y%m%d%H%M%S")[:6]
+    else:
+        date_time = time.localtime()[:6]
+    if is_dir:
+        zinfo = zipfile.ZipInfo(f"{arcname}/", date_time)
+        zinfo.external_attr = 0o40775 << 16 | 0x10  # drwxrwxr-x and MS-DOS directory flag
+        zinfo.file_size = zinfo.compress_size = zinfo.CRC = 0
+    else:
+        zinfo = zipfile.ZipInfo(arcname, date_time)
+        zinfo.external_attr = 0o644 << 16
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    return zinfo
+
+
+def walk_ftp(ftp, top):
+    """Yield (dirpath, dirnames, filenames) for each directory of the remote tree `top',
+    like os.walk(). Names come with their MLSD facts ({} if the server does not support MLSD). """
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        dirnames, filenames = list_ftp_dir(ftp, dirpath)
+        yield dirpath, dirnames, filenames
+        stack.extend(os.path.join(dirpath, name) for name, facts in reversed(dirnames))
+
+
+def list_ftp_dir(ftp, path):
+    """Return the (name, facts) of the sub-directories and of the files of the remote `path'. """
+    dirnames, filenames = [], []
+    try:
+        entries = list(ftp.mlsd(path, facts=["type", "size", "modify"]))
+    except ftplib.error_perm as exc:
+        # MLSD not implemented: tell the directories from the files with a cwd.
+        if not str(exc)[:3] in ("500", "502"):
+            raise
+        working_dir = ftp.pwd()
+        for name in ftp.nlst(path):
+            name = os.path.basename(name)
+            if name in ('.', '..'):
+                continue
+            try:
+                ftp.cwd(os.path.join(path, name))
+                ftp.cwd(working_dir)
+            except ftplib.all_errors:
+                filenames.append((name, {}))
+            else:
+                dirnames.append((name, {}))
+    else:
+        for name, facts in entries:
+            if facts.get("type") == "dir":
+                dirnames.append((name, facts))
+            elif facts.get("type") == "file":
+                filenames.append((name, facts))
+    return dirnames, filenames
+
+
+def remove_ftp_tree(ftp, tree):
+    """Delete a remote tree as listed by `walk_ftp()': the files and then the directories, deepest first. """
+    for dirpath, dirnames, filenames in tree:
+        for name, facts in filenames:
+            ftp.delete(os.path.join(dirpath, name))
+    for dirpath, dirnames, filenames in reversed(tree):
+        ftp.rmd(dirpath)
 
 
 # https://gist.github.com/Starou/beb8bde114bf7a20cf80
@@ -176,14 +498,7 @@ def rmtree_ftp(ftp, path):
 
 
 def mkdir_unique(directory, ftp_params=None):
-    if not ftp_params:
-        unique_path = tempfile.mkdtemp(dir=directory)
-    else:
-        unique_path = os.path.join(directory, uuid.uuid1().hex)
-        ftp = get_ftp(ftp_params)
-        ftp.mkd(unique_path)
-        close_ftp_conn(ftp, ftp_params)
-    return unique_path
+    return get_transport(ftp_params).mkdir_unique(directory)
 
 
 def close_ftp_conn(ftp, ftp_params=None):
@@ -195,6 +510,153 @@ def close_ftp_conn(ftp, ftp_params=None):
         ftp.quit()
 
 
+async def copy_async(src_filename, dst_filename, ftp_params=None, src_open_mode="rb"):
+    await get_transport(ftp_params).copy_async(src_filename, dst_filename, src_open_mode)
+
+
+async def unpack_archive_async(filename, ftp_params=None, extract_dir=None, fmt='zip', workers=None,
+                               report=None):
+    await get_transport(ftp_params).unpack_archive_async(filename, extract_dir, fmt, workers, report)
+
+
+async def unlink_async(filename, ftp_params=None):
+    await get_transport(ftp_params).unlink_async(filename)
+
+
+async def rmtree_async(tree, ftp_params=None):
+    await get_transport(ftp_params).rmtree_async(tree)
+
+
+async def read_async(filename, ftp_params=None):
+    return await get_transport(ftp_params).read_async(filename)
+
+
+async def mkdir_unique_async(directory, ftp_params=None):
+    return await get_transport(ftp_params).mkdir_unique_async(directory)
+
+
+class FTPPool(object):
+    """A thread-safe pool of logged-in FTP connections keyed by `ftp_params["auth"]'.
+
+    At most `max_size' connections are open for a server at a time. An idle connection
+    is checked with a NOOP before being reused and closed after `idle_timeout' seconds.
+    Set `ftp_params["pooled"]' to False to open a connection per command instead.
+    """
+
+    def __init__(self, max_size=4, idle_timeout=60):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.condition = threading.Condition()
+        self.idle_connections = {}
+        self.open_connections = {}
+
+    def get_key(self, ftp_params):
+        return tuple(ftp_params["auth"])
+
+    def checkout(self, ftp_params):
+        key = self.get_key(ftp_params)
+        with self.condition:
+            while True:
+                expired = self.pop_expired_connections()
+                idle_connections = self.idle_connections.get(key)
+                if idle_connections:
+                    ftp = idle_connections.pop()[0]
+                    break
+                if self.open_connections.get(key, 0) < self.max_size:
+                    self.open_connections[key] = self.open_connections.get(key, 0) + 1
+                    ftp = None
+                    break
+                self.condition.wait()
+
+        for expired_ftp, expired_ftp_params in expired:
+            self.close(expired_ftp, expired_ftp_params)
+
+        if ftp is not None:
+            try:
+                ftp.voidcmd("NOOP")
+            except ftplib.all_errors:
+                self.close(ftp, ftp_params)
+                ftp = None
+            else:
+                ftp.set_pasv(ftp_params["passive"])
+                return ftp
+
+        try:
+            return get_ftp(ftp_params)
+        except BaseException:
+            self.discard(ftp_params)
+            raise
+
+    def checkin(self, ftp, ftp_params):
+        key = self.get_key(ftp_params)
+        with self.condition:
+            self.idle_connections.setdefault(key, []).append((ftp, ftp_params, time.monotonic()))
+            self.condition.notify_all()
+
+    def discard(self, ftp_params):
+        """A connection of `ftp_params' was closed. """
+        key = self.get_key(ftp_params)
+        with self.condition:
+            self.open_connections[key] -= 1
+            self.condition.notify_all()
+
+    def close(self, ftp, ftp_params):
+        try:
+            close_ftp_conn(ftp, ftp_params)
+        except ftplib.all_errors:
+            ftp.close()
+
+    def pop_expired_connections(self):
+        # Called with the lock held.
+        expired = []
+        deadline = time.monotonic() - self.idle_timeout
+        for key, idle_connections in self.idle_connections.items():
+            while idle_connections and idle_connections[0][2] < deadline:
+                ftp, ftp_params = idle_connections.pop(0)[:2]
+                self.open_connections[key] -= 1
+                expired.append((ftp, ftp_params))
+        return expired
+
+    @contextmanager
+    def connection(self, ftp_params):
+        if ftp_params.get("pooled", True) is False:
+            ftp = get_ftp(ftp_params)
+            try:
+                yield ftp
+            finally:
+                close_ftp_conn(ftp, ftp_params)
+            return
+
+        ftp = self.checkout(ftp_params)
+        try:
+            yield ftp
+        except ftplib.error_perm:
+            # A refused command (missing file...) leaves the connection usable.
+            self.checkin(ftp, ftp_params)
+            raise
+        except BaseException:
+            ftp.close()
+            self.discard(ftp_params)
+            raise
+        else:
+            self.checkin(ftp, ftp_params)
+
+    def clear(self):
+        """Close the idle connections. """
+        with self.condition:
+            idle_connections = [connection for connections in self.idle_connections.values()
+                                for connection in connections]
+            for key, connections in self.idle_connections.items():
+                self.open_connections[key] -= len(connections)
+            self.idle_connections.clear()
+            self.condition.notify_all()
+        for ftp, ftp_params, last_used in idle_connections:
+            self.close(ftp, ftp_params)
+
+
+ftp_pool = FTPPool()
+
+
 def get_ftp(ftp_params):
     ftp = ftplib.FTP(*ftp_params["auth"])
     ftp.set_pasv(ftp_params["passive"])
@@ -1,18 +1,24 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import concurrent.futures
 import copy
+import itertools
 import os
 import re
 import shutil
+import threading
 import zipfile
 from decimal import Decimal
 from lxml import etree
 from simple_idml import BACKINGSTORY, SETCONTENT_TAG, IGNORECONTENT_TAG, FORCECONTENT_TAG
+from simple_idml import SERIALIZATION_PRETTY, SERIALIZATIONS
 from simple_idml.components import get_idml_xml_file_by_name
-from simple_idml.components import (Designmap, Spread, Story, BackingStory,
-                                    Style, StyleMapping, Graphic, Tags, Fonts, XMLElement)
-from simple_idml.decorators import use_working_copy
-from simple_idml.utils import increment_filename, prefix_content_filename, tree_to_etree_dom
+from simple_idml.components import (IDMLXMLFile, Designmap, Spread, Story, Style, StyleMapping,
+                                    Graphic, Tags, Fonts, XMLElement)
+from simple_idml.decorators import use_working_copy, use_shared_components
+from simple_idml.utils import increment_filename, prefix_content_filename, tree_to_etree_dom, uri_to_path
+from simple_idml.utils import zip_members
 
 STORIES_DIRNAME = "Stories"
 
@@ -20,16 +26,70 @@ STORIES_DIRNAME = "Stories"
 class IDMLPackage(zipfile.ZipFile):
     """An IDML file (a package) is a Zip-stored archive/UCF container. """
     debug = False
-
-    def __init__(self, *args, **kwargs):
+    # Kind of the members of the manifest by directory (the others are "other").
+    member_kinds = {
+        "Spreads": "spread",
+        STORIES_DIRNAME: "story",
+        "MasterSpreads": "masterspread",
+        "Resources": "resource",
+        "XML": "xml",
+        "META-INF": "meta",
+    }
+    # How the XML files are written and exported:
+    # - "pretty": indented (pretty_print),
+    # - "compact": the formatting whitespaces are removed when parsing and none is added,
+    # - "preserve": the whitespaces of the parsed files are kept and none is added.
+    serialization = SERIALIZATION_PRETTY
+
+    def __init__(self, *args, preload=None, workers=None, max_parsed_bytes=None, max_parsed_components=None,
+                 serialization=None, **kwargs):
+        # The members are written stored, unless by write_members() with a `compresslevel'.
         kwargs["compression"] = zipfile.ZIP_STORED
         zipfile.ZipFile.__init__(self, *args, **kwargs)
+        self.workers = workers
+        if serialization is not None:
+            if serialization not in SERIALIZATIONS:
+                raise ValueError(f"Unknown serialization '{serialization}'.")
+            self.serialization = serialization
         self.working_copy_path = None
+        # Component objects (Stories, Spreads...) shared by name, see use_shared_components.
+        self.shared_components = None
+        # DOMs parsed ahead by preload() and not used by a component yet.
+        self.preloaded_doms = {}
+        # Parsing budget, see use_component_dom().
+        self.max_parsed_bytes = max_parsed_bytes
+        self.max_parsed_components = max_parsed_components
+        self.parsed_components = collections.OrderedDict()
+        self.parsed_bytes = 0
+        self.evictions = 0
+        self.reparses = 0
+        # The components are also parsed by the worker threads (preload(), prefix()).
+        self.parsing_lock = threading.Lock()
+        # See manifest.
+        self._manifest = None
+        self._manifest_working_copy_path = None
         self.init_lazy_references()
+        if preload and self.mode == "r":
+            self.preload(preload, workers)
 
     def __repr__(self):
         return f"<idml.IDMLPackage instance of '{os.path.basename(self.filename)}' at {hex(id(self))}>"
 
+    def get_options(self):
+        """The options to open a package made from this one with. """
+        return {"workers": self.workers,
+                "max_parsed_bytes": self.max_parsed_bytes,
+                "max_parsed_components": self.max_parsed_components,
+                "serialization": self.serialization,
+                "compresslevel": self.compresslevel}
+
+    def write_members(self, members):
+        """Write `members', a list of (filename, arcname). With a `compresslevel' the members are
+        read ahead in a pool of `workers' threads and deflated one by one, except `mimetype' which
+        must be stored and first (UCF). """
+        members = sorted(members, key=lambda member: os.path.normpath(member[1]).lstrip(os.sep) != "mimetype")
+        zip_members(self, members, compresslevel=self.compresslevel, stored=("mimetype",), workers=self.workers)
+
     def init_lazy_references(self):
         self._xml_structure = None
         self._xml_structure_tree = None
@@ -48,10 +108,14 @@ class IDMLPackage(zipfile.ZipFile):
         self._stories = None
         self._story_ids = None
         self._referenced_layers = None
+        self._nested_style_range_nodes = {}
 
     def namelist(self):
         if not self.working_copy_path:
             return zipfile.ZipFile.namelist(self)
+        return list(self.manifest)
+
+    def _walk_working_copy(self):
         namelist = []
         for root, dirs, filenames in os.walk(self.working_copy_path):
             rel_root = root.replace(self.working_copy_path, "")[1:]
@@ -63,9 +127,145 @@ class IDMLPackage(zipfile.ZipFile):
                 })
         return namelist
 
+    @property
+    def manifest(self):
+        """The members (the archive's or the working copy's files) mapped to their kind
+        ("spread", "story", "resource"... see member_kinds).
+
+        It survives init_lazy_references(): in a working copy the operations creating or
+        renaming files update it (register_member(), rename_members()). """
+        if self._manifest is None or self._manifest_working_copy_path != self.working_copy_path:
+            if self.working_copy_path:
+                names = self._walk_working_copy()
+            else:
+                names = zipfile.ZipFile.namelist(self)
+            manifest = {name: self.member_kinds.get(os.path.dirname(name), "other") for name in names}
+            # An archive being written changes.
+            if not self.working_copy_path and self.mode != "r":
+                return manifest
+            self._manifest = manifest
+            self._manifest_working_copy_path = self.working_copy_path
+        return self._manifest
+
+    def register_member(self, name):
+        """`name' has been created in the working copy. """
+        if self._manifest is not None and self._manifest_working_copy_path == self.working_copy_path:
+            self._manifest.setdefault(name, self.member_kinds.get(os.path.dirname(name), "other"))
+
+    def rename_members(self, names):
+        """The files of the working copy have been renamed (`names' maps the old to the new names). """
+        if self._manifest is not None and self._manifest_working_copy_path == self.working_copy_path:
+            self._manifest = {names.get(name, name): kind for name, kind in self._manifest.items()}
+
+    def has_story(self, story_id):
+        return f"{STORIES_DIRNAME}/Story_{story_id}.xml" in self.manifest
+
+    def get_idml_xml_file(self, name):
+        """The IDMLXMLFile object of the `name' member.
+
+        The object is shared while components are shared (see use_shared_components),
+        otherwise a new one is returned each time. """
+        if self.shared_components is not None and name in self.shared_components:
+            return self.shared_components[name]
+        idml_xml_file = get_idml_xml_file_by_name(self, name, self.working_copy_path)
+        if self.shared_components is not None:
+            self.shared_components[name] = idml_xml_file
+        return idml_xml_file
+
+    def preload(self, components="all", workers=None):
+        """Parse the Stories and/or the Spreads (`components' is "all", "stories" or "spreads")
+        concurrently in a pool of `workers' threads (lxml releases the GIL when parsing).
+
+        Each DOM is given to the first component object that needs it (see pop_preloaded_dom).
+        The files are parsed outside of the component objects: the preloaded DOMs do not count in
+        the parsing budget until they are given. """
+        if components == "all":
+            names = self.contentfile_namelist()
+        elif components in ("stories", "spreads"):
+            names = [f for f in self.contentfile_namelist() if os.path.dirname(f) == components.title()]
+        else:
+            raise ValueError(f"Cannot preload '{components}'.")
+
+        def parse(name):
+            if self.working_copy_path:
+                fobj = open(os.path.join(self.working_copy_path, name), mode="rb")
+            else:
+                fobj = self.open(name, mode="r")
+            with fobj:
+                return name, etree.parse(fobj, parser=IDMLXMLFile.get_parser(self.serialization)).getroot()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            self.preloaded_doms.update(executor.map(parse, names))
+
+    def pop_preloaded_dom(self, name):
+        """The preloaded DOM of the `name' member (None if there is not) which is then forgotten:
+        the component that gets it will modify it. """
+        return self.preloaded_doms.pop(name, None)
+
+    def use_component_dom(self, idml_xml_file):
+        """Called on each access to the DOM of a Story or a Spread.
+
+        Past `max_parsed_bytes' (the size of the files) or `max_parsed_components', the least
+        recently used DOMs are evicted and parsed again on their next access. A DOM is evicted only
+        if it is the same as its file: not modified (see IDMLXMLFile.is_modified) since it was
+        parsed or written.
+        `evictions' and `reparses' count them. """
+        if not self.has_parsing_budget:
+            return
+        with self.parsing_lock:
+            key = id(idml_xml_file)
+            if key in self.parsed_components:
+                self.parsed_components.move_to_end(key)
+                return
+            idml_xml_file.parsed_bytes = self._get_member_size(idml_xml_file)
+            self.parsed_components[key] = idml_xml_file
+            self.parsed_bytes += idml_xml_file.parsed_bytes
+
+            # The most recent one is kept.
+            for key, parsed_component in list(self.parsed_components.items())[:-1]:
+                if not self._is_over_parsing_budget():
+                    break
+                if parsed_component.is_modified():
+                    continue
+                del self.parsed_components[key]
+                self.parsed_bytes -= parsed_component.parsed_bytes
+                parsed_component.evict_dom()
+                self.evictions += 1
+
+    @property
+    def has_parsing_budget(self):
+        return self.max_parsed_bytes is not None or self.max_parsed_components is not None
+
+    def count_reparse(self):
+        with self.parsing_lock:
+            self.reparses += 1
+
+    def _is_over_parsing_budget(self):
+        return ((self.max_parsed_bytes is not None and self.parsed_bytes > self.max_parsed_bytes) or
+                (self.max_parsed_components is not None and
+                 len(self.parsed_components) > self.max_parsed_components))
+
+    def _get_member_size(self, idml_xml_file):
+        try:
+            if idml_xml_file.working_copy_path:
+                return os.path.getsize(os.path.join(idml_xml_file.working_copy_path, idml_xml_file.name))
+            return self.getinfo(idml_xml_file.name).file_size
+        except (KeyError, OSError):
+            return 0
+
+    def is_shared_component(self, idml_xml_file):
+        return (self.shared_components is not None and
+                self.shared_components.get(idml_xml_file.name) is idml_xml_file)
+
+    def synchronize_components(self):
+        """Write the shared components modified since they were last written. """
+        for idml_xml_file in self.shared_components.values():
+            if idml_xml_file.dirty:
+                idml_xml_file.write()
+
     def contentfile_namelist(self):
         """Namelist filtered on Spreads and Stories. """
-        return [f for f in self.namelist() if os.path.dirname(f) in ("Spreads", "Stories")]
+        return [name for name, kind in self.manifest.items() if kind in ("spread", "story")]
 
     @property
     def xml_structure(self):
@@ -92,9 +292,9 @@ class IDMLPackage(zipfile.ZipFile):
                     if elt.get("XMLContent"):
                         xml_content_value = elt.get("XMLContent")
                         story_name = f"Stories/Story_{xml_content_value}.xml"
-                        story = Story(self, name=story_name, working_copy_path=self.working_copy_path)
+                        story = self.get_idml_xml_file(story_name)
                         try:
-                            new_source_node = story.get_element_by_id(elt.get("Self"))
+                            new_source_node = story.get_element_by_id(elt.get("Self"), readonly=True)
                         # The story does not exists (i.e. for an image).
                         except KeyError:
                             continue
@@ -110,7 +310,7 @@ class IDMLPackage(zipfile.ZipFile):
         return self._xml_structure
 
     def xml_structure_pretty(self):
-        return etree.tostring(self.xml_structure, pretty_print=True)
+        return etree.tostring(self.xml_structure, pretty_print=self.serialization == SERIALIZATION_PRETTY)
 
     @property
     def xml_structure_tree(self):
@@ -122,7 +322,7 @@ class IDMLPackage(zipfile.ZipFile):
     @property
     def designmap(self):
         if self._designmap is None:
-            designmap = Designmap(self, working_copy_path=self.working_copy_path)
+            designmap = self.get_idml_xml_file(Designmap.name)
             self._designmap = designmap  # pylint: disable=attribute-defined-outside-init
         return self._designmap
 
@@ -150,7 +350,7 @@ class IDMLPackage(zipfile.ZipFile):
     @property
     def style(self):
         if self._style is None:
-            style = Style(self, self.working_copy_path)
+            style = self.get_idml_xml_file(Style.name)
             self._style = style  # pylint: disable=attribute-defined-outside-init
         return self._style
 
@@ -158,28 +358,28 @@ class IDMLPackage(zipfile.ZipFile):
     def style_mapping(self):
         """The style mapping file may not be present in the archive and is created in that case. """
         if self._style_mapping is None:
-            style_mapping = StyleMapping(self, self.working_copy_path)
+            style_mapping = self.get_idml_xml_file(StyleMapping.name)
             self._style_mapping = style_mapping  # pylint: disable=attribute-defined-outside-init
         return self._style_mapping
 
     @property
     def graphic(self):
         if self._graphic is None:
-            graphic = Graphic(self, self.working_copy_path)
+            graphic = self.get_idml_xml_file(Graphic.name)
             self._graphic = graphic  # pylint: disable=attribute-defined-outside-init
         return self._graphic
 
     @property
     def spreads(self):
         if self._spreads is None:
-            spreads = [elt for elt in self.namelist() if re.match("^Spreads/*", elt)]
+            spreads = [name for name, kind in self.manifest.items() if kind == "spread"]
             self._spreads = spreads  # pylint: disable=attribute-defined-outside-init
         return self._spreads
 
     @property
     def spreads_objects(self):
         if self._spreads_objects is None:
-            spreads_objects = [Spread(self, s, self.working_copy_path) for s in self.spreads]
+            spreads_objects = [self.get_idml_xml_file(s) for s in self.spreads]
             self._spreads_objects = spreads_objects  # pylint: disable=attribute-defined-outside-init
         return self._spreads_objects
 
@@ -187,7 +387,7 @@ class IDMLPackage(zipfile.ZipFile):
     def last_spread(self):
         if self._last_spread is None:
             src = self.designmap.spread_nodes[-1].get("src")
-            self._last_spread = Spread(self, src, self.working_copy_path)  # pylint: disable=attribute-defined-outside-init
+            self._last_spread = self.get_idml_xml_file(src)  # pylint: disable=attribute-defined-outside-init
         return self._last_spread
 
     @property
@@ -203,22 +403,21 @@ class IDMLPackage(zipfile.ZipFile):
     def backing_story(self):
         """The style mapping file may not be present in the archive and is created in that case. """
         if self._backing_story is None:
-            backing_story = BackingStory(self, working_copy_path=self.working_copy_path)
+            backing_story = self.get_idml_xml_file(BACKINGSTORY)
             self._backing_story = backing_story  # pylint: disable=attribute-defined-outside-init
         return self._backing_story
 
     @property
     def stories(self):
         if self._stories is None:
-            stories = [elt for elt in self.namelist()
-                       if re.match(f"^{STORIES_DIRNAME}/*", elt)]
+            stories = [name for name, kind in self.manifest.items() if kind == "story"]
             self._stories = stories  # pylint: disable=attribute-defined-outside-init
         return self._stories
 
     def stories_for_node(self, node_path):
         return [f"{STORIES_DIRNAME}/Story_{child.get('XMLContent')}.xml"
                 for child in self.xml_structure.xpath(node_path)[0].iter()
-                if child.get("XMLContent") in self.story_ids]
+                if self.has_story(child.get("XMLContent"))]
 
     @property
     def story_ids(self):
@@ -248,7 +447,46 @@ class IDMLPackage(zipfile.ZipFile):
 
     @use_working_copy
     def import_xml(self, xml, at):
-        """ Reproduce the action «Import XML» on a XML Element in InDesign® Structure. """
+        """ Reproduce the action «Import XML» on a XML Element in InDesign® Structure.
+
+        `xml' is a XML string, or a path or a binary file object of a XML document.
+        A document is parsed incrementally: the children of its root element are imported
+        as they are parsed and then discarded, so the memory used is bounded by the
+        largest of them rather than by the whole document.
+        """
+        self._import_xml(xml, at)
+        return self
+
+    @use_working_copy
+    @use_shared_components
+    def import_xmls(self, sources):
+        """ Import several sources at once, `sources' being a list of (xml, at) as in import_xml().
+
+        The `at' paths are all resolved against the structure before the first import, so
+        they cannot be inside one another: an import replaces the content of its destination.
+        Each Story or Spread is parsed once and written once, whatever the number of
+        sources imported into it. """
+        destinations = [self.xml_structure.xpath(at)[0] for _, at in sources]
+        ats_by_destination = {destination: at for destination, (_, at) in zip(destinations, sources)}
+        for destination, (_, at) in zip(destinations, sources):
+            for ancestor in destination.iterancestors():
+                if ancestor in ats_by_destination:
+                    raise ValueError(f"Cannot import at '{at}': its destination is replaced by the import at "
+                                     f"'{ats_by_destination[ancestor]}'.")
+        element_ids = [destination.get("Self") for destination in destinations]
+        for (xml, _), element_id in zip(sources, element_ids):
+            at = self.xml_structure_tree.getpath(self.xml_structure.xpath(f"//*[@Self='{element_id}']")[0])
+            self._import_xml(xml, at)
+        return self
+
+    def _import_xml(self, xml, at):
+        # A XML string read from a file may start with a byte order mark.
+        if isinstance(xml, str) and xml.startswith("\ufeff"):
+            xml = xml[1:]
+        if hasattr(xml, "read") or isinstance(xml, os.PathLike) or \
+           (isinstance(xml, str) and not xml.lstrip().startswith("<")):
+            self._import_xml_stream(xml, at)
+            return
 
         # Python 3 strictly require a bytestring.
         try:
@@ -256,222 +494,304 @@ class IDMLPackage(zipfile.ZipFile):
         except ValueError:
             source_node = etree.fromstring(xml.encode("utf-8"))
 
-        def _set_content(xpath, element_id, content, story=None):
-            story = story or self.get_story_object_by_xpath(xpath)
-            story.set_element_content(element_id, content)
-            story.synchronize()
+        self._import_source_node(source_node, at)
 
-        def _apply_style(style_range_node, style_to_apply_node, applied_style_node):
-            """ A style_range_node as an applied_style_node overriden with style_to_apply_node. """
-            for attr in ("PointSize", "FontStyle", "HorizontalScale", "Tracking", "FillColor", "Capitalization", "Position"):
-                if style_to_apply_node.get(attr) is not None:
-                    value_to_apply = style_to_apply_node.get(attr)
-                    applied_value = style_range_node.get(attr) or applied_style_node.get(attr)
-                    if attr == "FontStyle":
-                        style_range_node.set(attr, _merge_font_style(applied_value, value_to_apply))
-                    else:
-                        style_range_node.set(attr, style_to_apply_node.get(attr))
-            # TODO
-            # for attr in ("Leading", "AppliedFont"):
-            #    path = "Properties/%s" % attr
-            #    source_attr_node = source_style_node.find(path)
-            #    attr_node = (style_node is not None and style_node.find(path) is not None)
-            #    if attr_node is None and source_attr_node is not None:
-            #        properties_element.append(copy.deepcopy(source_attr_node))
-
-        mergeable_font_styles = {
-            "Condensed": {
-                "Light": "Condensed Light",
-            },
-            "Bold": {
-                "Italic": "Bold Italic",
-            },
-            "SemiBold": {
-                "Italic": "SemiBold Italic",
-            },
-            "Semibold": {
-                "Italic": "Semibold Italic",
-            },
-        }
+    @use_working_copy
+    def import_tree(self, tree, at):
+        """ Like import_xml() with a source given as a tree (see export_as_tree()) or an etree.Element.
 
-        def _merge_font_style(applied_font_style, font_style_to_apply):
-            """ If not mergeable, return the child."""
-            parent = mergeable_font_styles.get(applied_font_style, {})
-            return parent.get(font_style_to_apply, font_style_to_apply)
-
-        def _get_nested_style_range_node(xml_structure_node):
-            """Use the more distant parent as base style and then apply its children styles until the new tag itself.
-
-            Returns:
-             o new_style_range_node: unbound element.
-             o root_style_node
-            """
-            nested_styles = []
-            while xml_structure_node is not None :
-                style_name = self.style_mapping.character_style_mapping.get(xml_structure_node.tag)
-                if style_name:
-                    style_node = self.style.get_style_node_by_name(style_name)
-                    nested_styles.insert(0, style_node)
-                xml_structure_node = xml_structure_node.getparent()
+        The source is imported as is, without being serialized and parsed again. """
+        source_node = tree if etree.iselement(tree) else tree_to_etree_dom(tree)
+        self._import_source_node(source_node, at)
+        return self
 
+    def _import_source_node(self, source_node, at):
+        self._clear_destination(source_node, at)
+        self.init_lazy_references()
+        self._import_node(source_node, at)
+
+    def _import_xml_stream(self, source, at):
+        events = etree.iterparse(source, events=("start", "end"), huge_tree=True)
+        _, root = next(events)
+        source_node_children = self._iter_stream_children(events, root)
+        first_child = next(source_node_children, None)
+
+        # The root element has no children, its whole content is known now.
+        if first_child is None:
+            self._import_source_node(root, at)
+            return
+
+        # Its text is known since the first child has been parsed.
+        source_node = etree.Element(root.tag, dict(root.attrib))
+        source_node.text = root.text
+        self._clear_destination(source_node, at)
+        self.init_lazy_references()
+        element_id = self.xml_structure.xpath(at)[0].get("Self")
+        ignorecontent = self._import_node_content(source_node, at, element_id)
+        self._import_node_children(itertools.chain([first_child], source_node_children),
+                                   at, element_id, ignorecontent, clear_destination=True)
+
+    def _iter_stream_children(self, events, root):
+        """Yield the children of `root' as soon as they are parsed, including their tail,
+        and discard them once they have been imported. """
+        depth, child = 1, None
+        for event, elt in events:
+            if event == "start":
+                depth += 1
+                if depth == 2 and child is not None:
+                    yield child
+                    child.clear()
+                    while child.getprevious() is not None:
+                        del root[0]
+                    child = None
+            else:
+                depth -= 1
+                if depth == 1:
+                    child = elt
+                elif depth == 0:
+                    break
+        if child is not None:
+            yield child
+
+    def _set_content(self, xpath, element_id, content, story=None):
+        story = story or self.get_story_object_by_xpath(xpath)
+        story.set_element_content(element_id, content)
+        story.synchronize()
+
+    def _apply_style(self, style_range_node, style_to_apply_node, applied_style_node):
+        """ A style_range_node as an applied_style_node overriden with style_to_apply_node. """
+        for attr in ("PointSize", "FontStyle", "HorizontalScale", "Tracking", "FillColor", "Capitalization", "Position"):
+            if style_to_apply_node.get(attr) is not None:
+                value_to_apply = style_to_apply_node.get(attr)
+                applied_value = style_range_node.get(attr) or applied_style_node.get(attr)
+                if attr == "FontStyle":
+                    style_range_node.set(attr, self._merge_font_style(applied_value, value_to_apply))
+                else:
+                    style_range_node.set(attr, style_to_apply_node.get(attr))
+        # TODO
+        # for attr in ("Leading", "AppliedFont"):
+        #    path = "Properties/%s" % attr
+        #    source_attr_node = source_style_node.find(path)
+        #    attr_node = (style_node is not None and style_node.find(path) is not None)
+        #    if attr_node is None and source_attr_node is not None:
+        #        properties_element.append(copy.deepcopy(source_attr_node))
+
+    mergeable_font_styles = {
+        "Condensed": {
+            "Light": "Condensed Light",
+        },
+        "Bold": {
+            "Italic": "Bold Italic",
+        },
+        "SemiBold": {
+            "Italic": "SemiBold Italic",
+        },
+        "Semibold": {
+            "Italic": "Semibold Italic",
+        },
+    }
+
+    def _merge_font_style(self, applied_font_style, font_style_to_apply):
+        """ If not mergeable, return the child."""
+        parent = self.mergeable_font_styles.get(applied_font_style, {})
+        return parent.get(font_style_to_apply, font_style_to_apply)
+
+    def _get_nested_style_range_node(self, xml_structure_node):
+        """Use the more distant parent as base style and then apply its children styles until the new tag itself.
+
+        The result is computed once for each nesting of mapped styles and copied afterwards.
+
+        Returns:
+         o new_style_range_node: unbound element.
+         o root_style_node
+        """
+        style_names = []
+        while xml_structure_node is not None :
+            style_name = self.style_mapping.character_style_mapping.get(xml_structure_node.tag)
+            if style_name:
+                style_names.insert(0, style_name)
+            xml_structure_node = xml_structure_node.getparent()
+        style_names = tuple(style_names)
+
+        if style_names not in self._nested_style_range_nodes:
+            nested_styles = [self.style.get_style_node_by_name(style_name) for style_name in style_names]
             # Merge the styles starting from the top parent like in a HTML document.
             root_style_node = nested_styles.pop(0)
-            new_style_range_node = etree.Element("CharacterStyleRange", AppliedCharacterStyle=root_style_node.get("Self"))
+            new_style_range_node = etree.Element("CharacterStyleRange",
+                                                 AppliedCharacterStyle=root_style_node.get("Self"))
             etree.SubElement(new_style_range_node, "Properties")
             for style_to_apply_node in nested_styles:
-                _apply_style(new_style_range_node, style_to_apply_node, root_style_node)
+                self._apply_style(new_style_range_node, style_to_apply_node, root_style_node)
+            self._nested_style_range_nodes[style_names] = (new_style_range_node, root_style_node)
+
+        new_style_range_node, root_style_node = self._nested_style_range_nodes[style_names]
+        return copy.deepcopy(new_style_range_node), root_style_node
+
+    def _apply_parent_style_range(self, style_range_node, applied_style_node, parent):
+        """Parent CharacterStyleRange must be set locally. """
+        properties_element = style_range_node.find("Properties")
+
+        parent_style_node = parent.get_character_style_range()
+        if parent_style_node is None:
+            return
+        # If the parent specify a font face, a font style or a font size and the style_node don't, it is added.
+        for attr in ("PointSize", "FontStyle", "HorizontalScale", "Tracking",
+                     "FillColor", "FillTint", "Capitalization", "Position"):
+            if parent_style_node.get(attr) is not None and (applied_style_node is None or not applied_style_node.get(attr)):
+                style_range_node.set(attr, parent_style_node.get(attr))
+
+        for attr in ("Leading", "AppliedFont", "ParagraphShadingColor", "ParagraphBorderColor"):
+            path = f"Properties/{attr}"
+            parent_attr_node = parent_style_node.find(path)
+            attr_node = applied_style_node.find(path) is not None if applied_style_node is not None else None
+            if attr_node is None and parent_attr_node is not None:
+                properties_element.append(copy.deepcopy(parent_attr_node))
+
+    def _move_siblings_content(self, at, element_id):
+        """ When new XML elements are inserted, the siblings of the initial <content>
+            (<br> only to avoid moving newly created elements) are
+            repositionned after the last <content> created.
+        """
+        story = self.get_story_object_by_xpath(at)
+        element = story.get_element_by_id(element_id)
+        content_nodes = element.get_element_content_nodes()
+        if len(content_nodes) < 2:
+            return
+
+        first_content_node = content_nodes[0]
+        last_content_node = content_nodes[-1]
+        siblings = list(first_content_node.itersiblings(['br', 'Br', 'BR']))
+        if not len(siblings):
+            return
+
+        for sibling in siblings:
+            try:
+                last_content_node.addnext(sibling)
+            except ValueError:  # "cannot add ancestor as sibling, please break cycle first"
+                pass
+        story.synchronize()
 
-            return new_style_range_node, root_style_node
+    def _import_new_node(self, source_node, at=None, element_id=None, story=None):
+        xml_structure_parent_node = self.xml_structure.find(f"*//*[@Self='{element_id}']")
+        xml_structure_new_node = etree.Element(source_node.tag)
+        # We cannot force the self._xml_structure reset by setting it at None.
+        xml_structure_parent_node.append(xml_structure_new_node)
 
-        def _apply_parent_style_range(style_range_node, applied_style_node, parent):
-            """Parent CharacterStyleRange must be set locally. """
-            properties_element = style_range_node.find("Properties")
+        style_range_node, applied_style_node = self._get_nested_style_range_node(xml_structure_new_node)
+        story = story or self.get_story_object_by_xpath(at)
+        parent = story.get_element_by_id(element_id)
+        self._apply_parent_style_range(style_range_node, applied_style_node, parent)
 
-            parent_style_node = parent.get_character_style_range()
-            if parent_style_node is None:
-                return
-            # If the parent specify a font face, a font style or a font size and the style_node don't, it is added.
-            for attr in ("PointSize", "FontStyle", "HorizontalScale", "Tracking",
-                         "FillColor", "FillTint", "Capitalization", "Position"):
-                if parent_style_node.get(attr) is not None and (applied_style_node is None or not applied_style_node.get(attr)):
-                    style_range_node.set(attr, parent_style_node.get(attr))
-
-            for attr in ("Leading", "AppliedFont", "ParagraphShadingColor", "ParagraphBorderColor"):
-                path = f"Properties/{attr}"
-                parent_attr_node = parent_style_node.find(path)
-                attr_node = applied_style_node.find(path) is not None if applied_style_node is not None else None
-                if attr_node is None and parent_attr_node is not None:
-                    properties_element.append(copy.deepcopy(parent_attr_node))
-
-        def _move_siblings_content(at, element_id):
-            """ When new XML elements are inserted, the siblings of the initial <content>
-                (<br> only to avoid moving newly created elements) are
-                repositionned after the last <content> created.
-            """
-            story = self.get_story_object_by_xpath(at)
-            element = story.get_element_by_id(element_id)
-            content_nodes = element.get_element_content_nodes()
-            if len(content_nodes) < 2:
-                return
+        new_xml_element = XMLElement(tag=source_node.tag)
+        new_xml_element.add_content(source_node.text, parent, style_range_node)
+        story.add_element(element_id, new_xml_element.element)
 
-            first_content_node = content_nodes[0]
-            last_content_node = content_nodes[-1]
-            siblings = list(first_content_node.itersiblings(['br', 'Br', 'BR']))
-            if not len(siblings):
-                return
+        xml_structure_new_node.set("Self", new_xml_element.get("Self"))
 
-            for sibling in siblings:
-                try:
-                    last_content_node.addnext(sibling)
-                except ValueError:  # "cannot add ancestor as sibling, please break cycle first"
-                    pass
+        # Source may also contains some children.
+        source_node_children = source_node.getchildren()
+        if len(source_node_children):
             story.synchronize()
+            for source_node_child in source_node_children:
+                self._import_new_node(source_node_child,
+                                      element_id=new_xml_element.get("Self"),
+                                      story=story)
 
-        def _import_new_node(source_node, at=None, element_id=None, story=None):
-            xml_structure_parent_node = self.xml_structure.find(f"*//*[@Self='{element_id}']")
-            xml_structure_new_node = etree.Element(source_node.tag)
-            # We cannot force the self._xml_structure reset by setting it at None.
-            xml_structure_parent_node.append(xml_structure_new_node)
-
-            style_range_node, applied_style_node = _get_nested_style_range_node(xml_structure_new_node)
-            story = story or self.get_story_object_by_xpath(at)
-            parent = story.get_element_by_id(element_id)
-            _apply_parent_style_range(style_range_node, applied_style_node, parent)
-
-            new_xml_element = XMLElement(tag=source_node.tag)
-            new_xml_element.add_content(source_node.text, parent, style_range_node)
-            story.add_element(element_id, new_xml_element.element)
-
-            xml_structure_new_node.set("Self", new_xml_element.get("Self"))
-
-            # Source may also contains some children.
-            source_node_children = source_node.getchildren()
-            if len(source_node_children):
-                story.synchronize()
-                for source_node_child in source_node_children:
-                    _import_new_node(source_node_child,
-                                     element_id=new_xml_element.get("Self"),
-                                     story=story)
-
-            if source_node.tail:
-                story.add_content_to_element(element_id, source_node.tail, parent)
-            story.synchronize()
+        if source_node.tail:
+            story.add_content_to_element(element_id, source_node.tail, parent)
+        story.synchronize()
 
-        def _import_node(source_node, at=None, element_id=None, story=None, ignorecontent_parent_flag=False):
-            element_id = element_id or self.xml_structure.xpath(at)[0].get("Self")
-            items = dict(source_node.items())
-
-            forcecontent = (items.get(FORCECONTENT_TAG) == "true")
-            if not ignorecontent_parent_flag or forcecontent:
-                if items:
-                    self.set_attributes(at, items, element_id)
-                content_flags = items.get(SETCONTENT_TAG, "").split(',')
-                if "remove-previous-br" in content_flags:
-                    local_story = story or self.get_story_object_by_xpath(at)
-                    elt = local_story.get_element_by_id(element_id).element
-                    for _elt in reversed(elt.xpath("preceding::*")):
-                        if _elt.tag == "XMLElement":
-                            break
-                        if _elt.tag == "Br":
-                            _elt.getparent().remove(_elt)
-                            continue
-                    local_story.synchronize()
-                if "delete" in content_flags:
-                    local_story = story or self.get_story_object_by_xpath(at)
-                    local_story.remove_element(element_id, synchronize=True)
-                    spread = self.get_spread_object_by_xpath(at)
-                    if spread:
-                        content_id = self.xml_structure.xpath(at)[0].get("XMLContent")
-                        spread.remove_page_item(content_id, synchronize=True)
-                elif "false" not in content_flags:
-                    _set_content(at, element_id, source_node.text or "", story)
-
-            ignorecontent = (items.get(IGNORECONTENT_TAG) == "true") or (ignorecontent_parent_flag and not forcecontent)
-            source_node_children = source_node.getchildren()
-            if len(source_node_children):
-                source_node_children_tags = [n.tag for n in source_node_children]
-                destination_node = self.xml_structure.xpath(at)[0]
-                destination_node_children = destination_node.iterchildren()
-                destination_node_children_tags = [n.tag for n in destination_node.iterchildren()]
-                # Childrens in source node (xml file) and destination node are an exact match,
-                # we can call a map() on _import_node().
-                # FIXME: what if source_node.text exists ?
-                if destination_node_children_tags == source_node_children_tags:
-                    for s, d in zip(source_node_children, [self.xml_structure_tree.getpath(c) for c in
-                                                           destination_node.iterchildren()]):
-                        _import_node(s, at=d, ignorecontent_parent_flag=ignorecontent)
-
-                # Step-by-step iteration.
-                else:
-                    destination_node_child = next(destination_node_children, None)
-                    for source_child in source_node_children:
-                        # Source and destination match.
-                        if destination_node_child is not None and source_child.tag == destination_node_child.tag:
-                            _import_node(source_child, at=self.xml_structure_tree.getpath(destination_node_child),
-                                         ignorecontent_parent_flag=ignorecontent)
-                            destination_node_child = next(destination_node_children, None)
-                        # Source does not match destination. It is added, but only if the tag is mapped to a style.
-                        elif not ignorecontent and source_child.tag in self.style_mapping.character_style_mapping.keys():
-                            _import_new_node(source_child, at, element_id)
-
-                    _move_siblings_content(at, element_id)
+    def _import_node(self, source_node, at=None, element_id=None, story=None, ignorecontent_parent_flag=False):
+        element_id = element_id or self.xml_structure.xpath(at)[0].get("Self")
+        ignorecontent = self._import_node_content(source_node, at, element_id, story, ignorecontent_parent_flag)
+        source_node_children = source_node.getchildren()
+        if len(source_node_children):
+            self._import_node_children(source_node_children, at, element_id, ignorecontent)
 
-        self._clear_destination(source_node, at)
-        self.init_lazy_references()
-        _import_node(source_node, at)
-        return self
+    def _import_node_content(self, source_node, at, element_id, story=None, ignorecontent_parent_flag=False):
+        """Import the attributes and the text of source_node.
+
+        Return the `ignorecontent' flag to pass to the children. """
+        items = dict(source_node.items())
+
+        forcecontent = (items.get(FORCECONTENT_TAG) == "true")
+        if not ignorecontent_parent_flag or forcecontent:
+            if items:
+                self.set_attributes(at, items, element_id)
+            content_flags = items.get(SETCONTENT_TAG, "").split(',')
+            if "remove-previous-br" in content_flags:
+                local_story = story or self.get_story_object_by_xpath(at)
+                elt = local_story.get_element_by_id(element_id).element
+                for _elt in reversed(elt.xpath("preceding::*")):
+                    if _elt.tag == "XMLElement":
+                        break
+                    if _elt.tag == "Br":
+                        _elt.getparent().remove(_elt)
+                        continue
+                local_story.synchronize()
+            if "delete" in content_flags:
+                local_story = story or self.get_story_object_by_xpath(at)
+                local_story.remove_element(element_id, synchronize=True)
+                spread = self.get_spread_object_by_xpath(at)
+                if spread:
+                    content_id = self.xml_structure.xpath(at)[0].get("XMLContent")
+                    spread.remove_page_item(content_id, synchronize=True)
+            elif "false" not in content_flags:
+                self._set_content(at, element_id, source_node.text or "", story)
+
+        return (items.get(IGNORECONTENT_TAG) == "true") or (ignorecontent_parent_flag and not forcecontent)
+
+    def _import_node_children(self, source_node_children, at, element_id, ignorecontent,
+                              clear_destination=False):
+        """Import the source children into the children of the destination node.
+
+        With `clear_destination', the destination of each child is cleared just before it is
+        imported (instead of clearing the whole destination before the import). """
+        destination_node_children = self.xml_structure.xpath(at)[0].iterchildren()
+        destination_node_child = next(destination_node_children, None)
+        # Childrens in source node (xml file) and destination node are an exact match.
+        # FIXME: what if source_node.text exists ?
+        exact_match = True
+        position = 0
+        for source_child in source_node_children:
+            # Source and destination match.
+            if destination_node_child is not None and source_child.tag == destination_node_child.tag:
+                child_at = self.xml_structure_tree.getpath(destination_node_child)
+                if clear_destination and self._clear_destination(source_child, child_at):
+                    # The structure has to be discovered again after a clear.
+                    self.init_lazy_references()
+                    destination_node_children = self.xml_structure.xpath(at)[0].iterchildren()
+                    for _ in range(position + 1):
+                        next(destination_node_children, None)
+                self._import_node(source_child, at=child_at, ignorecontent_parent_flag=ignorecontent)
+                destination_node_child = next(destination_node_children, None)
+                position += 1
+            else:
+                exact_match = False
+                # Source does not match destination. It is added, but only if the tag is mapped to a style.
+                if not ignorecontent and source_child.tag in self.style_mapping.character_style_mapping.keys():
+                    self._import_new_node(source_child, at, element_id)
+
+        if destination_node_child is not None:
+            exact_match = False
+        if not exact_match:
+            self._move_siblings_content(at, element_id)
 
     def _clear_destination(self, source_node, at):
-        """ Remove content marked for removal before importing XML. """
+        """ Remove content marked for removal before importing XML.
+
+        Return True if some content has been removed. """
 
         element_id = self.xml_structure.xpath(at)[0].get("Self")
         items = dict(source_node.items())
+        cleared = False
 
         content_flags = items.get(SETCONTENT_TAG, "").split(',')
         if "clear" in content_flags:
             story = self.get_story_object_by_xpath(at)
             story.remove_children(element_id, keep_style=True, synchronize=True)
             self._xml_structure.xpath(at)[0].clear()
+            cleared = True
 
         source_node_children = source_node.getchildren()
         if len(source_node_children):
@@ -483,16 +803,18 @@ class IDMLPackage(zipfile.ZipFile):
             if destination_node_children_tags == source_node_children_tags:
                 for s, d in zip(source_node_children,
                                 [self.xml_structure_tree.getpath(c) for c in destination_node_children]):
-                    self._clear_destination(s, at=d)
+                    cleared = self._clear_destination(s, at=d) or cleared
 
             # Step-by-step iteration.
             else:
                 destination_node_child = next(destination_node_children, None)
                 for source_child in source_node_children:
                     if destination_node_child is not None and source_child.tag == destination_node_child.tag:
-                        self._clear_destination(source_child,
-                                                at=self.xml_structure_tree.getpath(destination_node_child))
+                        cleared = self._clear_destination(
+                            source_child, at=self.xml_structure_tree.getpath(destination_node_child)
+                        ) or cleared
                         destination_node_child = next(destination_node_children, None)
+        return cleared
 
     @use_working_copy
     def import_pdf(self, pdf_path, at, crop="CropContentVisibleLayers", page_number=1):
@@ -524,6 +846,34 @@ class IDMLPackage(zipfile.ZipFile):
         spread.synchronize()
         return self
 
+    @use_working_copy
+    def set_contents(self, contents):
+        """Replace the text of many XML elements: `contents' maps a xpath in the xml_structure or a
+        XMLElement id to its new text.
+
+        Only the <Content> nodes of the elements are rewritten (like an import_xml() with no
+        attributes nor children) and each Story is written once. """
+        structure_nodes = None
+        contents_by_story = {}
+        for key, content in contents.items():
+            if key.startswith("/"):
+                xml_element = self.xml_structure.xpath(key)[0]
+            else:
+                if structure_nodes is None:
+                    structure_nodes = {node.get("Self"): node for node in self.xml_structure.iter()}
+                xml_element = structure_nodes[key]
+            story = self.get_story_object_by_xml_element(xml_element)
+            story, story_contents = contents_by_story.setdefault(story.name, (story, []))
+            story_contents.append((xml_element.get("Self"), content))
+
+        for story, story_contents in contents_by_story.values():
+            xml_elements = story.get_xml_elements_by_id()
+            story.mark_modified()
+            for element_id, content in story_contents:
+                story.set_xml_element_content(XMLElement(xml_elements[element_id]), content or "")
+            story.synchronize()
+        return self
+
     @use_working_copy
     def set_attributes(self, xpath, items, element_id=None):
         element_id = element_id or self.xml_structure.xpath(xpath)[0].get("Self")
@@ -547,6 +897,126 @@ class IDMLPackage(zipfile.ZipFile):
         story.synchronize()
         return self
 
+    @use_working_copy
+    def set_attributes_bulk(self, attributes):
+        """Like set_attributes() for many XML elements: `attributes' maps a xpath in the
+        xml_structure to the attributes of its XMLElement.
+
+        The work is grouped by Story and Spread and each file is written once. """
+        attributes_by_story = {}
+        for xpath, items in attributes.items():
+            xml_element = self.xml_structure.xpath(xpath)[0]
+            story = self.get_story_object_by_xml_element(xml_element)
+            story, story_attributes = attributes_by_story.setdefault(story.name, (story, []))
+            story_attributes.append((xml_element.get("Self"), xml_element.get("XMLContent"), items))
+
+        spread_elements = None
+        spreads_to_synchronize = {}
+        for story, story_attributes in attributes_by_story.values():
+            xml_elements = story.get_xml_elements_by_id()
+            story.mark_modified()
+            story_elements = None
+            for element_id, element_content_id, items in story_attributes:
+                XMLElement(xml_elements[element_id]).set_attributes(items)
+                if "href" not in items:
+                    continue
+
+                # Image references must be updated in the page item in Spread or Story.
+                resource_path = items.get("href")
+                if spread_elements is None:
+                    spread_elements = self._get_spread_elements_by_id()
+                spread, by_self, by_parent_story = spread_elements.get(element_content_id, (None, {}, {}))
+                if resource_path == "":
+                    story.remove_elt_page_items(xml_elements[element_id])
+                    if spread:
+                        elt = by_self.pop(element_content_id, None)
+                        if elt is None:
+                            elt = by_parent_story.pop(element_content_id, None)
+                        if elt is None:
+                            raise IndexError(f"No page item left for the XMLElement '{element_id}' "
+                                             f"(XMLContent '{element_content_id}').")
+                        elt.getparent().remove(elt)
+                        spread.mark_modified()
+                        spreads_to_synchronize[spread.name] = spread
+                else:
+                    if story_elements is None:
+                        story_elements = story.get_elements_by_id()
+                    if element_content_id in story_elements:
+                        story.set_elt_resource_path(story_elements[element_content_id], resource_path)
+                    if spread and element_content_id in by_self and \
+                       spread.set_elt_resource_path(by_self[element_content_id], resource_path):
+                        spreads_to_synchronize[spread.name] = spread
+            story.synchronize()
+
+        for spread in spreads_to_synchronize.values():
+            spread.synchronize()
+        return self
+
+    def _get_spread_elements_by_id(self):
+        """Map the ids of the Spreads elements (`Self' or `ParentStory') to a tuple
+        (spread, elements by Self, elements by ParentStory) like get_spread_object_by_id() does. """
+        spread_elements = {}
+        for spread in self.spreads_objects:
+            by_self = spread.get_elements_by_id()
+            by_parent_story = spread.get_elements_by_id("ParentStory")
+            for elt_id in itertools.chain(by_self, by_parent_story):
+                spread_elements.setdefault(elt_id, (spread, by_self, by_parent_story))
+        return spread_elements
+
+    @use_working_copy
+    def relink(self, rewrite, check_files=False, workers=None, report=None):
+        """Rewrite the `LinkResourceURI' of every <Link> of the Spreads and the Stories.
+
+        `rewrite' is either a callable returning the new URI of an URI (None to keep it) or a dict
+        mapping URI prefixes to their replacement (the longest prefix wins).
+        With `check_files' the `file:' URIs are checked on the local filesystem using a pool of
+        `workers' threads.
+        `report', if given, is a dict filled with the "changed" links as
+        (filename, link id, old URI, new URI) and the "missing" ones as (filename, link id, URI). """
+        if callable(rewrite):
+            rewrite_uri = rewrite
+        else:
+            prefixes = sorted(rewrite, key=len, reverse=True)
+
+            def rewrite_uri(uri):
+                for prefix in prefixes:
+                    if uri.startswith(prefix):
+                        return f"{rewrite[prefix]}{uri[len(prefix):]}"
+                return None
+
+        changed = []
+        links = []
+        for idml_xml_file in itertools.chain(self.spreads_objects,
+                                             (self.get_idml_xml_file(s) for s in self.stories)):
+            file_changed = False
+            for link in idml_xml_file.dom.iter("Link"):
+                uri = link.get("LinkResourceURI")
+                if uri is None:
+                    continue
+                new_uri = rewrite_uri(uri)
+                if new_uri is not None and new_uri != uri:
+                    link.set("LinkResourceURI", new_uri)
+                    changed.append((idml_xml_file.name, link.get("Self"), uri, new_uri))
+                    file_changed = True
+                    uri = new_uri
+                links.append((idml_xml_file.name, link.get("Self"), uri))
+            if file_changed:
+                idml_xml_file.synchronize()
+
+        missing = []
+        if check_files:
+            paths = list({uri_to_path(uri) for name, link_id, uri in links} - {None})
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                exists = dict(zip(paths, executor.map(os.path.exists, paths)))
+            # URIs that are not `file:' ones cannot be checked.
+            missing = [(name, link_id, uri) for name, link_id, uri in links
+                       if not exists.get(uri_to_path(uri), True)]
+
+        if report is not None:
+            report["changed"] = changed
+            report["missing"] = missing
+        return self
+
     def export_as_tree(self):
         """
         tree = {
@@ -607,29 +1077,34 @@ class IDMLPackage(zipfile.ZipFile):
         """ Reproduce the action «Export XML» on a XML Element in InDesign® Structure. """
         tree = self.export_as_tree()
         dom = tree_to_etree_dom(tree)
-        return etree.tostring(dom, encoding=encoding, pretty_print=True).decode("utf-8")
+        return etree.tostring(dom, encoding=encoding,
+                              pretty_print=self.serialization == SERIALIZATION_PRETTY).decode("utf-8")
 
     @use_working_copy
-    def prefix(self, prefix):
+    def prefix(self, prefix, workers=None):
         """Change references and filename by inserting `prefix' everywhere.
 
         files in ZipFile cannot be renamed or moved so we make a copies of them.
+        The files are processed in a pool of `workers' threads.
         """
         if not re.match(r"^\w+$", prefix):
             raise BaseException("Prefix must be alphanumeric.")
 
         # Change the references inside the file.
-        for filename in self.namelist():
-            if (
-                os.path.basename(filename) in ["container.xml", "metadata.xml"] or
-                os.path.splitext(filename)[1] != ".xml"
-            ):
-                continue
+        def prefix_references(filename):
             idml_xml_file = get_idml_xml_file_by_name(self, filename, self.working_copy_path)
             idml_xml_file.prefix_references(prefix)
             idml_xml_file.synchronize()
 
+        filenames = [filename for filename in self.namelist()
+                     if os.path.basename(filename) not in ["container.xml", "metadata.xml"] and
+                     os.path.splitext(filename)[1] == ".xml"]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() to raise the exceptions.
+            list(executor.map(prefix_references, filenames))
+
         # Story and Spread XML files are "prefixed".
+        renamed = {}
         for filename in self.contentfile_namelist():
             new_basename = prefix_content_filename(os.path.basename(filename),
                                                    prefix, "filename")
@@ -637,6 +1112,8 @@ class IDMLPackage(zipfile.ZipFile):
             old_name = os.path.join(self.working_copy_path, filename)
             new_name = os.path.join(os.path.dirname(old_name), new_basename)
             os.rename(old_name, new_name)
+            renamed[filename] = f"{os.path.dirname(filename)}/{new_basename}"
+        self.rename_members(renamed)
 
         # Update designmap.xml.
         self.designmap.prefix(prefix)
@@ -811,7 +1288,7 @@ class IDMLPackage(zipfile.ZipFile):
         """ Append idml_package spread elements into self.spread[0] <Spread> node. """
 
         spread_dest_filename = self.get_spread_by_xpath(at)
-        spread_dest = Spread(self, spread_dest_filename, self.working_copy_path)
+        spread_dest = self.get_idml_xml_file(spread_dest_filename)
         spread_dest_elt = spread_dest.dom.xpath("./Spread")[0]
 
         only_node = idml_package.xml_structure.xpath(only)[0]
@@ -895,13 +1372,13 @@ class IDMLPackage(zipfile.ZipFile):
         # We don't want to lose the XMLContent referencing the spread page item.
         # Neither we want to wipe the page item out from the spread.
         # To keep the document valid, the solution is to create a proxy story.
-        if content_ref and (content_ref not in self.story_ids):
+        if content_ref and not self.has_story(content_ref):
             self.add_story_with_content(content_ref, xml_element_dest_id, xml_element_dest.tag)
             self.xml_element_leaf_to_node(at, content_ref)
             xml_element_dest = self.xml_structure.xpath(at)[0]
 
         story_dest_filename = self.get_story_by_xpath(at)
-        story_dest = Story(self, story_dest_filename, self.working_copy_path)
+        story_dest = self.get_idml_xml_file(story_dest_filename)
         story_dest_elt = story_dest.get_element_by_id(xml_element_dest_id)
 
         story_src_elt_copy = copy.copy(story_src_elt)
@@ -919,6 +1396,7 @@ class IDMLPackage(zipfile.ZipFile):
         for filename in idml_package.stories_for_node(only):
             with open(os.path.join(self.working_copy_path, filename), mode="wb+") as story_cp:
                 story_cp.write(idml_package.open(filename, mode="r").read())
+            self.register_member(filename)
 
         # Update designmap.xml.
         self.designmap.add_stories(idml_package.story_ids_for_node(only))
@@ -1007,6 +1485,7 @@ class IDMLPackage(zipfile.ZipFile):
             os.path.join(working_copy_path, self.last_spread.name),
             new_spread_wc_path
         )
+        self.register_member(new_spread_name)
         self._spreads = None  # pylint: disable=attribute-defined-outside-init
         self._spreads_objects = None  # pylint: disable=attribute-defined-outside-init
         self._last_spread = None  # pylint: disable=attribute-defined-outside-init
@@ -1049,8 +1528,8 @@ class IDMLPackage(zipfile.ZipFile):
         result = None
         for spread in self.spreads_objects:
             if (
-                spread.get_element_by_id(elt_id, tag="*") is not None or
-                spread.get_element_by_id(elt_id, tag="*", attr="ParentStory") is not None
+                spread.get_element_by_id(elt_id, tag="*", readonly=True) is not None or
+                spread.get_element_by_id(elt_id, tag="*", attr="ParentStory", readonly=True) is not None
             ):
                 result = spread
             # FIXME: That's ugly. return spread here ?
@@ -1094,7 +1573,10 @@ class IDMLPackage(zipfile.ZipFile):
             self.get_spread_element_layer_id(spread_element.getparent())
 
     def get_story_object_by_xpath(self, xpath):
-        xml_element = self.xml_structure.xpath(xpath)[0]
+        return self.get_story_object_by_xml_element(self.xml_structure.xpath(xpath)[0])
+
+    def get_story_object_by_xml_element(self, xml_element):
+        """The Story of a node of the xml_structure. """
 
         def get_story_name(xml_element):
             ref = xml_element.get("XMLContent")
@@ -1109,14 +1591,13 @@ class IDMLPackage(zipfile.ZipFile):
 
         # Some XMLElement store a reference which is not a Story.
         # In that case, the Story is the parent's Story.
-        if (story_name not in self.story_ids) and (story_name is not BACKINGSTORY):
-            xpath = self.xml_structure_tree.getpath(xml_element.getparent())
-            story = self.get_story_object_by_xpath(xpath)
+        if not self.has_story(story_name) and (story_name is not BACKINGSTORY):
+            story = self.get_story_object_by_xml_element(xml_element.getparent())
         else:
             if story_name == BACKINGSTORY:
-                story = BackingStory(self)
+                story = self.get_idml_xml_file(BACKINGSTORY)
             else:
-                story = Story(self, f"{STORIES_DIRNAME}/Story_{story_name}.xml")
+                story = self.get_idml_xml_file(f"{STORIES_DIRNAME}/Story_{story_name}.xml")
         story.working_copy_path = self.working_copy_path
         return story
 
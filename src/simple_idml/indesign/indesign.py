@@ -1,36 +1,97 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
 import ntpath
 import os
+import queue
+import tempfile
+import threading
+import time
 
+from contextlib import contextmanager
 from xml.sax import SAXParseException
 from zipfile import ZipFile
 
+from suds.cache import ObjectCache
 from suds.client import Client
 
 from simple_idml import exceptions
 from simple_idml import ftp
 from simple_idml.decorators import simple_decorator
+from simple_idml.utils import run_blocking
 
 CURRENT_DIR = os.path.abspath(os.path.split(__file__)[0])
 SCRIPTS_DIR = os.path.join(CURRENT_DIR, "scripts")
+WSDL_CACHE_DIR = os.path.join(tempfile.gettempdir(), "simpleidml-wsdl")
+
+
+class ClientPool(object):
+    """A thread-safe pool of SOAP clients keyed by server URL.
+
+    A client is used by one thread at a time and returned to the pool after use.
+    New clients read the parsed WSDL from an on-disk cache shared between processes
+    instead of downloading it again.
+    """
+
+    def __init__(self, cache_location=WSDL_CACHE_DIR, cache_days=1):
+        self.cache_location = cache_location
+        self.cache_days = cache_days
+        self.lock = threading.Lock()
+        self.idle_clients = {}
+
+    def checkout(self, server_url):
+        with self.lock:
+            idle_clients = self.idle_clients.get(server_url)
+            if idle_clients:
+                return idle_clients.pop()
+
+        cache = ObjectCache(location=self.cache_location, days=self.cache_days)
+        client = Client(f"{server_url}/service?wsdl", cache=cache)
+        client.set_options(location=server_url)
+        return client
+
+    def checkin(self, server_url, client):
+        with self.lock:
+            self.idle_clients.setdefault(server_url, []).append(client)
+
+    @contextmanager
+    def client(self, server_url):
+        client = self.checkout(server_url)
+        try:
+            yield client
+        finally:
+            self.checkin(server_url, client)
+
+    def clear(self):
+        with self.lock:
+            self.idle_clients.clear()
+
+
+client_pool = ClientPool()
 
 
 class InDesignSoapScript(object):
     javascript_basename = None
+    # The files included by the script (#include), copied next to it.
+    javascript_includes = ()
 
     def __init__(self, server_url, client_workdir, server_workdir, server_path_style="posix",
-                 ftp_params=None, clean_workdir=True, logger=None, logger_extra=None):
+                 ftp_params=None, clean_workdir=True, logger=None, logger_extra=None, transport=None):
         self.client = None
         self.javascript_client_copy_filename = None
         self.javascript_server_copy_filename = None
+        self.javascript_includes_client_copy_filenames = []
         self.params = None
 
         self.server_url = server_url
         self.client_workdir = client_workdir
         self.server_workdir = server_workdir
         self.ftp_params = ftp_params
+        self.transport = ftp.get_transport(ftp_params, transport)
         self.clean_workdir = clean_workdir
 
         if not logger:
@@ -42,20 +103,32 @@ class InDesignSoapScript(object):
         self.server_path_mod = ntpath if server_path_style == "windows" else os.path
 
     def execute(self):
+        return self.collect(self.render())
+
+    def render(self):
+        """Run the script on the server, leaving its output files in the working directory. """
         self.copy_script_on_working_directory()
 
-        self.client = Client(f"{self.server_url}/service?wsdl")
-        self.client.set_options(location=self.server_url)
-        self.set_params()
-        return self.runscript()
+        with client_pool.client(self.server_url) as self.client:
+            self.set_params()
+            return self.call_runscript()
+
+    def collect(self, response):
+        """Fetch the output files of a `render()' call. """
+        return self.runscript_extra(response)
 
     def copy_script_on_working_directory(self):
         javascript_master_filename = os.path.join(SCRIPTS_DIR, self.javascript_basename)
         self.javascript_client_copy_filename = os.path.join(self.client_workdir, self.javascript_basename)
         self.javascript_server_copy_filename = self.server_path_mod.join(self.server_workdir,
                                                                          self.javascript_basename)
-        ftp.copy(javascript_master_filename, self.javascript_client_copy_filename,
-                 self.ftp_params, src_open_mode="rb")
+        self.transport.copy(javascript_master_filename, self.javascript_client_copy_filename,
+                            src_open_mode="rb")
+        self.javascript_includes_client_copy_filenames = []
+        for basename in self.javascript_includes:
+            client_copy_filename = os.path.join(self.client_workdir, basename)
+            self.transport.copy(os.path.join(SCRIPTS_DIR, basename), client_copy_filename, src_open_mode="rb")
+            self.javascript_includes_client_copy_filenames.append(client_copy_filename)
 
     def set_params(self):
         self.params = self.client.factory.create("ns0:RunScriptParameters")
@@ -63,6 +136,9 @@ class InDesignSoapScript(object):
         self.params.scriptFile = self.javascript_server_copy_filename
 
     def runscript(self):
+        return self.runscript_extra(self.call_runscript())
+
+    def call_runscript(self):
         self.logger.debug('Calling SOAP "RunScript" service (params: %s)', self.params, extra=self.logger_extra)
         try:
             response = self.client.service.RunScript(self.params)
@@ -78,9 +154,10 @@ class InDesignSoapScript(object):
             self.logger.debug('"RunScript" successful! Response: %s', response, extra=self.logger_extra)
         finally:
             if self.clean_workdir:
-                ftp.unlink(self.javascript_client_copy_filename, self.ftp_params)
+                self.transport.unlink(self.javascript_client_copy_filename)
+                for client_copy_filename in self.javascript_includes_client_copy_filenames:
+                    self.transport.unlink(client_copy_filename)
 
-        response = self.runscript_extra(response)
         return response
 
     def runscript_extra(self, response):
@@ -97,9 +174,10 @@ class CloseAllDocuments(InDesignSoapScript):
 
 class SaveAsBase(InDesignSoapScript):
     def __init__(self, src_name, dst_format, js_params, server_url, client_workdir, server_workdir,
-                 server_path_style="posix", ftp_params=None, clean_workdir=True, logger=None, logger_extra=None):
+                 server_path_style="posix", ftp_params=None, clean_workdir=True, logger=None, logger_extra=None,
+                 transport=None):
         super().__init__(server_url, client_workdir, server_workdir, server_path_style,
-                         ftp_params, clean_workdir, logger, logger_extra)
+                         ftp_params, clean_workdir, logger, logger_extra, transport)
         self.js_params = js_params
         self.dst_format = dst_format
 
@@ -139,9 +217,9 @@ class SaveAsBase(InDesignSoapScript):
     def runscript_extra(self, response):
         response = super().runscript_extra(response)
         if response:
-            response = ftp.read(self.response_client_copy_filename, self.ftp_params)
+            response = self.transport.read(self.response_client_copy_filename)
             if self.clean_workdir:
-                ftp.unlink(self.response_client_copy_filename, self.ftp_params)
+                self.transport.unlink(self.response_client_copy_filename)
         return response
 
 
@@ -151,6 +229,7 @@ class SaveAs(SaveAsBase):
 
 class Export(SaveAsBase):
     javascript_basename = "export.jsx"
+    javascript_includes = ("pdf_export.jsxinc",)
 
     def set_params(self):
         super().set_params()
@@ -170,24 +249,89 @@ class PackageForPrint(SaveAsBase):
         # Zip the tree generated in response_client_copy_filename and
         # make that variable point on that zip file.
         zip_filename = f"{self.response_client_copy_filename}.zip"
-        ftp.zip_dir(self.response_client_copy_filename, zip_filename, self.ftp_params)
+        self.transport.zip_dir(self.response_client_copy_filename, zip_filename)
         self.response_client_copy_filename = zip_filename
 
         return super().runscript_extra(response)
 
 
+class SaveAsMulti(InDesignSoapScript):
+    """Open the document once and save it in every format of `formats_options` in one RunScript.
+
+    The response maps each format to the content of its output file.
+    """
+    javascript_basename = "save_as_multi.jsx"
+    javascript_includes = ("pdf_export.jsxinc",)
+
+    def __init__(self, src_name, formats_options, server_url, client_workdir, server_workdir,
+                 server_path_style="posix", ftp_params=None, clean_workdir=True, logger=None, logger_extra=None,
+                 transport=None):
+        super().__init__(server_url, client_workdir, server_workdir, server_path_style,
+                         ftp_params, clean_workdir, logger, logger_extra, transport)
+        self.src_name = src_name
+        self.formats_options = formats_options
+
+        src_rootname = os.path.splitext(self.src_name)[0]
+        self.dst_basenames = {}
+        for format_options in formats_options:
+            fmt = format_options["fmt"]
+            if fmt in self.dst_basenames:
+                raise ValueError(f"Format {fmt} is requested more than once.")
+            # zip is a package directory zipped afterwards.
+            self.dst_basenames[fmt] = src_rootname if fmt == "zip" else f"{src_rootname}TMP.{fmt}"
+
+    def create_script_arg(self, name, value):
+        arg = self.client.factory.create("ns0:IDSP-ScriptArg")
+        arg.name = name
+        arg.value = value
+        return arg
+
+    def set_params(self):
+        super().set_params()
+
+        src_server_copy_filename = self.server_path_mod.join(self.server_workdir, self.src_name)
+        self.params.scriptArgs = [
+            self.create_script_arg("source", src_server_copy_filename),
+            self.create_script_arg("formats", ",".join(self.dst_basenames)),
+        ]
+        for format_options in self.formats_options:
+            fmt = format_options["fmt"]
+            response_server_copy_filename = self.server_path_mod.join(self.server_workdir, self.dst_basenames[fmt])
+            self.params.scriptArgs.append(self.create_script_arg(f"destination_{fmt}", response_server_copy_filename))
+            for k, value in format_options.get("params", {}).items():
+                self.params.scriptArgs.append(self.create_script_arg(f"{fmt}_{k}", value))
+
+    def runscript_extra(self, response):
+        response = super().runscript_extra(response)
+        if not response:
+            return response
+
+        contents = {}
+        for fmt, dst_basename in self.dst_basenames.items():
+            response_client_copy_filename = os.path.join(self.client_workdir, dst_basename)
+            if fmt == "zip":
+                zip_filename = f"{response_client_copy_filename}.zip"
+                self.transport.zip_dir(response_client_copy_filename, zip_filename)
+                response_client_copy_filename = zip_filename
+            contents[fmt] = self.transport.read(response_client_copy_filename)
+            if self.clean_workdir:
+                self.transport.unlink(response_client_copy_filename)
+        return contents
+
+
 @simple_decorator
 def use_dedicated_working_directory(view_func):
     def new_func(src_path, formats_options, indesign_server_url, indesign_client_workdir,
                  indesign_server_workdir, indesign_server_path_style="posix",
-                 clean_workdir=True, ftp_params=None, logger=None, logger_extra=None):
+                 clean_workdir=True, ftp_params=None, logger=None, logger_extra=None, transport=None):
 
+        transport = ftp.get_transport(ftp_params, transport)
         server_path_mod = os.path
         if indesign_server_path_style == "windows":
             server_path_mod = ntpath
 
         # Create a unique sub-directory.
-        working_dir = ftp.mkdir_unique(indesign_client_workdir, ftp_params)
+        working_dir = transport.mkdir_unique(indesign_client_workdir)
 
         # update the *_workdir parameters with the new working dir value.
         indesign_client_workdir = working_dir
@@ -197,12 +341,12 @@ def use_dedicated_working_directory(view_func):
             response = view_func(src_path, formats_options, indesign_server_url,
                                  indesign_client_workdir, indesign_server_workdir,
                                  indesign_server_path_style, clean_workdir, ftp_params,
-                                 logger, logger_extra)
+                                 logger, logger_extra, transport)
         except BaseException as exc:
             raise exc
         finally:
             if clean_workdir:
-                ftp.rmtree(working_dir, ftp_params)
+                transport.rmtree(working_dir)
         return response
     return new_func
 
@@ -211,7 +355,7 @@ def use_dedicated_working_directory(view_func):
 def save_as(src_path, formats_options, indesign_server_url,
             indesign_client_workdir, indesign_server_workdir,
             indesign_server_path_style="posix", clean_workdir=True,
-            ftp_params=None, logger=None, logger_extra=None):
+            ftp_params=None, logger=None, logger_extra=None, transport=None):
     """SOAP call to an InDesign Server to convert an InDesign file. """
 
     if not logger:
@@ -221,26 +365,53 @@ def save_as(src_path, formats_options, indesign_server_url,
 
     src_name = os.path.basename(src_path)
     src_client_copy_filename = os.path.join(indesign_client_workdir, src_name)
-    ftp.copy(src_path, src_client_copy_filename, ftp_params)
+    transport.copy(src_path, src_client_copy_filename)
 
     responses = [
         _save_as(src_name, format_options, indesign_server_url,
                  indesign_client_workdir, indesign_server_workdir,
                  indesign_server_path_style, ftp_params, clean_workdir,
-                 logger, logger_extra) for format_options in formats_options
+                 logger, logger_extra, transport) for format_options in formats_options
     ]
 
     if clean_workdir:
-        ftp.unlink(src_client_copy_filename, ftp_params)
+        transport.unlink(src_client_copy_filename)
 
     return responses
 
 
+@use_dedicated_working_directory
+def save_as_multi(src_path, formats_options, indesign_server_url,
+                  indesign_client_workdir, indesign_server_workdir,
+                  indesign_server_path_style="posix", clean_workdir=True,
+                  ftp_params=None, logger=None, logger_extra=None, transport=None):
+    """SOAP call to an InDesign Server to convert an InDesign file in several formats,
+    opening it only once.
+
+    Returns a dict mapping each format to the converted content.
+    """
+
+    src_name = os.path.basename(src_path)
+    src_client_copy_filename = os.path.join(indesign_client_workdir, src_name)
+    transport.copy(src_path, src_client_copy_filename)
+
+    script = SaveAsMulti(src_name, formats_options, indesign_server_url,
+                         indesign_client_workdir, indesign_server_workdir,
+                         indesign_server_path_style, ftp_params, clean_workdir,
+                         logger, logger_extra, transport)
+    response = script.execute()
+
+    if clean_workdir:
+        transport.unlink(src_client_copy_filename)
+
+    return response
+
+
 @use_dedicated_working_directory
 def export_package_as(package_path, formats_options, indesign_server_url,
                       indesign_client_workdir, indesign_server_workdir,
                       indesign_server_path_style="posix", clean_workdir=True,
-                      ftp_params=None, logger=None, logger_extra=None):
+                      ftp_params=None, logger=None, logger_extra=None, transport=None):
     """SOAP call to an InDesign Server to export a zipped package. """
 
     if not logger:
@@ -249,18 +420,9 @@ def export_package_as(package_path, formats_options, indesign_server_url,
     logger_extra = logger_extra or {}
 
     # Search the relative path of the INDD file in the archive before unpacking.
-    src_relpath = None
-    with ZipFile(package_path) as package_zip:
-        for name in package_zip.namelist():
-            if name.startswith('.'):
-                continue
-            if name.endswith('.indd'):
-                src_relpath = name
-                break
-    if not src_relpath:
-        raise BaseException("No INDD file in the archive.")
+    src_relpath = _get_package_src_relpath(package_path)
 
-    ftp.unpack_archive(package_path, ftp_params, indesign_client_workdir)
+    transport.unpack_archive(package_path, indesign_client_workdir)
 
     # Add the directory that contains the indd to workdir paths.
     dirname, indd_name = os.path.split(src_relpath)
@@ -275,13 +437,32 @@ def export_package_as(package_path, formats_options, indesign_server_url,
         _save_as(indd_name, format_options, indesign_server_url,
                  indesign_client_workdir, indesign_server_workdir,
                  indesign_server_path_style, ftp_params, clean_workdir,
-                 logger, logger_extra) for format_options in formats_options
+                 logger, logger_extra, transport) for format_options in formats_options
     ]
 
 
+def _get_package_src_relpath(package_path):
+    with ZipFile(package_path) as package_zip:
+        for name in package_zip.namelist():
+            if name.startswith('.'):
+                continue
+            if name.endswith('.indd'):
+                return name
+    raise BaseException("No INDD file in the archive.")
+
+
 def _save_as(src_name, format_options, indesign_server_url, indesign_client_workdir,
              indesign_server_workdir, indesign_server_path_style, ftp_params, clean_workdir,
-             logger, logger_extra):
+             logger, logger_extra, transport=None):
+    script = _get_save_as_script(src_name, format_options, indesign_server_url, indesign_client_workdir,
+                                 indesign_server_workdir, indesign_server_path_style, ftp_params,
+                                 clean_workdir, logger, logger_extra, transport)
+    return script.execute()
+
+
+def _get_save_as_script(src_name, format_options, indesign_server_url, indesign_client_workdir,
+                        indesign_server_workdir, indesign_server_path_style, ftp_params, clean_workdir,
+                        logger, logger_extra, transport=None):
     fmt = format_options["fmt"]
     js_params = format_options.get("params", {})
 
@@ -292,8 +473,634 @@ def _save_as(src_name, format_options, indesign_server_url, indesign_client_work
     else:
         klass = SaveAs
 
-    script = klass(src_name, fmt, js_params, indesign_server_url, indesign_client_workdir,
-                   indesign_server_workdir, indesign_server_path_style, ftp_params, clean_workdir,
-                   logger, logger_extra)
+    return klass(src_name, fmt, js_params, indesign_server_url, indesign_client_workdir,
+                 indesign_server_workdir, indesign_server_path_style, ftp_params, clean_workdir,
+                 logger, logger_extra, transport)
+
+
+class ResultCache(object):
+    """A cache of conversion results on the local disk, in `directory'.
+
+    A result is keyed by the content of the source file, the format and its parameters.
+    The least recently used results are evicted when the cache is over `max_size' bytes.
+    """
+
+    def __init__(self, directory, max_size=1024 ** 3):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # The modification time of an entry is its last use.
+        entries = []
+        for name in os.listdir(directory):
+            filename = os.path.join(directory, name)
+            if not name.startswith(".") and os.path.isfile(filename):
+                stat = os.stat(filename)
+                entries.append((stat.st_mtime, name, stat.st_size))
+        self.entries = collections.OrderedDict((name, size) for mtime, name, size in sorted(entries))
+        self.size = sum(self.entries.values())
+        self.evict()
+
+    def get_source_digest(self, src_path):
+        digest = hashlib.sha256()
+        with open(src_path, "rb") as fobj:
+            for chunk in iter(lambda: fobj.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_key(self, source_digest, format_options):
+        options = json.dumps({"fmt": format_options["fmt"], "params": format_options.get("params", {})},
+                             sort_keys=True, default=str)
+        return f"{source_digest}-{hashlib.sha256(options.encode('utf-8')).hexdigest()}"
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        filename = os.path.join(self.directory, key)
+        try:
+            with open(filename, "rb") as fobj:
+                response = fobj.read()
+            os.utime(filename)
+        except FileNotFoundError:
+            # Removed by another process.
+            with self.lock:
+                self.size -= self.entries.pop(key, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return response
 
-    return script.execute()
+    def set(self, key, response):
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix=".", delete=False) as fobj:
+            fobj.write(response)
+        os.replace(fobj.name, os.path.join(self.directory, key))
+        with self.lock:
+            self.size += len(response) - self.entries.pop(key, 0)
+            self.entries[key] = len(response)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            evicted = []
+            while self.size > self.max_size and self.entries:
+                key, size = self.entries.popitem(last=False)
+                self.size -= size
+                self.evictions += 1
+                evicted.append(key)
+        for key in evicted:
+            self.remove_file(key)
+
+    def remove_file(self, key):
+        try:
+            os.unlink(os.path.join(self.directory, key))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, src_path, formats_options=None):
+        """Remove the results of `src_path' (only the ones of `formats_options' if given). """
+        source_digest = self.get_source_digest(src_path)
+        with self.lock:
+            if formats_options is None:
+                keys = [key for key in self.entries if key.startswith(f"{source_digest}-")]
+            else:
+                keys = [key for key in (self.get_key(source_digest, format_options)
+                                        for format_options in formats_options) if key in self.entries]
+            for key in keys:
+                self.size -= self.entries.pop(key)
+        for key in keys:
+            self.remove_file(key)
+
+    def clear(self):
+        with self.lock:
+            keys = list(self.entries)
+            self.entries.clear()
+            self.size = 0
+        for key in keys:
+            self.remove_file(key)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "size": self.size,
+            }
+
+    def convert(self, func, src_path, formats_options, *args, **kwargs):
+        """Return the responses of `func(src_path, formats_options, *args, **kwargs)'
+        (`save_as' or `export_package_as'), calling it only for the formats not in the cache.
+        """
+        source_digest = self.get_source_digest(src_path)
+        keys = [self.get_key(source_digest, format_options) for format_options in formats_options]
+        responses = [self.get(key) for key in keys]
+
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if missing:
+            missing_responses = func(src_path, [formats_options[i] for i in missing], *args, **kwargs)
+            for i, response in zip(missing, missing_responses):
+                responses[i] = response
+                if response:
+                    self.set(keys[i], response)
+        return responses
+
+
+# asyncio API.
+# suds and ftplib being blocking, the SOAP calls and the transfers run in the default
+# executor so the event loop is free and concurrent jobs overlap their network waits.
+
+@simple_decorator
+def use_dedicated_working_directory_async(view_func):
+    async def new_func(src_path, formats_options, indesign_server_url, indesign_client_workdir,
+                       indesign_server_workdir, indesign_server_path_style="posix",
+                       clean_workdir=True, ftp_params=None, logger=None, logger_extra=None,
+                       transport=None):
+
+        transport = ftp.get_transport(ftp_params, transport)
+        server_path_mod = os.path
+        if indesign_server_path_style == "windows":
+            server_path_mod = ntpath
+
+        # Create a unique sub-directory.
+        working_dir = await transport.mkdir_unique_async(indesign_client_workdir)
+
+        # update the *_workdir parameters with the new working dir value.
+        indesign_client_workdir = working_dir
+        indesign_server_workdir = server_path_mod.join(indesign_server_workdir, os.path.basename(working_dir))
+
+        # The working directory is also removed when the task is cancelled.
+        try:
+            return await view_func(src_path, formats_options, indesign_server_url,
+                                   indesign_client_workdir, indesign_server_workdir,
+                                   indesign_server_path_style, clean_workdir, ftp_params,
+                                   logger, logger_extra, transport)
+        finally:
+            if clean_workdir:
+                await transport.rmtree_async(working_dir)
+    return new_func
+
+
+@use_dedicated_working_directory_async
+async def save_as_async(src_path, formats_options, indesign_server_url,
+                        indesign_client_workdir, indesign_server_workdir,
+                        indesign_server_path_style="posix", clean_workdir=True,
+                        ftp_params=None, logger=None, logger_extra=None, transport=None):
+    """Asynchronous version of `save_as()'. """
+
+    if not logger:
+        logger = logging.getLogger('simpleidml.indesign')
+        logger.addHandler(logging.NullHandler())
+    logger_extra = logger_extra or {}
+
+    src_name = os.path.basename(src_path)
+    src_client_copy_filename = os.path.join(indesign_client_workdir, src_name)
+    await transport.copy_async(src_path, src_client_copy_filename)
+
+    responses = []
+    for format_options in formats_options:
+        responses.append(await run_blocking(_save_as, src_name, format_options, indesign_server_url,
+                                            indesign_client_workdir, indesign_server_workdir,
+                                            indesign_server_path_style, ftp_params, clean_workdir,
+                                            logger, logger_extra, transport))
+
+    if clean_workdir:
+        await transport.unlink_async(src_client_copy_filename)
+
+    return responses
+
+
+@use_dedicated_working_directory_async
+async def save_as_multi_async(src_path, formats_options, indesign_server_url,
+                              indesign_client_workdir, indesign_server_workdir,
+                              indesign_server_path_style="posix", clean_workdir=True,
+                              ftp_params=None, logger=None, logger_extra=None, transport=None):
+    """Asynchronous version of `save_as_multi()'. """
+
+    src_name = os.path.basename(src_path)
+    src_client_copy_filename = os.path.join(indesign_client_workdir, src_name)
+    await transport.copy_async(src_path, src_client_copy_filename)
+
+    script = SaveAsMulti(src_name, formats_options, indesign_server_url,
+                         indesign_client_workdir, indesign_server_workdir,
+                         indesign_server_path_style, ftp_params, clean_workdir,
+                         logger, logger_extra, transport)
+    response = await run_blocking(script.execute)
+
+    if clean_workdir:
+        await transport.unlink_async(src_client_copy_filename)
+
+    return response
+
+
+@use_dedicated_working_directory_async
+async def export_package_as_async(package_path, formats_options, indesign_server_url,
+                                  indesign_client_workdir, indesign_server_workdir,
+                                  indesign_server_path_style="posix", clean_workdir=True,
+                                  ftp_params=None, logger=None, logger_extra=None, transport=None):
+    """Asynchronous version of `export_package_as()'. """
+
+    if not logger:
+        logger = logging.getLogger('simpleidml.indesign')
+        logger.addHandler(logging.NullHandler())
+    logger_extra = logger_extra or {}
+
+    src_relpath = await run_blocking(_get_package_src_relpath, package_path)
+    await transport.unpack_archive_async(package_path, indesign_client_workdir)
+
+    # Add the directory that contains the indd to workdir paths.
+    dirname, indd_name = os.path.split(src_relpath)
+    indesign_client_workdir = os.path.join(indesign_client_workdir, dirname)
+    server_path_mod = os.path
+    if indesign_server_path_style == "windows":
+        server_path_mod = ntpath
+    indesign_server_workdir = server_path_mod.join(indesign_server_workdir, dirname)
+
+    responses = []
+    for format_options in formats_options:
+        responses.append(await run_blocking(_save_as, indd_name, format_options, indesign_server_url,
+                                            indesign_client_workdir, indesign_server_workdir,
+                                            indesign_server_path_style, ftp_params, clean_workdir,
+                                            logger, logger_extra, transport))
+    return responses
+
+
+class Endpoint(object):
+    """An InDesign Server instance of a `Dispatcher' with its statistics.
+
+    `latency' is an exponential moving average of the job durations (in seconds) and
+    `failures' the number of consecutive failed jobs.
+    """
+
+    def __init__(self, server_url, client_workdir, server_workdir, server_path_style="posix",
+                 ftp_params=None, max_jobs=1, transport=None):
+        self.server_url = server_url
+        self.client_workdir = client_workdir
+        self.server_workdir = server_workdir
+        self.server_path_style = server_path_style
+        self.ftp_params = ftp_params
+        self.transport = transport
+        self.max_jobs = max_jobs
+
+        self.running = 0
+        self.jobs = 0
+        self.errors = 0
+        self.failures = 0
+        self.latency = None
+        self.disabled_until = 0
+
+    def __repr__(self):
+        return f"<Endpoint {self.server_url}>"
+
+    def is_available(self, now):
+        return self.disabled_until <= now
+
+    def get_load(self):
+        return (self.latency or 0) * (self.running + 1)
+
+    def get_stats(self):
+        return {
+            "server_url": self.server_url,
+            "running": self.running,
+            "jobs": self.jobs,
+            "errors": self.errors,
+            "failures": self.failures,
+            "latency": self.latency,
+            "disabled": not self.is_available(time.monotonic()),
+        }
+
+
+class Dispatcher(object):
+    """Spread `save_as()'/`export_package_as()' jobs over several InDesign Server instances.
+
+    `endpoints' is a list of dicts of `Endpoint' parameters. Each endpoint runs at most
+    `max_jobs' jobs at a time. A job goes to the least loaded endpoint (latency times running
+    jobs). An endpoint failing `max_failures' jobs in a row is put aside for `retry_after'
+    seconds and a job that failed on an endpoint is retried up to `retries' times on another
+    one (except when the script itself failed).
+    """
+
+    latency_smoothing = 0.3
+
+    def __init__(self, endpoints, max_jobs=1, max_failures=3, retry_after=60, retries=1,
+                 logger=None, logger_extra=None):
+        self.endpoints = [Endpoint(**dict({"max_jobs": max_jobs}, **endpoint)) for endpoint in endpoints]
+        if not self.endpoints:
+            raise ValueError("A Dispatcher needs at least one endpoint.")
+        self.max_failures = max_failures
+        self.retry_after = retry_after
+        self.retries = retries
+
+        if not logger:
+            logger = logging.getLogger('simpleidml.indesign')
+            logger.addHandler(logging.NullHandler())
+        self.logger = logger
+        self.logger_extra = logger_extra or {}
+
+        self.condition = threading.Condition()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=sum(endpoint.max_jobs for endpoint in self.endpoints)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def submit(self, func, src_path, formats_options, clean_workdir=True):
+        """Schedule `func(src_path, formats_options, ...)' on an endpoint and return a Future.
+
+        `func' is `save_as', `save_as_multi' or `export_package_as'.
+        """
+        return self.executor.submit(self.run, func, src_path, formats_options, clean_workdir)
+
+    def map(self, func, jobs, clean_workdir=True):
+        """Run the (src_path, formats_options) `jobs' and return their responses in order. """
+        futures = [self.submit(func, src_path, formats_options, clean_workdir)
+                   for src_path, formats_options in jobs]
+        return [future.result() for future in futures]
+
+    def run(self, func, src_path, formats_options, clean_workdir=True):
+        tried = set()
+        while True:
+            endpoint = self.acquire_endpoint(tried)
+            tried.add(endpoint)
+            start = time.monotonic()
+            try:
+                response = func(src_path, formats_options, endpoint.server_url,
+                                endpoint.client_workdir, endpoint.server_workdir,
+                                endpoint.server_path_style, clean_workdir, endpoint.ftp_params,
+                                self.logger, self.logger_extra, transport=endpoint.transport)
+            except exceptions.InDesignSoapException as exc:
+                # The script failed, not the server.
+                self.release_endpoint(endpoint, time.monotonic() - start, exc)
+                raise
+            except Exception as exc:
+                self.release_endpoint(endpoint, time.monotonic() - start, exc)
+                if len(tried) > self.retries:
+                    raise
+                self.logger.warning("Job %s failed on %s (%s), retrying on another endpoint.",
+                                    src_path, endpoint.server_url, exc, extra=self.logger_extra)
+            except BaseException:
+                # Interrupted (KeyboardInterrupt, SystemExit...): neither retried nor counted.
+                self.release_endpoint(endpoint)
+                raise
+            else:
+                self.release_endpoint(endpoint, time.monotonic() - start)
+                return response
+
+    def acquire_endpoint(self, exclude=()):
+        """Wait for an endpoint to run a job on and reserve it.
+
+        Endpoints in `exclude' or put aside after failures are only used when there is no other.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                preferred = [endpoint for endpoint in self.endpoints
+                             if endpoint not in exclude and endpoint.is_available(now)]
+                candidates = preferred or self.endpoints
+                free = [endpoint for endpoint in candidates if endpoint.running < endpoint.max_jobs]
+                if free:
+                    endpoint = min(free, key=lambda e: e.get_load())
+                    endpoint.running += 1
+                    return endpoint
+                self.condition.wait()
+
+    def release_endpoint(self, endpoint, duration=None, exc=None):
+        """The job run on `endpoint' is over (`duration' is None if it was interrupted). """
+        with self.condition:
+            endpoint.running -= 1
+            if duration is None:
+                self.condition.notify_all()
+                return
+            endpoint.jobs += 1
+            if exc is None:
+                endpoint.failures = 0
+                if endpoint.latency is None:
+                    endpoint.latency = duration
+                else:
+                    endpoint.latency += self.latency_smoothing * (duration - endpoint.latency)
+            else:
+                endpoint.errors += 1
+                endpoint.failures += 1
+                if endpoint.failures >= self.max_failures:
+                    self.logger.error("Endpoint %s failed %d times in a row, disabled for %s seconds.",
+                                      endpoint.server_url, endpoint.failures, self.retry_after,
+                                      extra=self.logger_extra)
+                    endpoint.disabled_until = time.monotonic() + self.retry_after
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            return [endpoint.get_stats() for endpoint in self.endpoints]
+
+
+# Pipelined conversions.
+# The staging of a source (upload or unpacking), its rendering by the server (SOAP) and
+# the collection of the results (download and cleanup) run in three threads linked by
+# bounded queues, so the transfers of a job overlap the rendering of its neighbours.
+
+class PipelineJob(object):
+    """A source going through a `Pipeline'.
+
+    `responses' is the list of the contents of the converted files and `error' the
+    exception that stopped the job, if any.
+    """
+
+    def __init__(self, src_path):
+        self.src_path = src_path
+        self.working_dir = None
+        self.src_name = None
+        self.client_workdir = None
+        self.server_workdir = None
+        self.renders = []
+        self.responses = None
+        self.error = None
+
+    def __repr__(self):
+        return f"<PipelineJob {self.src_path}>"
+
+
+class Pipeline(object):
+    """Convert a stream of sources in all the `formats_options' on one InDesign Server.
+
+    A source is an InDesign file or a zipped package (`.zip'). At most `queue_size' jobs
+    wait between two stages. The results come out in the order of the sources.
+    """
+    # The exceptions failing a job, the others stop the pipeline.
+    job_errors = (Exception, exceptions.InDesignSoapException)
+
+    def __init__(self, formats_options, indesign_server_url, indesign_client_workdir,
+                 indesign_server_workdir, indesign_server_path_style="posix", clean_workdir=True,
+                 ftp_params=None, logger=None, logger_extra=None, transport=None, queue_size=2):
+        self.formats_options = formats_options
+        self.server_url = indesign_server_url
+        self.client_workdir = indesign_client_workdir
+        self.server_workdir = indesign_server_workdir
+        self.server_path_style = indesign_server_path_style
+        self.server_path_mod = ntpath if indesign_server_path_style == "windows" else os.path
+        self.clean_workdir = clean_workdir
+        self.ftp_params = ftp_params
+        self.transport = ftp.get_transport(ftp_params, transport)
+        self.queue_size = queue_size
+
+        if not logger:
+            logger = logging.getLogger('simpleidml.indesign')
+            logger.addHandler(logging.NullHandler())
+        self.logger = logger
+        self.logger_extra = logger_extra or {}
+
+    def run(self, sources):
+        """Yield a (src_path, responses, error) tuple per source of `sources'.
+
+        A failed job does not stop the others: its `error' is the exception raised. Any other
+        exception (from `sources', KeyboardInterrupt...) stops the pipeline and is raised once
+        the working directories are removed.
+        """
+        render_queue = queue.Queue(self.queue_size)
+        collect_queue = queue.Queue(self.queue_size)
+        result_queue = queue.Queue(self.queue_size)
+        stopped = threading.Event()
+        interruptions = []
+        threads = [
+            threading.Thread(target=self.stage, args=(sources, render_queue, stopped, interruptions)),
+            threading.Thread(target=self.render, args=(render_queue, collect_queue, stopped, interruptions)),
+            threading.Thread(target=self.collect, args=(collect_queue, result_queue, stopped, interruptions)),
+        ]
+        for thread in threads:
+            thread.start()
+
+        # The jobs already staged are still collected, and their working directory removed,
+        # when the caller stops iterating.
+        try:
+            while not interruptions:
+                try:
+                    job = result_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if job is None:
+                    break
+                yield job.src_path, job.responses, job.error
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+        if interruptions:
+            raise interruptions[0]
+
+    def interrupt(self, exc, stopped, interruptions):
+        interruptions.append(exc)
+        stopped.set()
+
+    def stage(self, sources, render_queue, stopped, interruptions):
+        try:
+            for src_path in sources:
+                if stopped.is_set():
+                    break
+                job = PipelineJob(src_path)
+                try:
+                    self.stage_job(job)
+                except self.job_errors as exc:
+                    job.error = exc
+                finally:
+                    # Even when interrupted, collect() removes the working directory.
+                    render_queue.put(job)
+        except BaseException as exc:
+            self.interrupt(exc, stopped, interruptions)
+        finally:
+            render_queue.put(None)
+
+    def stage_job(self, job):
+        job.working_dir = self.transport.mkdir_unique(self.client_workdir)
+        job.client_workdir = job.working_dir
+        job.server_workdir = self.server_path_mod.join(self.server_workdir, os.path.basename(job.working_dir))
+
+        if job.src_path.endswith(".zip"):
+            src_relpath = _get_package_src_relpath(job.src_path)
+            self.transport.unpack_archive(job.src_path, job.working_dir)
+            dirname, job.src_name = os.path.split(src_relpath)
+            job.client_workdir = os.path.join(job.client_workdir, dirname)
+            job.server_workdir = self.server_path_mod.join(job.server_workdir, dirname)
+        else:
+            job.src_name = os.path.basename(job.src_path)
+            self.transport.copy(job.src_path, os.path.join(job.client_workdir, job.src_name))
+
+    def render(self, render_queue, collect_queue, stopped, interruptions):
+        while True:
+            job = render_queue.get()
+            if job is None:
+                collect_queue.put(None)
+                return
+            if job.error is None and not stopped.is_set():
+                try:
+                    for format_options in self.formats_options:
+                        script = _get_save_as_script(job.src_name, format_options, self.server_url,
+                                                     job.client_workdir, job.server_workdir,
+                                                     self.server_path_style, self.ftp_params,
+                                                     self.clean_workdir, self.logger, self.logger_extra,
+                                                     self.transport)
+                        job.renders.append((script, script.render()))
+                except self.job_errors as exc:
+                    job.error = exc
+                except BaseException as exc:
+                    self.interrupt(exc, stopped, interruptions)
+            collect_queue.put(job)
+
+    def collect(self, collect_queue, result_queue, stopped, interruptions):
+        while True:
+            job = collect_queue.get()
+            if job is None:
+                self.put_result(result_queue, None, stopped)
+                return
+            try:
+                if job.error is None and not stopped.is_set():
+                    job.responses = [script.collect(response) for script, response in job.renders]
+            except self.job_errors as exc:
+                job.error = exc
+            except BaseException as exc:
+                self.interrupt(exc, stopped, interruptions)
+            finally:
+                if self.clean_workdir and job.working_dir:
+                    try:
+                        self.transport.rmtree(job.working_dir)
+                    except Exception as exc:
+                        self.logger.error("Removing %s failed: %s", job.working_dir, exc,
+                                          extra=self.logger_extra)
+            self.put_result(result_queue, job, stopped)
+
+    def put_result(self, result_queue, job, stopped):
+        # Nobody reads the results any more once the pipeline is stopped.
+        while not stopped.is_set():
+            try:
+                result_queue.put(job, timeout=0.1)
+            except queue.Full:
+                continue
+            return
+
+
+def save_as_pipeline(sources, formats_options, indesign_server_url,
+                     indesign_client_workdir, indesign_server_workdir,
+                     indesign_server_path_style="posix", clean_workdir=True,
+                     ftp_params=None, logger=None, logger_extra=None, transport=None, queue_size=2):
+    """Convert the InDesign files or zipped packages of `sources' one after the other,
+    overlapping their transfers with the rendering of the other jobs.
+
+    Yield a (src_path, responses, error) tuple per source, in order.
+    """
+    pipeline = Pipeline(formats_options, indesign_server_url, indesign_client_workdir,
+                        indesign_server_workdir, indesign_server_path_style, clean_workdir,
+                        ftp_params, logger, logger_extra, transport, queue_size)
+    return pipeline.run(sources)
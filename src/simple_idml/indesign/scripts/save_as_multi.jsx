@@ -0,0 +1,51 @@
+/* Open a document once and save it in several formats.
+ *
+ * Script arguments:
+ *   - source: the document to open.
+ *   - formats: comma-separated list of the formats (indd, idml, pdf, jpeg, zip).
+ *   - destination_<format>: the output path for each format (a directory for zip).
+ *   - <format>_<param>: extra parameters of a format (see pdf_export.jsxinc).
+ *
+ * The result is a JSON object mapping each format to its output path.
+ */
+#include "pdf_export.jsxinc"
+
+function createPackage(doc, dst_dir) {
+    doc.packageForPrint(dst_dir, true, true, true, true, false, true, true, false, false, "", "", false);
+}
+
+var src_file = new File(app.scriptArgs.get("source"));
+var formats = app.scriptArgs.get("formats").split(",");
+var result = [];
+
+app.open(src_file);
+var myDocument = app.documents.item(0);
+updateLinks(myDocument);
+
+try {
+    for (var i = 0; i < formats.length; i++) {
+        var format = formats[i];
+        var dst_filename = app.scriptArgs.get("destination_" + format);
+        var getArg = (function(prefix) {
+            return function(name) { return app.scriptArgs.get(prefix + name); };
+        })(format + "_");
+
+        if (format === "pdf") {
+            exportPDF(myDocument, new File(dst_filename), getArg);
+        } else if (format === "jpeg") {
+            myDocument.exportFile(ExportFormat.JPG, new File(dst_filename));
+        } else if (format === "idml") {
+            myDocument.exportFile(ExportFormat.INDESIGN_MARKUP, new File(dst_filename));
+        } else if (format === "zip") {
+            createPackage(myDocument, dst_filename);
+        } else {
+            myDocument.saveACopy(new File(dst_filename));
+        }
+        result.push('"' + format + '": "' + dst_filename.replace(/\\/g, "\\\\").replace(/"/g, '\\"') + '"');
+    }
+}
+finally {
+    myDocument.close(SaveOptions.no);
+}
+
+"{" + result.join(", ") + "}";
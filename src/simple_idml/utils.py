@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import collections
+import concurrent.futures
 import copy
+import functools
 import os
 import re
+import threading
+import zipfile
+from urllib.parse import unquote, urlparse
 from lxml import etree
 
 rx_numbered = re.compile(r"(.*?)(\d+)")
@@ -10,6 +17,8 @@ rx_xmltag_sibling_id = re.compile(r"(.*?d.*i)(\d+)")
 rx_contentfile_ref = re.compile(r"^(Stories/Story_|Spreads/Spread_)(.+\.xml)$")
 rx_contentfile_name = re.compile(r"^(Story_|Spread_)(.+\.xml)$")
 
+_thread_local = threading.local()
+
 
 def increment_filename(filename):
     dirname = os.path.dirname(filename)
@@ -65,6 +74,84 @@ def str_is_prefixed(prefix, strng):
     return False
 
 
+def get_xml_parser(**options):
+    """An etree.XMLParser created once per thread and per `options' (a parser
+    cannot be used by several threads at the same time). """
+    parsers = getattr(_thread_local, "xml_parsers", None)
+    if parsers is None:
+        parsers = _thread_local.xml_parsers = {}
+    key = tuple(sorted(options.items()))
+    parser = parsers.get(key)
+    if parser is None:
+        parser = parsers[key] = etree.XMLParser(**options)
+    return parser
+
+
+def zip_members(zfile, members, compresslevel=None, stored=(), workers=None):
+    """Write `members', a list of (filename, arcname), in the ZipFile `zfile'.
+
+    The files are deflated at `compresslevel' (all are stored if None) except the
+    `stored' arcnames. The files are read ahead in a pool of `workers' threads, the
+    members are deflated and written in order, one at a time, by the calling thread. """
+    if compresslevel is None:
+        for filename, arcname in members:
+            zfile.write(filename, arcname, compress_type=zipfile.ZIP_STORED)
+        return
+
+    def read(filename, arcname):
+        zinfo = zipfile.ZipInfo.from_file(filename, arcname)
+        if zinfo.is_dir():
+            return filename, zinfo, None
+        with open(filename, "rb") as fobj:
+            return filename, zinfo, fobj.read()
+
+    # Bound the number of files waiting in memory.
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for filename, arcname in members:
+            pending.append(executor.submit(read, filename, arcname))
+            if len(pending) > max_pending:
+                _write_zip_member(zfile, *pending.popleft().result(), compresslevel, stored)
+        while pending:
+            _write_zip_member(zfile, *pending.popleft().result(), compresslevel, stored)
+
+
+def _write_zip_member(zfile, filename, zinfo, data, compresslevel, stored):
+    if data is None:
+        zfile.write(filename, zinfo.filename, compress_type=zipfile.ZIP_STORED)
+        return
+    if zinfo.filename in stored:
+        zinfo.compress_type = zipfile.ZIP_STORED
+        zfile.writestr(zinfo, data)
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zfile.writestr(zinfo, data, compresslevel=compresslevel)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Await the blocking `func(*args, **kwargs)' run in the default executor.
+
+    If the awaiting task is cancelled, `func' is let finish before the cancellation is
+    propagated so the caller can safely clean up what `func' works on.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+
+def uri_to_path(uri):
+    """The local path of a `file:' URI (as in <Link LinkResourceURI="...">), None for other schemes. """
+    parsed_uri = urlparse(uri)
+    if parsed_uri.scheme != "file":
+        return None
+    return unquote(parsed_uri.path)
+
+
 class Proxy(object):
     def __init__(self, target):
         self._target = target
@@ -82,36 +169,118 @@ def tree_to_etree_dom(tree):
         "content": ["foo", {subtree}, "bar", ...]
     }
 
+    The tree is walked iteratively and the last child of each node is tracked
+    so the conversion is linear in the number of nodes, whatever the depth.
     """
 
-    def _set_node_content(node, tree):
-        for c in tree["content"]:
+    dom = etree.Element(tree["tag"], tree.get("attrs", {}))
+    # [node, iterator over the remaining content, last child appended].
+    stack = [[dom, iter(tree["content"]), None]]
+    while stack:
+        frame = stack[-1]
+        node, contents = frame[0], frame[1]
+        for c in contents:
             if isinstance(c, dict):
-                child = etree.Element(c["tag"], **c.get("attrs", {}))
-                _set_node_content(child, c)
-                node.append(child)
+                child = etree.SubElement(node, c["tag"], c.get("attrs", {}))
+                frame[2] = child
+                stack.append([child, iter(c["content"]), None])
+                break
+            last_child = frame[2]
+            if last_child is None:
+                node.text = "%s%s" % (node.text or "", c or "")
             else:
-                node_children = node.getchildren()
-                if len(node_children) == 0:
-                    node.text = "%s%s" % (node.text or "", c or "")
-                else:
-                    node_children[-1].tail = "%s%s" % (node_children[-1].tail or "", c or "")
-
-    dom = etree.Element(tree["tag"], **tree.get("attrs", {}))
-    _set_node_content(dom, tree)
+                last_child.tail = "%s%s" % (last_child.tail or "", c or "")
+        else:
+            stack.pop()
 
     return dom
 
 
-def etree_dom_to_tree(dom, strip_text=False):
-    """A mapping representation of a etree node. """
-    return {
-        "tag": dom.tag,
-        "attrs": copy.deepcopy(dom.attrib),
-        "text": dom.text.strip() if (dom.text and strip_text) else dom.text,
-        "tail": dom.tail.strip() if (dom.tail and strip_text) else dom.tail,
-        "content": [etree_dom_to_tree(elt, strip_text) for elt in dom.iterchildren()]
+def etree_dom_to_tree(dom, strip_text=False, flat=False):
+    """A mapping representation of a etree node.
+
+    The nodes having the same attributes share the keys and values (not the `attrs' dicts).
+
+    With `flat', a columnar representation is returned instead of nested mappings
+    (see etree_dom_to_flat_tree()).
+    """
+    if flat:
+        return etree_dom_to_flat_tree(dom, strip_text)
+
+    get_attrs = _shared_attrs_getter()
+
+    def _node(elt):
+        return {
+            "tag": elt.tag,
+            "attrs": get_attrs(elt),
+            "text": elt.text.strip() if (elt.text and strip_text) else elt.text,
+            "tail": elt.tail.strip() if (elt.tail and strip_text) else elt.tail,
+            "content": []
+        }
+
+    tree = _node(dom)
+    stack = [(dom, tree)]
+    while stack:
+        elt, node = stack.pop()
+        for child in elt.iterchildren():
+            child_node = _node(child)
+            node["content"].append(child_node)
+            stack.append((child, child_node))
+    return tree
+
+
+def etree_dom_to_flat_tree(dom, strip_text=False):
+    """A columnar representation of a etree node.
+
+    Nodes are listed in document order and `parents' holds the index of
+    the parent of each node (-1 for the root):
+
+    flat_tree = {
+        "tags": ["Root", "module", ...],
+        "attrs": [{...}, {...}, ...],
+        "texts": [None, "foo", ...],
+        "tails": [None, "bar", ...],
+        "parents": [-1, 0, ...],
     }
+    """
+    get_attrs = _shared_attrs_getter()
+    tags, attrs, texts, tails, parents = [], [], [], [], []
+    indexes = {}
+    for elt in dom.iter():
+        parent = elt.getparent() if elt is not dom else None
+        indexes[elt] = len(tags)
+        tags.append(elt.tag)
+        attrs.append(get_attrs(elt))
+        texts.append(elt.text.strip() if (elt.text and strip_text) else elt.text)
+        tails.append(elt.tail.strip() if (elt.tail and strip_text) else elt.tail)
+        parents.append(indexes[parent] if parent is not None else -1)
+    return {"tags": tags, "attrs": attrs, "texts": texts, "tails": tails, "parents": parents}
+
+
+def flat_tree_to_etree_dom(flat_tree):
+    """The reverse of etree_dom_to_flat_tree(). """
+    nodes = []
+    for tag, attrs, text, tail, parent in zip(flat_tree["tags"], flat_tree["attrs"], flat_tree["texts"],
+                                              flat_tree["tails"], flat_tree["parents"]):
+        if parent == -1:
+            node = etree.Element(tag, attrs)
+        else:
+            node = etree.SubElement(nodes[parent], tag, attrs)
+        node.text = text
+        node.tail = tail
+        nodes.append(node)
+    return nodes[0]
+
+
+def _shared_attrs_getter():
+    """Return a function giving the attributes of an element as a new dict,
+    the keys and values being the same string instances for the same attributes. """
+    shared_items = {}
+
+    def get_attrs(elt):
+        items = tuple(elt.attrib.items())
+        return dict(shared_items.setdefault(items, items))
+    return get_attrs
 
 
 def deepcopy_element_as(element, tag):
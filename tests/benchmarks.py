@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""Benchmarks of the package operations on the IDML files of the regression tests.
+
+    $ python benchmarks.py [benchmark ...]
+
+Wall times are the best of a few runs.
+"""
+
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join('..', 'src'))
+
+# pylint: disable=wrong-import-position
+from lxml import etree
+from simple_idml import SERIALIZATIONS
+from simple_idml.components import Story, XMLElement
+from simple_idml.idml import IDMLPackage
+from simple_idml.utils import etree_dom_to_tree, flat_tree_to_etree_dom, get_xml_parser, tree_to_etree_dom
+
+IDMLFILES_DIR = os.path.join('regressiontests', 'IDML')
+CPU_COUNT = os.cpu_count() or 1
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def best_time(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(func):
+    """The peak of the memory allocated by Python (not libxml2) while calling `func'. """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def report(label, value, unit="ms"):
+    print(f"  {label:<72} {value:>10.2f} {unit}")
+
+
+def make_tree(nodes, width=100):
+    """A tree of `nodes' elements: modules of `width' children in mixed content. """
+    attrs = {"simpleidml-setcontent": "true", "class": "paragraph"}
+    modules = []
+    for i in range(nodes // (width + 1)):
+        content = []
+        for j in range(width):
+            content += [f"text {j}", {"tag": "span", "attrs": dict(attrs), "content": [f"child {j}"]}]
+        modules.append({"tag": "module", "attrs": {"id": str(i)}, "content": content})
+    return {"tag": "Root", "attrs": {}, "content": modules}
+
+
+@benchmark
+def trees():
+    """tree_to_etree_dom() and etree_dom_to_tree() (nested and flat): linear in the nodes. """
+    for nodes, width in ((10000, 100), (100000, 100), (100000, 10000)):
+        tree = make_tree(nodes, width)
+        dom = tree_to_etree_dom(tree)
+        flat_tree = etree_dom_to_tree(dom, flat=True)
+        count = sum(1 for _ in dom.iter())
+        for label, func in (("tree_to_etree_dom", lambda: tree_to_etree_dom(tree)),
+                            ("etree_dom_to_tree", lambda: etree_dom_to_tree(dom)),
+                            ("etree_dom_to_tree(flat=True)", lambda: etree_dom_to_tree(dom, flat=True)),
+                            ("flat_tree_to_etree_dom", lambda: flat_tree_to_etree_dom(flat_tree))):
+            elapsed = best_time(func, repeat=3)
+            report(f"{label}, {count} nodes, {width} children per node", elapsed * 1e6 / count, "us/node")
+
+
+@benchmark
+def set_contents():
+    """Cost per slot of the set_contents() path (id index) and of set_element_content(), by story size. """
+    slots = 100
+    tmp_dir = mkdtemp()
+    try:
+        for size in (100, 1000, 10000):
+            story = Story.create(None, f"u{size}", "di2", "article", tmp_dir)
+            story_node = story.dom.find("Story")
+            for i in range(size):
+                story_node.append(etree.XML(
+                    f'<XMLElement Self="di2i{i}" MarkupTag="XMLTag/slot">'
+                    '<CharacterStyleRange AppliedCharacterStyle="CharacterStyle/$ID/[No character style]">'
+                    f'<Content>text {i}</Content></CharacterStyleRange></XMLElement>'))
+            element_ids = [f"di2i{i}" for i in range(0, size, size // slots)]
+
+            xml_elements = story.get_xml_elements_by_id()
+
+            def set_indexed():
+                for element_id in element_ids:
+                    story.set_xml_element_content(XMLElement(xml_elements[element_id]), "new text")
+
+            def set_one_by_one():
+                for element_id in element_ids:
+                    story.set_element_content(element_id, "new text")
+
+            # The index is built once per story by set_contents().
+            report(f"id index of the story, {size} XMLElements", best_time(story.get_xml_elements_by_id) * 1e6,
+                   "us")
+            report(f"set_contents() path, {size} XMLElements", best_time(set_indexed) * 1e6 / slots, "us/slot")
+            report(f"set_element_content(), {size} XMLElements", best_time(set_one_by_one) * 1e6 / slots,
+                   "us/slot")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@benchmark
+def parsing():
+    """Parsing a component from its zip member stream with a shared parser, or from a bytestring. """
+    with IDMLPackage(os.path.join(IDMLFILES_DIR, "interview.idml")) as idml_file:
+        name = max(idml_file.contentfile_namelist(), key=lambda name: idml_file.getinfo(name).file_size)
+
+        def from_stream():
+            idml_file.get_idml_xml_file(name).get_dom()
+
+        def from_bytestring():
+            etree.fromstring(idml_file.read(name), etree.XMLParser(huge_tree=True))
+
+        report(f"{name}, size of the member", idml_file.getinfo(name).file_size / 1024, "kB")
+        report("stream, peak Python memory", peak_memory(from_stream) / 1024, "kB")
+        report("bytestring, peak Python memory", peak_memory(from_bytestring) / 1024, "kB")
+        report("stream, time", best_time(from_stream) * 1000)
+        report("bytestring, time", best_time(from_bytestring) * 1000)
+    report("new XMLParser(), time", best_time(lambda: etree.XMLParser(huge_tree=True), repeat=1000) * 1e6, "us")
+    report("get_xml_parser(), time", best_time(lambda: get_xml_parser(huge_tree=True), repeat=1000) * 1e6, "us")
+
+
+@benchmark
+def serialization():
+    """Size and time of the serialization of the Stories and Spreads, by serialization policy. """
+    for name in ("interview.idml", "magazineA-courrier-des-lecteurs-3pages.idml"):
+        for policy in SERIALIZATIONS:
+            with IDMLPackage(os.path.join(IDMLFILES_DIR, name), serialization=policy) as idml_file:
+                components = [idml_file.get_idml_xml_file(member) for member in idml_file.contentfile_namelist()]
+                size = sum(len(component.tostring()) for component in components)
+                elapsed = best_time(lambda: [component.tostring() for component in components])
+            report(f"{name}, {policy}, size", size / 1024, "kB")
+            report(f"{name}, {policy}, time", elapsed * 1000)
+
+
+@benchmark
+def preload():
+    """Opening a package and parsing all its Stories and Spreads: lazily or preloaded by workers. """
+    def run(filename, preload, workers):
+        with IDMLPackage(filename, preload=preload, workers=workers) as idml_file:
+            for name in idml_file.contentfile_namelist():
+                idml_file.get_idml_xml_file(name).dom  # pylint: disable=expression-not-assigned
+
+    for name in ("interview.idml", "magazineA-courrier-des-lecteurs-3pages.idml"):
+        filename = os.path.join(IDMLFILES_DIR, name)
+        report(f"{name}, lazy", best_time(lambda: run(filename, None, None)) * 1000)
+        for workers in sorted({1, CPU_COUNT}):
+            report(f"{name}, preload='all', workers={workers}",
+                   best_time(lambda: run(filename, "all", workers)) * 1000)
+
+
+@benchmark
+def prefix():
+    """IDMLPackage.prefix() with one worker and one per CPU. """
+    def run(filename, workers):
+        with IDMLPackage(filename) as idml_file:
+            with idml_file.prefix("FOO", workers=workers):
+                pass
+
+    tmp_dir = mkdtemp()
+    try:
+        for name in ("interview.idml", "magazineA-courrier-des-lecteurs-3pages.idml"):
+            filename = os.path.join(tmp_dir, name)
+            shutil.copy2(os.path.join(IDMLFILES_DIR, name), filename)
+            for workers in sorted({1, CPU_COUNT}):
+                report(f"{name}, workers={workers}", best_time(lambda: run(filename, workers)) * 1000)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        print(f"{name}: {BENCHMARKS[name].__doc__.strip()}")
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
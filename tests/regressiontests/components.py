@@ -410,6 +410,20 @@ class StyleTestCase(unittest.TestCase):
             'tail': '',
             'text': ''
         })
+        self.assertIs(style.get_style_node_by_name("CharacterStyle/bold"), style_node)
+        self.assertRaises(IndexError, style.get_style_node_by_name, "CharacterStyle/foo")
+        idml_file.close()
+
+    def test_character_style_nodes(self):
+        idml_file = IDMLPackage(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"), mode="r")
+        style = Style(idml_file)
+        self.assertEqual(set(style.character_style_nodes.keys()), {
+            'CharacterStyle/$ID/[No character style]',
+            'CharacterStyle/bold',
+            'CharacterStyle/italique',
+            'CharacterStyle/sup',
+        })
+        idml_file.close()
 
 
 class StyleMappingTestCase(unittest.TestCase):
@@ -42,6 +42,19 @@ class ExtrasTestCase(unittest.TestCase):
         self.assertRaises(IOError, create_idml_package_from_dir, src_dir + "-foo", destination.replace(".idml",
                                                                                                        "-2.idml"))
 
+    def test_create_package_from_dir_compressed(self):
+        src_dir = os.path.join(IDMLFILES_DIR, "article-1photo")
+        destination = os.path.join(OUTPUT_DIR, "article-1photo.idml")
+        create_idml_package_from_dir(src_dir, destination, compresslevel=9, workers=2)
+        with zipfile.ZipFile(destination, 'r') as package:
+            self.assertIsNone(package.testzip())
+            # The mimetype is stored and first (UCF).
+            self.assertEqual(package.infolist()[0].filename, "mimetype")
+            self.assertEqual(package.getinfo("mimetype").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(package.getinfo("designmap.xml").compress_type, zipfile.ZIP_DEFLATED)
+            with open(os.path.join(src_dir, "designmap.xml"), "rb") as fobj:
+                self.assertEqual(package.read("designmap.xml"), fobj.read())
+
 
 def suite():
     suite = unittest.TestLoader().loadTestsFromTestCase(ExtrasTestCase)
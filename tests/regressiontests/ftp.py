@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import ftplib
+import mock
+import os
+import threading
+import time
+import unittest
+import zipfile
+from ftplib import FTP
+from io import BytesIO
+from simple_idml import ftp
+
+CURRENT_DIR = os.path.dirname(__file__)
+IDMLFILES_DIR = os.path.join(CURRENT_DIR, "IDML")
+
+FTP_PARAMS = {
+    'auth': ("ftp.foo.org", "user_account", "s3cret-pa55word"),
+    'passive': False,
+}
+
+
+class FTPTestCase(unittest.TestCase):
+    def setUp(self):
+        super(FTPTestCase, self).setUp()
+        self.ftp_patcher = mock.patch('ftplib.FTP', side_effect=lambda *args: mock.MagicMock(spec=FTP))
+        self.ftp_mock = self.ftp_patcher.start()
+        self.pool = ftp.ftp_pool = ftp.FTPPool(max_size=2, idle_timeout=60)
+
+    def tearDown(self):
+        self.ftp_patcher.stop()
+        ftp.ftp_pool = ftp.FTPPool()
+
+    def test_pool(self):
+        # One connection for the whole package upload.
+        ftp.unpack_archive(os.path.join(IDMLFILES_DIR, "package-pirate.zip"), FTP_PARAMS, "/workdir", workers=1)
+        ftp.unlink("/workdir/foo.txt", FTP_PARAMS)
+        ftp.mkdir_unique("/workdir", FTP_PARAMS)
+        self.assertEqual(self.ftp_mock.call_count, 1)
+        connection = self.pool.idle_connections[("ftp.foo.org", "user_account", "s3cret-pa55word")][0][0]
+        self.assertTrue(connection.storbinary.called)
+        connection.voidcmd.assert_called_with("NOOP")
+        connection.quit.assert_not_called()
+
+        # A refused command keeps the connection, a broken one is replaced.
+        connection.delete.side_effect = ftplib.error_perm("550 No such file")
+        self.assertRaises(ftplib.error_perm, ftp.unlink, "/workdir/foo.txt", FTP_PARAMS)
+        self.assertEqual(self.ftp_mock.call_count, 1)
+        connection.voidcmd.side_effect = EOFError
+        ftp.unlink("/workdir/foo.txt", FTP_PARAMS)
+        self.assertEqual(self.ftp_mock.call_count, 2)
+
+        # Bounded size.
+        with self.pool.connection(FTP_PARAMS) as ftp_1, self.pool.connection(FTP_PARAMS) as ftp_2:
+            self.assertIsNot(ftp_1, ftp_2)
+            self.assertEqual(self.pool.open_connections[tuple(FTP_PARAMS["auth"])], 2)
+
+        # Idle timeout.
+        self.pool.idle_timeout = 0
+        time.sleep(0.01)
+        ftp.unlink("/workdir/foo.txt", FTP_PARAMS)
+        self.assertEqual(self.ftp_mock.call_count, 4)
+        self.assertEqual(self.pool.open_connections[tuple(FTP_PARAMS["auth"])], 1)
+
+        self.pool.clear()
+        self.assertEqual(self.pool.open_connections[tuple(FTP_PARAMS["auth"])], 0)
+
+    def test_unpack_archive(self):
+        commands = []
+        in_flight = {"current": 0, "max": 0}
+        in_flight_lock = threading.Lock()
+        # Each upload waits (a while) for the other one to be in flight too.
+        overlap = threading.Barrier(2, timeout=5)
+
+        def storbinary(command, fobj):
+            with in_flight_lock:
+                in_flight["current"] += 1
+                in_flight["max"] = max(in_flight["max"], in_flight["current"])
+            try:
+                overlap.wait()
+            except threading.BrokenBarrierError:
+                pass
+            commands.append((command, len(fobj.read())))
+            with in_flight_lock:
+                in_flight["current"] -= 1
+
+        def get_connection(*args):
+            connection = mock.MagicMock(spec=FTP)
+            connection.mkd.side_effect = lambda dirname: commands.append((f"MKD {dirname}", None))
+            connection.storbinary.side_effect = storbinary
+            return connection
+
+        self.ftp_mock.side_effect = get_connection
+        report = {}
+        ftp.unpack_archive(os.path.join(IDMLFILES_DIR, "package-pirate.zip"), FTP_PARAMS, "/workdir",
+                           workers=2, report=report)
+        # Directories first, members in parallel.
+        self.assertEqual(commands[:2], [("MKD /workdir/package-pirate", None),
+                                        ("MKD /workdir/package-pirate/Links", None)])
+        self.assertEqual(sorted(commands[2:]), [
+            ("STOR /workdir/package-pirate/4-pages-2.indd", 774144),
+            ("STOR /workdir/package-pirate/Links/pirate-juillet-2020.jpg", 1025380),
+        ])
+        # The uploads overlapped, with never more connections than workers.
+        self.assertEqual(in_flight["max"], 2)
+        self.assertLessEqual(self.ftp_mock.call_count, 2)
+        self.assertEqual(report["files"], 2)
+        self.assertEqual(report["bytes"], 1799524)
+        self.assertTrue(report["throughput"] > 0)
+
+    def test_zip_dir(self):
+        for mlsd in (True, False):
+            server = FTPServerMock(mlsd)
+            server.files = {
+                "/workdir/package/4-pages.indd": b"INDD" * 1000,
+                "/workdir/package/Links/photo.jpg": b"JPEG" * 1000,
+                "/workdir/package/Fonts/font.otf": b"OTF",
+            }
+            server.dirs = {"/workdir", "/workdir/package", "/workdir/package/Links",
+                           "/workdir/package/Fonts", "/workdir/package/Empty"}
+            self.ftp_mock.side_effect = lambda *args: server
+            ftp.zip_dir("/workdir/package", "/workdir/package.zip", FTP_PARAMS, workers=2)
+
+            self.assertEqual(set(server.files), {"/workdir/package.zip"})
+            self.assertEqual(server.dirs, {"/workdir"})
+            with zipfile.ZipFile(BytesIO(server.files["/workdir/package.zip"])) as zfile:
+                self.assertIsNone(zfile.testzip())
+                self.assertEqual(sorted(zfile.namelist()), [
+                    "package/", "package/4-pages.indd", "package/Empty/", "package/Fonts/",
+                    "package/Fonts/font.otf", "package/Links/", "package/Links/photo.jpg"
+                ])
+                self.assertEqual(zfile.read("package/Links/photo.jpg"), b"JPEG" * 1000)
+            self.pool.clear()
+
+        # The large files are streamed in the zip instead of being downloaded ahead.
+        server = FTPServerMock()
+        server.files = {
+            "/workdir/package/4-pages.indd": b"INDD" * 10000,
+            "/workdir/package/font.otf": b"OTF",
+        }
+        server.dirs = {"/workdir", "/workdir/package"}
+        self.ftp_mock.side_effect = lambda *args: server
+        buffered = []
+        writestr = zipfile.ZipFile.writestr
+
+        def writestr_mock(zfile, zinfo, data, *args, **kwargs):
+            if not zinfo.is_dir():
+                buffered.append(zinfo.filename)
+            return writestr(zfile, zinfo, data, *args, **kwargs)
+
+        zip_buf = BytesIO()
+        with mock.patch.object(zipfile.ZipFile, "writestr", autospec=True, side_effect=writestr_mock):
+            tree = list(ftp.walk_ftp(server, "/workdir/package"))
+            ftp.zip_ftp_tree(tree, zip_buf, FTP_PARAMS, workers=2, max_buffered_size=1000)
+        self.assertEqual(buffered, ["package/font.otf"])
+        with zipfile.ZipFile(zip_buf) as zfile:
+            self.assertIsNone(zfile.testzip())
+            self.assertEqual(zfile.read("package/4-pages.indd"), b"INDD" * 10000)
+            self.assertEqual(zfile.getinfo("package/4-pages.indd").date_time, (2020, 11, 24, 9, 3, 0))
+        self.pool.clear()
+
+    def test_memory_transport(self):
+        transport = ftp.MemoryTransport()
+        working_dir = transport.mkdir_unique("/workdir")
+        self.assertEqual(transport.dirs, {working_dir})
+        transport.unpack_archive(os.path.join(IDMLFILES_DIR, "package-pirate.zip"), working_dir)
+        self.assertEqual(len(transport.read(f"{working_dir}/package-pirate/Links/pirate-juillet-2020.jpg")), 1025380)
+
+        transport.zip_dir(f"{working_dir}/package-pirate", f"{working_dir}/package-pirate.zip")
+        with zipfile.ZipFile(BytesIO(transport.read(f"{working_dir}/package-pirate.zip"))) as zfile:
+            self.assertIsNone(zfile.testzip())
+            self.assertEqual(sorted(zfile.namelist()), [
+                "package-pirate/", "package-pirate/4-pages-2.indd", "package-pirate/Links/",
+                "package-pirate/Links/pirate-juillet-2020.jpg"
+            ])
+        self.assertEqual([filename for filename in transport.files if "__MACOSX" not in filename],
+                         [f"{working_dir}/package-pirate.zip"])
+
+        transport.unlink(f"{working_dir}/package-pirate.zip")
+        self.assertRaises(FileNotFoundError, transport.read, f"{working_dir}/package-pirate.zip")
+        transport.rmtree(working_dir)
+        self.assertEqual(transport.dirs, set())
+
+    def test_memory_transport_async(self):
+        transport = ftp.MemoryTransport()
+
+        async def zip_working_dir():
+            working_dir = await transport.mkdir_unique_async("/workdir")
+            await transport.write_async(f"{working_dir}/package/4-pages.indd", b"INDD")
+            await transport.zip_dir_async(f"{working_dir}/package", f"{working_dir}/package.zip")
+            return await transport.read_async(f"{working_dir}/package.zip")
+
+        with zipfile.ZipFile(BytesIO(asyncio.run(zip_working_dir()))) as zfile:
+            self.assertEqual(sorted(zfile.namelist()), ["package/", "package/4-pages.indd"])
+            self.assertEqual(zfile.read("package/4-pages.indd"), b"INDD")
+        self.assertEqual(len(transport.files), 1)
+
+    def test_get_transport(self):
+        self.assertIs(ftp.get_transport(), ftp.local_transport)
+        self.assertIsInstance(ftp.get_transport(FTP_PARAMS), ftp.FTPTransport)
+        transport = ftp.MemoryTransport()
+        self.assertIs(ftp.get_transport(FTP_PARAMS, transport), transport)
+
+    def test_not_pooled(self):
+        ftp_params = dict(FTP_PARAMS, pooled=False)
+        ftp.unlink("/workdir/foo.txt", ftp_params)
+        ftp.unlink("/workdir/bar.txt", ftp_params)
+        self.assertEqual(self.ftp_mock.call_count, 2)
+        self.assertEqual(self.pool.idle_connections, {})
+
+
+class FTPServerMock(object):
+    """An in-memory FTP server. """
+
+    def __init__(self, mlsd=True):
+        self.support_mlsd = mlsd
+        self.files = {}
+        self.dirs = set()
+        self.working_dir = "/"
+        self.lock = threading.Lock()
+
+    def __call__(self, *args):
+        return self
+
+    def set_pasv(self, val):
+        pass
+
+    def voidcmd(self, cmd):
+        pass
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def pwd(self):
+        return self.working_dir
+
+    def cwd(self, path):
+        if path not in self.dirs and path != "/":
+            raise ftplib.error_perm("550 No such directory")
+
+    def list_names(self, path):
+        names = set()
+        for name in list(self.files) + list(self.dirs):
+            if os.path.dirname(name) == path:
+                names.add(name)
+        return sorted(names)
+
+    def mlsd(self, path, facts=None):
+        if not self.support_mlsd:
+            raise ftplib.error_perm("500 Unknown command")
+        for name in self.list_names(path):
+            if name in self.dirs:
+                yield os.path.basename(name), {"type": "dir", "modify": "20201124090300"}
+            else:
+                yield os.path.basename(name), {"type": "file", "size": str(len(self.files[name])),
+                                               "modify": "20201124090300"}
+
+    def nlst(self, path):
+        return self.list_names(path)
+
+    def retrbinary(self, cmd, callback, blocksize=1024):
+        data = self.files[cmd[5:]]
+        for i in range(0, len(data), blocksize):
+            callback(data[i:i + blocksize])
+
+    def storbinary(self, cmd, fobj):
+        with self.lock:
+            self.files[cmd[5:]] = fobj.read()
+
+    def delete(self, filename):
+        with self.lock:
+            del self.files[filename]
+
+    def rmd(self, dirname):
+        with self.lock:
+            if self.list_names(dirname):
+                raise ftplib.error_perm("550 Directory not empty")
+            self.dirs.remove(dirname)
+
+
+def suite():
+    suite = unittest.TestLoader().loadTestsFromTestCase(FTPTestCase)
+    return suite
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
 import datetime
 import glob
+import mock
 import os
 import shutil
+import time
 import unittest
+import zipfile
 from tempfile import gettempdir, mkdtemp
 from lxml import etree
+from simple_idml.components import IDMLXMLFile, Spread, Story
 from simple_idml.idml import IDMLPackage
 from simple_idml.test import SimpleTestCase
 from simple_idml.utils import etree_dom_to_tree
@@ -246,6 +251,139 @@ class IdmlTestCase(SimpleTestCase):
 </Root>
 """)
 
+    def test_preload(self):
+        idml_filename = os.path.join(IDMLFILES_DIR, "4-pages.idml")
+        with IDMLPackage(idml_filename) as idml_file:
+            expected_xml = idml_file.export_xml()
+
+        with IDMLPackage(idml_filename, preload="spreads", workers=2) as idml_file:
+            self.assertEqual(sorted(idml_file.preloaded_doms), idml_file.spreads)
+
+        with IDMLPackage(idml_filename, preload="all", workers=2) as idml_file:
+            self.assertEqual(sorted(idml_file.preloaded_doms), sorted(idml_file.contentfile_namelist()))
+            story_name = idml_file.stories[0]
+            preloaded_dom = idml_file.preloaded_doms[story_name]
+            # The preloaded DOM is given once.
+            self.assertIs(idml_file.get_idml_xml_file(story_name).dom, preloaded_dom)
+            self.assertIsNot(idml_file.get_idml_xml_file(story_name).dom, preloaded_dom)
+            self.assertMultiLineEqual(idml_file.export_xml(), expected_xml)
+
+        # Preloading does not use the parsing budget.
+        with IDMLPackage(idml_filename, preload="all", workers=2, max_parsed_components=1) as idml_file:
+            self.assertEqual(len(idml_file.preloaded_doms), len(idml_file.contentfile_namelist()))
+            self.assertEqual(len(idml_file.parsed_components), 0)
+            story = idml_file.get_idml_xml_file(idml_file.stories[0])
+            preloaded_dom = idml_file.preloaded_doms[story.name]
+            self.assertIs(story.dom, preloaded_dom)
+            self.assertEqual(list(idml_file.parsed_components.values()), [story])
+            self.assertEqual(idml_file.evictions, 0)
+
+        with IDMLPackage(idml_filename) as idml_file:
+            self.assertRaises(ValueError, idml_file.preload, "masterspreads")
+
+    def test_parsing_budget(self):
+        idml_filename = os.path.join(IDMLFILES_DIR, "4-pages.idml")
+        with IDMLPackage(idml_filename, max_parsed_components=2) as idml_file:
+            spreads = idml_file.spreads_objects
+            doms = [spread.dom for spread in spreads]
+            # The least recently used is evicted.
+            self.assertEqual(idml_file.evictions, 1)
+            self.assertEqual(len(idml_file.parsed_components), 2)
+            self.assertIsNone(spreads[0]._dom)
+            # And parsed again when needed.
+            self.assertIsNot(spreads[0].dom, doms[0])
+            self.assertEqual(spreads[0].dom.get("DOMVersion"), doms[0].get("DOMVersion"))
+            self.assertEqual(idml_file.reparses, 1)
+            self.assertEqual(idml_file.evictions, 2)
+
+        # A DOM changed in place is evicted only when written.
+        working_copy_path = os.path.join(OUTPUT_DIR, "4-pages")
+        with IDMLPackage(idml_filename, max_parsed_components=1) as idml_file:
+            idml_file.extractall(working_copy_path)
+            spreads = [Spread(idml_file, name, working_copy_path) for name in idml_file.spreads]
+            spreads[0].dom.set("Foo", "bar")
+            spreads[1].dom
+            self.assertEqual(idml_file.evictions, 0)
+            self.assertTrue(spreads[0].modified)
+            spreads[0].synchronize()
+            spreads[2].dom
+            # spreads[1], unchanged, then spreads[0].
+            self.assertEqual(idml_file.evictions, 2)
+            self.assertIsNone(spreads[0]._dom)
+            self.assertEqual(spreads[0].dom.get("Foo"), "bar")
+
+            # Dirty components are never evicted.
+            idml_file.shared_components = {}
+            idml_file.shared_components[spreads[1].name] = spreads[1]
+            spreads[1].synchronize()
+            self.assertTrue(spreads[1].dirty)
+            spreads[0].dom
+            self.assertIsNotNone(spreads[1]._dom)
+            idml_file.shared_components = None
+
+        # An unchanged DOM is evicted, whatever the access.
+        with IDMLPackage(idml_filename, max_parsed_components=1) as idml_file:
+            spreads = [Spread(idml_file, name, working_copy_path) for name in idml_file.spreads]
+            spreads[0].get_dom(readonly=True)
+            spreads[1].dom
+            self.assertIsNone(spreads[0]._dom)
+            spreads[2].get_dom(readonly=True)
+            self.assertFalse(spreads[1].modified)
+            self.assertIsNone(spreads[1]._dom)
+            self.assertEqual(idml_file.evictions, 2)
+
+        # A DOM modified in a package without working copy is kept.
+        with IDMLPackage(idml_filename, max_parsed_components=1) as idml_file:
+            element_id = idml_file.xml_structure.xpath("/Root/article[1]/Story/title")[0].get("Self")
+            story = idml_file.get_story_object_by_xpath("/Root/article[1]/Story/title")
+            story.set_element_content(element_id, "Steve Zissou")
+            other_story = idml_file.get_story_object_by_xpath("/Root/article[1]")
+            self.assertNotEqual(other_story.name, story.name)
+            other_story.dom
+            self.assertIsNotNone(story._dom)
+            self.assertEqual(story.get_element_by_id(element_id).get_element_content_nodes()[0].text,
+                             "Steve Zissou")
+
+            # Also when changed in place, without mark_modified().
+            spread = idml_file.spreads_objects[0]
+            spread.dom.set("Foo", "bar")
+            for other_spread in idml_file.spreads_objects[1:]:
+                other_spread.dom
+            self.assertIsNotNone(spread._dom)
+            self.assertTrue(spread.modified)
+            self.assertEqual(spread.dom.get("Foo"), "bar")
+
+    def test_parsing_budget_threads(self):
+        # The threads share the LRU of the parsed components.
+        idml_filename = os.path.join(IDMLFILES_DIR, "magazineA-courrier-des-lecteurs-3pages.idml")
+        is_over_parsing_budget = IDMLPackage._is_over_parsing_budget
+
+        def slow_is_over_parsing_budget(idml_package):
+            # Let the other threads run in the middle of the evictions.
+            time.sleep(0.0001)
+            return is_over_parsing_budget(idml_package)
+
+        with IDMLPackage(idml_filename, max_parsed_components=2) as idml_file, \
+                mock.patch.object(IDMLPackage, "_is_over_parsing_budget", slow_is_over_parsing_budget):
+            names = idml_file.contentfile_namelist() * 20
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                tags = set(executor.map(lambda name: idml_file.get_idml_xml_file(name).dom.tag, names))
+            self.assertEqual(len(tags), 2)
+            self.assertEqual(len(idml_file.parsed_components), 2)
+            self.assertEqual(idml_file.parsed_bytes,
+                             sum(component.parsed_bytes for component in idml_file.parsed_components.values()))
+            self.assertGreater(idml_file.evictions, 0)
+
+        # prefix() in threads with a budget.
+        contents = []
+        for max_parsed_components in (None, 1):
+            prefixed_filename = os.path.join(OUTPUT_DIR, f"magazineA-budget-{max_parsed_components}.idml")
+            shutil.copy2(idml_filename, prefixed_filename)
+            with IDMLPackage(prefixed_filename, max_parsed_components=max_parsed_components) as idml_file:
+                with idml_file.prefix("FOO", workers=4) as prefixed_f:
+                    contents.append({name: prefixed_f.read(name) for name in prefixed_f.namelist()})
+        self.assertEqual(contents[0], contents[1])
+
     def test_get_story_by_xpath(self):
         idml_filename = os.path.join(IDMLFILES_DIR, "4-pages.idml")
         with IDMLPackage(idml_filename) as idml_file:
@@ -271,6 +409,37 @@ class IdmlTestCase(SimpleTestCase):
 
             shutil.rmtree(idml_working_copy)
 
+    def test_manifest(self):
+        idml_filename = os.path.join(IDMLFILES_DIR, "4-pages.idml")
+        with IDMLPackage(idml_filename) as idml_file:
+            self.assertEqual(idml_file.manifest["Spreads/Spread_ub6.xml"], "spread")
+            self.assertEqual(idml_file.manifest["Stories/Story_u102.xml"], "story")
+            self.assertEqual(idml_file.manifest["MasterSpreads/MasterSpread_uca.xml"], "masterspread")
+            self.assertEqual(idml_file.manifest["Resources/Styles.xml"], "resource")
+            self.assertEqual(idml_file.manifest["designmap.xml"], "other")
+            self.assertTrue(idml_file.has_story("u102"))
+            self.assertFalse(idml_file.has_story("ub6"))
+
+            # The working copy is walked once.
+            idml_working_copy = mkdtemp()
+            idml_file.extractall(idml_working_copy)
+            idml_file.working_copy_path = idml_working_copy
+            idml_file.init_lazy_references()
+            with mock.patch.object(IDMLPackage, "_walk_working_copy", autospec=True,
+                                   side_effect=IDMLPackage._walk_working_copy) as walk_mock:
+                self.assertEqual(set(idml_file.namelist()), set(zipfile.ZipFile(idml_filename).namelist()))
+                Story.create(idml_file, "uFOO", "di2i10", "article", idml_working_copy)
+                idml_file.init_lazy_references()
+                self.assertIn("Stories/Story_uFOO.xml", idml_file.stories)
+                self.assertTrue(idml_file.has_story("uFOO"))
+                idml_file.rename_members({"Stories/Story_uFOO.xml": "Stories/Story_uBAR.xml"})
+                self.assertFalse(idml_file.has_story("uFOO"))
+                self.assertTrue(idml_file.has_story("uBAR"))
+            self.assertEqual(walk_mock.call_count, 1)
+
+            idml_file.working_copy_path = None
+            shutil.rmtree(idml_working_copy)
+
     def test_contentfile_namelist(self):
         idml_filename = os.path.join(IDMLFILES_DIR, "4-pages.idml")
         with IDMLPackage(idml_filename) as idml_file:
@@ -649,6 +818,229 @@ class IdmlTestCase(SimpleTestCase):
 </Root>
 """)
 
+    def test_import_xml_from_file(self):
+        # A path or a binary file object is parsed incrementally.
+        for xml_name, idml_name, at in (("article-1photo_import-xml-nested-tags.xml",
+                                         "article-1photo_import-xml.idml", "/Root/module[1]"),
+                                        ("interview_en.xml", "interview.idml", "/Root/dossier")):
+            xml_filename = os.path.join(XML_DIR, xml_name)
+            shutil.copy2(os.path.join(IDMLFILES_DIR, idml_name), os.path.join(OUTPUT_DIR, "from-string.idml"))
+            with IDMLPackage(os.path.join(OUTPUT_DIR, "from-string.idml")) as idml_file,\
+                 open(xml_filename, "r") as xml_file:
+                with idml_file.import_xml(xml_file.read(), at=at) as f:
+                    expected_xml = f.export_xml()
+
+            shutil.copy2(os.path.join(IDMLFILES_DIR, idml_name), os.path.join(OUTPUT_DIR, "from-path.idml"))
+            with IDMLPackage(os.path.join(OUTPUT_DIR, "from-path.idml")) as idml_file:
+                with idml_file.import_xml(xml_filename, at=at) as f:
+                    self.assertMultiLineEqual(f.export_xml(), expected_xml)
+
+            shutil.copy2(os.path.join(IDMLFILES_DIR, idml_name), os.path.join(OUTPUT_DIR, "from-fobj.idml"))
+            with IDMLPackage(os.path.join(OUTPUT_DIR, "from-fobj.idml")) as idml_file,\
+                 open(xml_filename, "rb") as xml_file:
+                with idml_file.import_xml(xml_file, at=at) as f:
+                    self.assertMultiLineEqual(f.export_xml(), expected_xml)
+
+            # A string starting with a byte order mark is not a path.
+            shutil.copy2(os.path.join(IDMLFILES_DIR, idml_name), os.path.join(OUTPUT_DIR, "from-bom-string.idml"))
+            with IDMLPackage(os.path.join(OUTPUT_DIR, "from-bom-string.idml")) as idml_file,\
+                 open(xml_filename, "r") as xml_file:
+                with idml_file.import_xml(f"\ufeff{xml_file.read()}", at=at) as f:
+                    self.assertMultiLineEqual(f.export_xml(), expected_xml)
+
+    def test_import_tree(self):
+        # export -> import round-trip without serialization.
+        with IDMLPackage(os.path.join(IDMLFILES_DIR, "article-1photo_imported-nested-xml.idml")) as idml_file:
+            tree = idml_file.export_as_tree()
+            expected_xml = idml_file.export_xml()
+
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_import-tree.idml"))
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-tree.idml")) as idml_file:
+            with idml_file.import_tree(tree, at="/Root") as f:
+                self.assertMultiLineEqual(f.export_xml(), expected_xml)
+
+        # An etree.Element is accepted as well.
+        xml_filename = os.path.join(XML_DIR, "article-1photo_import-xml-nested-tags.xml")
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_import-xml.idml"))
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-xml.idml")) as idml_file,\
+             open(xml_filename, "r") as xml_file:
+            with idml_file.import_xml(xml_file.read(), at="/Root/module[1]") as f:
+                expected_xml = f.export_xml()
+
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_import-element.idml"))
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-element.idml")) as idml_file:
+            source_node = etree.parse(xml_filename).getroot()
+            with idml_file.import_tree(source_node, at="/Root/module[1]") as f:
+                self.assertMultiLineEqual(f.export_xml(), expected_xml)
+
+    def test_import_xmls(self):
+        sources = [
+            ("<headline>A new headline</headline>", "/Root/module/headline"),
+            ("<article>Hello <bold>world</bold> and <italique>friends</italique></article>",
+             "/Root/module/Story/article"),
+            ("<informations>Some <sup>info</sup></informations>", "/Root/module/Story/informations"),
+        ]
+        # Sequential imports.
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_import-xml-sequential.idml"))
+        idml_file = IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-xml-sequential.idml"))
+        for xml, at in sources:
+            new_idml_file = idml_file.import_xml(xml, at)
+            idml_file.close()
+            idml_file = new_idml_file
+        expected_xml = idml_file.export_xml()
+        idml_file.close()
+
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_import-xmls.idml"))
+        written = []
+        write = IDMLXMLFile.write
+
+        def write_mock(idml_xml_file):
+            written.append(idml_xml_file.name)
+            write(idml_xml_file)
+
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-xmls.idml")) as idml_file,\
+             mock.patch.object(IDMLXMLFile, "write", autospec=True, side_effect=write_mock):
+            with idml_file.import_xmls(sources) as f:
+                self.assertMultiLineEqual(f.export_xml(), expected_xml)
+        # Each file is written once.
+        self.assertEqual(sorted(written), ["Stories/Story_ue1.xml", "Stories/Story_uf7.xml"])
+
+        # The first import would remove the destination of the second one.
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-xmls.idml")) as idml_file:
+            with self.assertRaises(ValueError) as context:
+                idml_file.import_xmls([
+                    ("<module><headline>A module headline</headline></module>", "/Root/module"),
+                    ("<headline>A new headline</headline>", "/Root/module/headline"),
+                ])
+            self.assertIn("/Root/module/headline", str(context.exception))
+
+    def test_set_contents(self):
+        # Same as importing XML elements without attributes nor children.
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_import-xml-sequential.idml"))
+        idml_file = IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-xml-sequential.idml"))
+        for xml, at in (("<headline>A new headline</headline>", "/Root/module/headline"),
+                        ("<article>Hello world</article>", "/Root/module/Story/article"),
+                        ("<informations>Some informations</informations>", "/Root/module/Story/informations")):
+            new_idml_file = idml_file.import_xml(xml, at)
+            idml_file.close()
+            idml_file = new_idml_file
+        expected_xml = idml_file.export_xml()
+        idml_file.close()
+
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_set-contents.idml"))
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_set-contents.idml")) as idml_file:
+            informations_id = idml_file.xml_structure.xpath("/Root/module/Story/informations")[0].get("Self")
+            with idml_file.set_contents({
+                "/Root/module/headline": "A new headline",
+                "/Root/module/Story/article": "Hello world",
+                informations_id: "Some informations",
+            }) as f:
+                self.assertMultiLineEqual(f.export_xml(), expected_xml)
+
+    def test_set_attributes_bulk(self):
+        attributes = {
+            "/Root/module/main_picture": {"href": "file:///steve.jpg", "credits": "Jack"},
+            "/Root/module/headline": {"foo": "bar"},
+            "/Root/module/Story/article": {"foo": "baz", "lang": "en"},
+        }
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_import-xml-sequential.idml"))
+        idml_file = IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_import-xml-sequential.idml"))
+        for xpath, items in attributes.items():
+            new_idml_file = idml_file.set_attributes(xpath, items)
+            idml_file.close()
+            idml_file = new_idml_file
+        expected_xml = idml_file.export_xml()
+        idml_file.close()
+
+        written = []
+        write = IDMLXMLFile.write
+
+        def write_mock(idml_xml_file):
+            written.append(idml_xml_file.name)
+            write(idml_xml_file)
+
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_set-attributes-bulk.idml"))
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_set-attributes-bulk.idml")) as idml_file,\
+             mock.patch.object(IDMLXMLFile, "write", autospec=True, side_effect=write_mock):
+            with idml_file.set_attributes_bulk(attributes) as f:
+                self.assertMultiLineEqual(f.export_xml(), expected_xml)
+                self.assertEqual(f.get_spread_elem_by_xpath("/Root/module/main_picture").find("Link")
+                                 .get("LinkResourceURI"), "file:///steve.jpg")
+        # Each file is written once.
+        self.assertEqual(sorted(written), ["Spreads/Spread_ud8.xml", "Stories/Story_u10d.xml",
+                                           "Stories/Story_ue1.xml", "Stories/Story_uf7.xml"])
+
+        # The page item of an element is removed once.
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_set-attributes-bulk.idml")) as idml_file:
+            element_id = idml_file.xml_structure.xpath("/Root/module/main_picture")[0].get("Self")
+            with self.assertRaises(IndexError) as context:
+                idml_file.set_attributes_bulk({
+                    "/Root/module/main_picture": {"href": ""},
+                    "/Root/module[1]/main_picture": {"href": ""},
+                })
+            self.assertIn(element_id, str(context.exception))
+
+    def test_relink(self):
+        old_uri = ("file:/Users/stan/Dropbox/Projets/Slashdev/SimpleIDML/repos/git/simpleidml/"
+                   "tests/regressiontests/IDML/media/default.jpg")
+        new_uri = f"file:{IDMLFILES_DIR}/media/default.jpg"
+        shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo.idml"),
+                     os.path.join(OUTPUT_DIR, "article-1photo_relink.idml"))
+        with IDMLPackage(os.path.join(OUTPUT_DIR, "article-1photo_relink.idml")) as idml_file:
+            # A prefix map.
+            report = {}
+            with idml_file.relink({
+                "file:/Users/stan/": "file:/nowhere/",
+                "file:/Users/stan/Dropbox/Projets/Slashdev/SimpleIDML/repos/git/simpleidml/tests/regressiontests/IDML/":
+                f"file:{IDMLFILES_DIR}/",
+            }, check_files=True, report=report) as relinked:
+                self.assertEqual(report, {
+                    "changed": [("Spreads/Spread_ud6.xml", "u21a", old_uri, new_uri)],
+                    "missing": [],
+                })
+                self.assertEqual(relinked.spreads_objects[0].dom.find(".//Link").get("LinkResourceURI"), new_uri)
+
+                # A callable.
+                report = {}
+                with relinked.relink(lambda uri: uri.replace("default.jpg", "nothere.jpg"),
+                                     check_files=True, workers=2, report=report):
+                    self.assertEqual(report, {
+                        "changed": [("Spreads/Spread_ud6.xml", "u21a", new_uri,
+                                     f"file:{IDMLFILES_DIR}/media/nothere.jpg")],
+                        "missing": [("Spreads/Spread_ud6.xml", "u21a", f"file:{IDMLFILES_DIR}/media/nothere.jpg")],
+                    })
+
+    def test_serialization(self):
+        self.assertRaises(ValueError, IDMLPackage, os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"),
+                          serialization="ugly")
+
+        stories = {}
+        for serialization in ("pretty", "compact", "preserve"):
+            idml_filename = os.path.join(OUTPUT_DIR, f"article-1photo_import-xml-{serialization}.idml")
+            shutil.copy2(os.path.join(IDMLFILES_DIR, "article-1photo_import-xml.idml"), idml_filename)
+            with IDMLPackage(idml_filename, serialization=serialization) as idml_file:
+                with idml_file.set_contents({"/Root/module/headline": "A new headline"}) as f:
+                    self.assertEqual(f.serialization, serialization)
+                    stories[serialization] = f.read("Stories/Story_ue1.xml").decode("utf-8")
+                    self.assertEqual(len(f.export_xml().splitlines()) == 1, serialization != "pretty")
+
+        # The formatting of the file is kept by "pretty" and "preserve".
+        self.assertIn('DOMVersion="10.0">\n\t<Story Self="ue1"', stories["pretty"])
+        self.assertIn('DOMVersion="10.0">\n\t<Story Self="ue1"', stories["preserve"])
+        self.assertIn('DOMVersion="10.0"><Story Self="ue1"', stories["compact"])
+        self.assertEqual(len(stories["compact"].splitlines()), 2)  # The XML declaration and the rest.
+        for story in stories.values():
+            self.assertIn("<Content>A new headline</Content>", story)
+
     def test_import_pdf(self):
         shutil.copy2(os.path.join(IDMLFILES_DIR, "page-9modules.idml"),
                      os.path.join(OUTPUT_DIR, "page-9modules.idml"))
@@ -893,6 +1285,20 @@ class IdmlTestCase(SimpleTestCase):
             with idml_file.prefix("FOO") as prefixed_f:
                 pass
 
+    def test_prefix_workers(self):
+        # The result does not depend on the number of threads and is the same as
+        # the sequential implementation (the expected package).
+        with IDMLPackage(os.path.join(IDMLFILES_DIR, "magazineA-courrier-des-lecteurs-3pages-prefixed-FOO.idml")) \
+                as expected_f:
+            expected_contents = {name: expected_f.read(name) for name in expected_f.namelist()}
+        for workers in (1, 4):
+            idml_filename = os.path.join(OUTPUT_DIR, f"magazineA-courrier-des-lecteurs-3pages-{workers}.idml")
+            shutil.copy2(os.path.join(IDMLFILES_DIR, "magazineA-courrier-des-lecteurs-3pages.idml"), idml_filename)
+            with IDMLPackage(idml_filename) as idml_file:
+                with idml_file.prefix("FOO", workers=workers) as prefixed_f:
+                    self.assertEqual({name: prefixed_f.read(name) for name in prefixed_f.namelist()},
+                                     expected_contents)
+
     def test_is_prefixed(self):
         with IDMLPackage(os.path.join(IDMLFILES_DIR, "4-pages.idml")) as idml_file:
             self.assertFalse(idml_file.is_prefixed("foo"))
@@ -1,15 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import glob
 import json
 import mock
 import os
 import shutil
+import time
 import unittest
 import zipfile
 from io import BytesIO
+from tempfile import mkdtemp
 from simple_idml.indesign import indesign
 from suds.client import ServiceSelector
+from urllib.error import URLError
 from urllib.request import OpenerDirector
 
 CURRENT_DIR = os.path.dirname(__file__)
@@ -33,6 +37,8 @@ class InDesignTestCase(unittest.TestCase):
         self.runscript_mock = self.runscript_patcher.start()
         self.runscript_mock.side_effect = ServiceSelectorMock
 
+        indesign.client_pool.clear()
+
         for f in glob.glob(os.path.join(CLIENT_WORKDIR, "*")):
             if os.path.isdir(f):
                 shutil.rmtree(f)
@@ -44,6 +50,7 @@ class InDesignTestCase(unittest.TestCase):
     def tearDown(self):
         self.u2open_patcher.stop()
         self.runscript_patcher.stop()
+        ServiceSelectorMock.transport = indesign.ftp.local_transport
 
     def test_save_as(self):
         responses = indesign.save_as(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
@@ -103,6 +110,36 @@ class InDesignTestCase(unittest.TestCase):
             'script': 'export.jsx'
         })
 
+    def test_save_as_multi(self):
+        with mock.patch.object(indesign.ftp.local_transport, "copy",
+                               wraps=indesign.ftp.local_transport.copy) as copy_mock:
+            responses = indesign.save_as_multi(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                                               [{"fmt": "pdf",
+                                                 "params": {"colorSpace": "CMYK"}},
+                                                {"fmt": "jpeg"},
+                                                {"fmt": "zip"}],
+                                               "http://url-to-indesign-server:8080",
+                                               CLIENT_WORKDIR, SERVER_WORKDIR,
+                                               indesign_server_path_style="posix")
+        # The source file and a single script (and its include).
+        self.assertEqual(copy_mock.call_count, 3)
+        self.assertEqual(set(responses), {"pdf", "jpeg", "zip"})
+        self.assertEqual(json.loads(responses["pdf"].decode('utf-8')),
+                         {"extra_params": {"colorSpace": "CMYK"},
+                          "script": "save_as_multi.jsx", "dst": "4-pagesTMP.pdf"})
+        self.assertEqual(json.loads(responses["jpeg"].decode('utf-8')),
+                         {"extra_params": {}, "script": "save_as_multi.jsx", "dst": "4-pagesTMP.jpeg"})
+        zip_buf = BytesIO()
+        zip_buf.write(responses["zip"])
+        self.assertTrue(zipfile.is_zipfile(zip_buf))
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+
+        with self.assertRaises(ValueError):
+            indesign.save_as_multi(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                                   [{"fmt": "pdf"}, {"fmt": "pdf"}],
+                                   "http://url-to-indesign-server:8080",
+                                   CLIENT_WORKDIR, SERVER_WORKDIR)
+
     def test_close_all_documents(self):
         script = indesign.CloseAllDocuments("http://url-to-indesign-server:8080",
                                             CLIENT_WORKDIR, SERVER_WORKDIR,
@@ -116,10 +153,240 @@ class InDesignTestCase(unittest.TestCase):
         script.execute()
         self.assertTrue(self.runscript_mock.called)
 
+    def test_client_pool(self):
+        # One WSDL download and parsing for all the formats.
+        with mock.patch.object(indesign, "Client", wraps=indesign.Client) as client_mock:
+            indesign.save_as(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                             [{"fmt": "pdf"}, {"fmt": "jpeg"}, {"fmt": "indd"}],
+                             "http://url-to-indesign-server:8080",
+                             CLIENT_WORKDIR, SERVER_WORKDIR,
+                             indesign_server_path_style="posix")
+            self.assertEqual(client_mock.call_count, 1)
+        self.assertEqual(len(indesign.client_pool.idle_clients["http://url-to-indesign-server:8080"]), 1)
+
+        # A client is checked out by one thread at a time.
+        client_1 = indesign.client_pool.checkout("http://url-to-indesign-server:8080")
+        client_2 = indesign.client_pool.checkout("http://url-to-indesign-server:8080")
+        self.assertIsNot(client_1, client_2)
+        self.assertEqual(client_2.options.location, "http://url-to-indesign-server:8080")
+        indesign.client_pool.checkin("http://url-to-indesign-server:8080", client_1)
+        indesign.client_pool.checkin("http://url-to-indesign-server:8080", client_2)
+        self.assertIs(indesign.client_pool.checkout("http://url-to-indesign-server:8080"), client_2)
+
+    def test_dispatcher(self):
+        endpoints = [
+            {"server_url": "http://broken-indesign-server:8080",
+             "client_workdir": CLIENT_WORKDIR, "server_workdir": SERVER_WORKDIR},
+            {"server_url": "http://url-to-indesign-server:8080",
+             "client_workdir": CLIENT_WORKDIR, "server_workdir": SERVER_WORKDIR},
+            {"server_url": "http://url-to-indesign-server:8081",
+             "client_workdir": CLIENT_WORKDIR, "server_workdir": SERVER_WORKDIR},
+        ]
+        jobs = [(os.path.join(IDMLFILES_DIR, "4-pages.idml"), [{"fmt": fmt}])
+                for fmt in ("indd", "pdf", "jpeg", "idml", "pdf", "indd")]
+        with indesign.Dispatcher(endpoints, max_jobs=2, max_failures=1, retry_after=60) as dispatcher:
+            responses = dispatcher.map(indesign.save_as, jobs)
+            stats = dispatcher.get_stats()
+
+        self.assertEqual([json.loads(response[0].decode('utf-8'))["dst"] for response in responses],
+                         ["4-pagesTMP.indd", "4-pagesTMP.pdf", "4-pagesTMP.jpeg",
+                          "4-pagesTMP.idml", "4-pagesTMP.pdf", "4-pagesTMP.indd"])
+        # The broken server is put aside after its first failure.
+        self.assertTrue(stats[0]["disabled"])
+        self.assertTrue(1 <= stats[0]["errors"] <= 2)
+        self.assertEqual(stats[0]["jobs"], stats[0]["errors"])
+        self.assertEqual(stats[1]["jobs"] + stats[2]["jobs"], 6)
+        self.assertEqual(stats[1]["errors"] + stats[2]["errors"], 0)
+        self.assertIsNotNone(stats[1]["latency"])
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+
+        # Script errors are not retried.
+        with indesign.Dispatcher(endpoints[1:]) as dispatcher:
+            with mock.patch.object(indesign, "save_as",
+                                   side_effect=indesign.exceptions.InDesignSoapException({}, {})) as save_as_mock:
+                future = dispatcher.submit(indesign.save_as, "4-pages.idml", [{"fmt": "indd"}])
+                self.assertRaises(indesign.exceptions.InDesignSoapException, future.result)
+            self.assertEqual(save_as_mock.call_count, 1)
+            self.assertEqual(sum(stat["errors"] for stat in dispatcher.get_stats()), 1)
+
+        # Nor the interruptions, which are not failures of the endpoint.
+        with indesign.Dispatcher(endpoints[1:]) as dispatcher:
+            with mock.patch.object(indesign, "save_as", side_effect=KeyboardInterrupt) as save_as_mock:
+                future = dispatcher.submit(indesign.save_as, "4-pages.idml", [{"fmt": "indd"}])
+                self.assertRaises(KeyboardInterrupt, future.result)
+            self.assertEqual(save_as_mock.call_count, 1)
+            self.assertEqual([(stat["running"], stat["jobs"], stat["errors"]) for stat in dispatcher.get_stats()],
+                             [(0, 0, 0), (0, 0, 0)])
+
+    def test_save_as_async(self):
+        async def convert():
+            return await asyncio.gather(
+                indesign.save_as_async(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                                       [{"fmt": "indd"}, {"fmt": "jpeg"}],
+                                       "http://url-to-indesign-server:8080",
+                                       CLIENT_WORKDIR, SERVER_WORKDIR),
+                indesign.save_as_multi_async(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                                             [{"fmt": "pdf"}],
+                                             "http://url-to-indesign-server:8080",
+                                             CLIENT_WORKDIR, SERVER_WORKDIR),
+                indesign.export_package_as_async(os.path.join(IDMLFILES_DIR, "package-pirate.zip"),
+                                                 [{"fmt": "pdf"}],
+                                                 "http://url-to-indesign-server:8080",
+                                                 CLIENT_WORKDIR, SERVER_WORKDIR),
+            )
+
+        save_as_responses, save_as_multi_response, export_responses = asyncio.run(convert())
+        self.assertEqual([json.loads(response.decode('utf-8'))["dst"] for response in save_as_responses],
+                         ["4-pagesTMP.indd", "4-pagesTMP.jpeg"])
+        self.assertEqual(json.loads(save_as_multi_response["pdf"].decode('utf-8'))["dst"], "4-pagesTMP.pdf")
+        self.assertEqual(json.loads(export_responses[0].decode('utf-8'))["dst"], "4-pages-2TMP.pdf")
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+
+    def test_save_as_async_cancel(self):
+        save_as = indesign._save_as
+
+        def slow_save_as(*args):
+            time.sleep(0.2)
+            return save_as(*args)
+
+        async def convert():
+            task = asyncio.create_task(
+                indesign.save_as_async(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                                       [{"fmt": "indd"}],
+                                       "http://url-to-indesign-server:8080",
+                                       CLIENT_WORKDIR, SERVER_WORKDIR)
+            )
+            await asyncio.sleep(0.1)
+            self.assertEqual(len(os.listdir(CLIENT_WORKDIR)), 1)
+            task.cancel()
+            await task
+
+        with mock.patch.object(indesign, "_save_as", side_effect=slow_save_as):
+            self.assertRaises(asyncio.CancelledError, asyncio.run, convert())
+        # The working directory is removed.
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+
+    def test_save_as_transport(self):
+        transport = indesign.ftp.MemoryTransport()
+        ServiceSelectorMock.transport = transport
+        responses = indesign.save_as(os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                                     [{"fmt": "indd"}, {"fmt": "pdf"}],
+                                     "http://url-to-indesign-server:8080",
+                                     CLIENT_WORKDIR, SERVER_WORKDIR,
+                                     transport=transport)
+        self.assertEqual([json.loads(response.decode('utf-8'))["dst"] for response in responses],
+                         ["4-pagesTMP.indd", "4-pagesTMP.pdf"])
+        # Nothing written on disk and the working directory is cleaned.
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+        self.assertEqual(transport.files, {})
+        self.assertEqual(transport.dirs, set())
+
+    def test_result_cache(self):
+        cache_dir = mkdtemp()
+        cache = indesign.ResultCache(cache_dir)
+        src_path = os.path.join(IDMLFILES_DIR, "4-pages.idml")
+
+        def convert(formats_options):
+            return cache.convert(indesign.save_as, src_path, formats_options,
+                                 "http://url-to-indesign-server:8080", CLIENT_WORKDIR, SERVER_WORKDIR)
+
+        with mock.patch.object(indesign, "_save_as", wraps=indesign._save_as) as save_as_mock:
+            responses = convert([{"fmt": "pdf", "params": {"colorSpace": "CMYK", "cropMarks": "1"}},
+                                 {"fmt": "jpeg"}])
+            self.assertEqual(save_as_mock.call_count, 2)
+
+            # Same parameters in another order, no SOAP call.
+            cached_responses = convert([{"fmt": "pdf", "params": {"cropMarks": "1", "colorSpace": "CMYK"}},
+                                        {"fmt": "jpeg"}])
+            self.assertEqual(save_as_mock.call_count, 2)
+            self.assertEqual(cached_responses, responses)
+
+            # Only the missing formats are converted.
+            cached_responses = convert([{"fmt": "jpeg"}, {"fmt": "pdf"}])
+            self.assertEqual(save_as_mock.call_count, 3)
+            self.assertEqual(cached_responses[0], responses[1])
+            self.assertEqual(save_as_mock.call_args[0][1], {"fmt": "pdf"})
+
+        self.assertEqual(cache.get_stats(), {"hits": 3, "misses": 3, "evictions": 0,
+                                             "entries": 3, "size": sum(map(len, responses + cached_responses[1:]))})
+
+        # Persistent and LRU.
+        cache = indesign.ResultCache(cache_dir, max_size=cache.size - 1)
+        self.assertEqual(cache.get_stats()["entries"], 2)
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+        cache.invalidate(src_path, [{"fmt": "jpeg"}])
+        self.assertEqual(cache.get_stats()["entries"], 1)
+        cache.invalidate(src_path)
+        self.assertEqual(cache.get_stats()["entries"], 0)
+        self.assertEqual(os.listdir(cache_dir), [])
+        shutil.rmtree(cache_dir)
+
+    def test_save_as_pipeline(self):
+        sources = [os.path.join(IDMLFILES_DIR, "4-pages.idml"),
+                   os.path.join(IDMLFILES_DIR, "missing.idml"),
+                   os.path.join(IDMLFILES_DIR, "package-pirate.zip")]
+        results = list(indesign.save_as_pipeline(sources, [{"fmt": "indd"}, {"fmt": "pdf"}],
+                                                 "http://url-to-indesign-server:8080",
+                                                 CLIENT_WORKDIR, SERVER_WORKDIR))
+        # In order, a failed job does not stop the others.
+        self.assertEqual([src_path for src_path, responses, error in results], sources)
+        self.assertEqual([json.loads(response.decode('utf-8'))["dst"] for response in results[0][1]],
+                         ["4-pagesTMP.indd", "4-pagesTMP.pdf"])
+        self.assertIsNone(results[0][2])
+        self.assertIsNone(results[1][1])
+        self.assertIsInstance(results[1][2], FileNotFoundError)
+        self.assertEqual([json.loads(response.decode('utf-8'))["dst"] for response in results[2][1]],
+                         ["4-pages-2TMP.indd", "4-pages-2TMP.pdf"])
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+
+        # The next source is staged while the server renders the current one.
+        events = []
+        copy = indesign.ftp.local_transport.copy
+        call_runscript = indesign.InDesignSoapScript.call_runscript
+
+        def record_copy(src_filename, dst_filename, *args, **kwargs):
+            if os.path.splitext(src_filename)[1] not in (".jsx", ".jsxinc"):
+                events.append(("stage", os.path.basename(dst_filename)))
+            return copy(src_filename, dst_filename, *args, **kwargs)
+
+        def slow_call_runscript(script):
+            time.sleep(0.1)
+            events.append(("render", script.src_name))
+            return call_runscript(script)
+
+        sources = [os.path.join(IDMLFILES_DIR, name) for name in ("4-pages.idml", "article-1photo.idml")]
+        with mock.patch.object(indesign.ftp.local_transport, "copy", side_effect=record_copy), \
+                mock.patch.object(indesign.InDesignSoapScript, "call_runscript", slow_call_runscript):
+            results = list(indesign.save_as_pipeline(sources, [{"fmt": "indd"}],
+                                                     "http://url-to-indesign-server:8080",
+                                                     CLIENT_WORKDIR, SERVER_WORKDIR))
+        self.assertEqual([error for src_path, responses, error in results], [None, None])
+        self.assertLess(events.index(("stage", "article-1photo.idml")), events.index(("render", "4-pages.idml")))
+
+        # Stopping early still removes the working directories.
+        pipeline = indesign.save_as_pipeline(sources * 3, [{"fmt": "indd"}],
+                                             "http://url-to-indesign-server:8080",
+                                             CLIENT_WORKDIR, SERVER_WORKDIR, queue_size=1)
+        src_path, responses, error = next(pipeline)
+        self.assertEqual(src_path, sources[0])
+        pipeline.close()
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+
+        # An interruption stops the pipeline instead of failing a job.
+        with mock.patch.object(indesign.InDesignSoapScript, "call_runscript", side_effect=KeyboardInterrupt):
+            pipeline = indesign.save_as_pipeline(sources * 3, [{"fmt": "indd"}],
+                                                 "http://url-to-indesign-server:8080",
+                                                 CLIENT_WORKDIR, SERVER_WORKDIR)
+            self.assertRaises(KeyboardInterrupt, list, pipeline)
+        self.assertEqual(os.listdir(CLIENT_WORKDIR), [])
+
 
 class OpenerDirectorMock(OpenerDirector):
     def open(self, fullurl=None, data=None, timeout=None):
         url = fullurl.get_full_url()
+        if url.startswith("http://broken-indesign-server"):
+            raise URLError("Connection refused")
         if os.path.basename(url) == 'service?wsdl':
             return open(os.path.join(SOAP_DIR, 'indesign-service.xml'), "r")
 
@@ -130,6 +397,9 @@ class SoapResponse(object):
 
 
 class ServiceSelectorMock(ServiceSelector):
+    # Where InDesign Server writes.
+    transport = indesign.ftp.local_transport
+
     def RunScript(self, params):
         script = os.path.basename(params['scriptFile'])
         script_args = dict([(p["name"], p["value"]) for p in params['scriptArgs']])
@@ -143,11 +413,26 @@ class ServiceSelectorMock(ServiceSelector):
                 dst_filename = "%s.zip" % dst_filename
 
             # Create the file in workdir and write something testable in it.
-            with open(dst_filename, "w+") as f:
+            json_str = json.dumps({'script': script,
+                                   'dst': os.path.basename(dst_filename),
+                                   'extra_params': extra_params})
+            self.transport.write(dst_filename, json_str.encode('utf-8'))
+        elif script == indesign.SaveAsMulti.javascript_basename:
+            script_args.pop("source")
+            formats = script_args.pop("formats").split(",")
+            for fmt in formats:
+                dst_filename = script_args.pop("destination_%s" % fmt)
+                extra_params = dict([(k.split("_", 1)[1], v) for k, v in script_args.items()
+                                     if k.startswith("%s_" % fmt)])
+                if fmt == "zip":
+                    os.mkdir(dst_filename)
+                    with open(os.path.join(dst_filename, "package.indd"), "w+") as f:
+                        f.write("")
+                    continue
                 json_str = json.dumps({'script': script,
                                        'dst': os.path.basename(dst_filename),
                                        'extra_params': extra_params})
-                f.write(str(json_str))
+                self.transport.write(dst_filename, json_str.encode('utf-8'))
         elif script == indesign.CloseAllDocuments.javascript_basename:
             pass
 
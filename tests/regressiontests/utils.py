@@ -62,6 +62,49 @@ class UtilsTestCase(unittest.TestCase):
         self.assertFalse(str_is_prefixed("foo", "bar"))
         self.assertTrue(str_is_prefixed("foo", "foobar"))
 
+    def test_get_xml_parser(self):
+        import threading
+        from simple_idml.utils import get_xml_parser
+        parser = get_xml_parser(huge_tree=True)
+        self.assertIs(get_xml_parser(huge_tree=True), parser)
+        self.assertIsNot(get_xml_parser(huge_tree=True, remove_blank_text=True), parser)
+
+        # One parser per thread.
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(get_xml_parser(huge_tree=True)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(parsers[0], parser)
+
+    def test_zip_members(self):
+        import os
+        import tempfile
+        import zipfile
+        from simple_idml.utils import zip_members
+        tmp_dir = tempfile.mkdtemp()
+        members = []
+        for i in range(10):
+            filename = os.path.join(tmp_dir, f"file{i}.txt")
+            with open(filename, "w") as fobj:
+                fobj.write("Steve Zissou " * 100 * i)
+            members.append((filename, f"dir/file{i}.txt"))
+        zip_filename = os.path.join(tmp_dir, "files.zip")
+        with zipfile.ZipFile(zip_filename, "w") as zfile:
+            zip_members(zfile, members, compresslevel=6, stored=("dir/file1.txt",), workers=3)
+        with zipfile.ZipFile(zip_filename) as zfile:
+            self.assertIsNone(zfile.testzip())
+            self.assertEqual(zfile.namelist(), [f"dir/file{i}.txt" for i in range(10)])
+            self.assertEqual(zfile.getinfo("dir/file1.txt").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zfile.getinfo("dir/file2.txt").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(zfile.read("dir/file9.txt"), b"Steve Zissou " * 900)
+
+    def test_uri_to_path(self):
+        from simple_idml.utils import uri_to_path
+        self.assertEqual(uri_to_path("file:/Users/stan/media/default.jpg"), "/Users/stan/media/default.jpg")
+        self.assertEqual(uri_to_path("file:///Users/stan/media/my%20image.jpg"), "/Users/stan/media/my image.jpg")
+        self.assertEqual(uri_to_path("file:../../IDML/media/bouboune.jpg"), "../../IDML/media/bouboune.jpg")
+        self.assertIsNone(uri_to_path("http://example.com/default.jpg"))
+
     def test_tree_to_etree_dom(self):
         from simple_idml.utils import tree_to_etree_dom
         tree = {
@@ -176,6 +219,44 @@ class UtilsTestCase(unittest.TestCase):
             'text': ''
         })
 
+    def test_etree_dom_to_tree_deep(self):
+        from simple_idml.utils import etree_dom_to_tree, tree_to_etree_dom
+
+        # Deeper than the recursion limit.
+        tree = {'tag': 'Root', 'attrs': {}, 'content': []}
+        node = tree
+        for i in range(5000):
+            child = {'tag': 'bold', 'attrs': {'foo': 'bar'}, 'content': ['text']}
+            node['content'].extend([child, 'tail'])
+            node = child
+        dom = tree_to_etree_dom(tree)
+        self.assertEqual(len(list(dom.iter())), 5001)
+
+        tree = etree_dom_to_tree(dom)
+        self.assertEqual(tree['tag'], 'Root')
+        self.assertEqual(tree['content'][0]['content'][0]['attrs'], {'foo': 'bar'})
+        self.assertEqual(tree['content'][0]['tail'], 'tail')
+        # Same attributes, same strings but not the same dict.
+        attrs, child_attrs = tree['content'][0]['attrs'], tree['content'][0]['content'][0]['attrs']
+        self.assertIs(attrs['foo'], child_attrs['foo'])
+        attrs['foo'] = 'baz'
+        self.assertEqual(child_attrs, {'foo': 'bar'})
+
+    def test_etree_dom_to_flat_tree(self):
+        from simple_idml.utils import etree_dom_to_tree, flat_tree_to_etree_dom
+        xml = ('<XMLTag Self="XMLTag/advertise" Name="advertise"><Properties>'
+               '<TagColor type="enumeration">Green</TagColor>tail</Properties></XMLTag>')
+        dom = etree.fromstring(xml)
+        flat_tree = etree_dom_to_tree(dom, flat=True)
+        self.assertEqual(flat_tree, {
+            'tags': ['XMLTag', 'Properties', 'TagColor'],
+            'attrs': [{'Name': 'advertise', 'Self': 'XMLTag/advertise'}, {}, {'type': 'enumeration'}],
+            'texts': [None, None, 'Green'],
+            'tails': [None, None, 'tail'],
+            'parents': [-1, 0, 1],
+        })
+        self.assertEqual(etree.tostring(flat_tree_to_etree_dom(flat_tree)).decode("utf-8"), xml)
+
     def test_proxy_class(self):
         from simple_idml.utils import Proxy
 